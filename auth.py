@@ -1,33 +1,30 @@
-from fastapi import FastAPI, HTTPException, Header, Body
+from fastapi import APIRouter, HTTPException, Header, Body
 from pydantic import BaseModel
 import requests
-import firebase_admin
-from firebase_admin import credentials, firestore, auth
+from firebase_admin import auth
 from typing import Optional
-import os
-import uvicorn
 from datetime import datetime
-from fastapi.middleware.cors import CORSMiddleware
 from datetime import timezone
-from dotenv import load_dotenv
-load_dotenv()
+from service import service_app
+from settings import get_settings
+from counters import add_to_counts
+from rollups import add_to_rollups
+from candidate_aging import add_to_aging
+from facet_catalog import add_to_facets
+from search_index import candidate_index
+from matching import match_engine
+from candidate_changes import add_tombstones
 
-app = FastAPI()
+router = APIRouter()
 
-API_KEY = os.getenv("FIREBASE_WEB_API_KEY")
+API_KEY = get_settings().firebase_web_api_key
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Handlers here block on the Identity Toolkit REST API and run in the
+# threadpool, so they keep using the sync client
+from datastore import sync_db as db, transactional
 
-
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+# Firestore caps a write batch at 500 operations
+BATCH_LIMIT = 500
 
 class UserSignUp(BaseModel):
     email: str
@@ -38,7 +35,7 @@ class UserSignIn(BaseModel):
     password: str
 
 
-@app.post("/signup")
+@router.post("/signup")
 def sign_up(user: UserSignUp):
     # Firebase sign-up endpoint
     sign_up_url = f'https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={API_KEY}'
@@ -69,7 +66,7 @@ def sign_up(user: UserSignUp):
     
 
 
-@app.post("/signin")
+@router.post("/signin")
 def sign_in(user: UserSignIn):
     url = f'https://identitytoolkit.googleapis.com/v1/accounts:signInWithPassword?key={API_KEY}'
     payload = {
@@ -135,7 +132,7 @@ class UserProfileUpdate(BaseModel):
 class PasswordResetRequest(BaseModel):
     email: str
 
-@app.post("/password-reset")
+@router.post("/password-reset")
 def send_password_reset_email(request: PasswordResetRequest):
     url = f'https://identitytoolkit.googleapis.com/v1/accounts:sendOobCode?key={API_KEY}'
     payload = {
@@ -149,7 +146,15 @@ def send_password_reset_email(request: PasswordResetRequest):
         raise HTTPException(status_code=response.status_code, detail=response.json())
     
 
-@app.post("/user/profile")
+@transactional
+def create_profile_in_transaction(transaction, user_ref, user_data):
+    """Write the profile; only a first-time profile counts as a new recruiter."""
+    snapshot = user_ref.get(transaction=transaction)
+    transaction.set(user_ref, user_data)
+    if not snapshot.exists:
+        add_to_counts(db, transaction, recruiters=1)
+
+@router.post("/user/profile")
 def create_user_profile(profile: UserProfileCreate, token: str):
     try:
         decoded_token = auth.verify_id_token(token)
@@ -185,7 +190,7 @@ def create_user_profile(profile: UserProfileCreate, token: str):
             "profile_pic_url": profile.profile_pic_url or None,
         }
 
-        user_ref.set(user_data)
+        create_profile_in_transaction(db.transaction(), user_ref, user_data)
         return {"message": "User profile created successfully."}
 
     except Exception as e:
@@ -193,7 +198,7 @@ def create_user_profile(profile: UserProfileCreate, token: str):
 
 
 
-@app.patch("/user/profile/update")
+@router.patch("/user/profile/update")
 def update_user_profile(token: str = Header(...), update: dict = Body(...)):
     """name, city, country, phone_number, email, 
             bio, tags = [], profile_pic_url"""
@@ -232,7 +237,7 @@ def update_user_profile(token: str = Header(...), update: dict = Body(...)):
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/logout")
+@router.post("/logout")
 def logout(token: str):
     try:
         # Verify the ID token and get the user UID
@@ -248,7 +253,7 @@ def logout(token: str):
         raise HTTPException(status_code=400, detail=str(e))
 
 
-@app.post("/verify-token")
+@router.post("/verify-token")
 def verify_token(token: str = Header(None)):
     try:
         # Decode and verify the Firebase ID token (disable IAM check)
@@ -271,8 +276,36 @@ def verify_token(token: str = Header(None)):
 
 from fastapi import Depends
 
-@app.delete("/user/delete")
+@transactional
+def delete_profile_in_transaction(transaction, user_ref):
+    snapshot = user_ref.get(transaction=transaction)
+    if snapshot.exists:
+        transaction.delete(user_ref)
+        add_to_counts(db, transaction, recruiters=-1)
+
+# Candidate fields the aggregates need to take a deleted candidate out
+CANDIDATE_AGGREGATE_FIELDS = ["created_at", "role", "city", "country", "skills", "sold", "experience", "ctc"]
+
+def remove_candidate_aggregates(writer, candidates):
+    add_to_counts(db, writer, candidates=-len(candidates))
+    add_to_rollups(db, writer, [(candidate, -1) for candidate in candidates])
+    add_to_aging(db, writer, [(candidate, -1) for candidate in candidates])
+    add_to_facets(db, writer, [(candidate, -1) for candidate in candidates])
+
+@transactional
+def delete_unsold_in_transaction(transaction, candidate_ref) -> bool:
+    """Delete a candidate if it still exists unsold, taking it out of the aggregates as it is now."""
+    snapshot = candidate_ref.get(transaction=transaction)
+    if not snapshot.exists or snapshot.to_dict().get("sold"):
+        return False
+    transaction.delete(candidate_ref)
+    add_tombstones(db, transaction, [candidate_ref.id])
+    remove_candidate_aggregates(transaction, [snapshot.to_dict()])
+    return True
+
+@router.delete("/user/delete")
 def delete_user_account(token: str = Header(...)):
+    from google.api_core.exceptions import FailedPrecondition, NotFound
     try:
         # Verify Firebase token
         decoded_token = auth.verify_id_token(token)
@@ -282,15 +315,40 @@ def delete_user_account(token: str = Header(...)):
         auth.delete_user(uid)
 
         # Delete user profile from Firestore
-        db.collection("recruiters").document(uid).delete()
+        delete_profile_in_transaction(db.transaction(), db.collection("recruiters").document(uid))
 
         # Query candidates where created_by == uid and sold == False
         candidates_ref = db.collection("candidates")
-        query = candidates_ref.where("created_by", "==", uid).where("sold", "==", False).stream()
-
-        # Delete each matching candidate document
-        for candidate in query:
-            candidate.reference.delete()
+        query = candidates_ref.where("created_by", "==", uid).where("sold", "==", False)\
+            .select(CANDIDATE_AGGREGATE_FIELDS).stream()
+        candidates = list(query)
+
+        # Delete the matching candidate documents in batches, with their
+        # tombstones, the counter, rollups, aging and facets in each commit;
+        # leave room for the counter, aging and facet writes and up to three
+        # rollup buckets per candidate
+        chunk_size = (BATCH_LIMIT - 3) // 5
+        for start in range(0, len(candidates), chunk_size):
+            chunk = candidates[start:start + chunk_size]
+            batch = db.batch()
+            for candidate in chunk:
+                # Only as read: a candidate sold, edited or deleted since must not be decremented from stale data
+                batch.delete(candidate.reference, option=db.write_option(last_update_time=candidate.update_time))
+            add_tombstones(db, batch, [candidate.id for candidate in chunk])
+            remove_candidate_aggregates(batch, [candidate.to_dict() for candidate in chunk])
+            try:
+                batch.commit()
+                deleted = [candidate.id for candidate in chunk]
+            except (FailedPrecondition, NotFound):
+                # One changed since the query; re-read and delete this chunk candidate by candidate
+                deleted = [
+                    candidate.id for candidate in chunk
+                    if delete_unsold_in_transaction(db.transaction(), candidate.reference)
+                ]
+            # Other workers' indexes drop them at their next refresh, from the tombstones
+            for candidate_id in deleted:
+                candidate_index.remove(candidate_id)
+                match_engine.remove_candidate(candidate_id)
 
         return {"message": "User account and related unsold candidate profiles deleted successfully."}
 
@@ -301,6 +359,10 @@ def delete_user_account(token: str = Header(...)):
 
 
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 # Entry point to run the FastAPI app
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,57 @@
+"""Time-bucketing throughput on synthetic timestamps.
+
+Bins N random epoch-second timestamps spread over a five-year range into
+every dashboard frequency, in UTC and in a DST-observing timezone:
+
+    python benchmarks/bucketing.py                    # 10M timestamps
+    python benchmarks/bucketing.py -n 1000000 --tz Asia/Kolkata --repeat 5
+
+Exits non-zero when any run takes longer than --budget seconds.
+"""
+import argparse
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import timebuckets  # noqa: E402
+
+
+def run(count: int, tz: str, repeat: int):
+    end = datetime(2026, 1, 1, tzinfo=timezone.utc)
+    start = end - timedelta(days=5 * 365)
+    rng = np.random.default_rng(0)
+    instants = rng.uniform(start.timestamp(), end.timestamp(), count)
+
+    results = []
+    for frequency in timebuckets.FREQUENCIES:
+        # Hourly and daily series over five years are not served, but they bound the cost
+        best = float("inf")
+        for _ in range(repeat):
+            started = time.perf_counter()
+            series = timebuckets.series(instants, start, end, frequency, tz)
+            best = min(best, time.perf_counter() - started)
+        total = sum(point["count"] for point in series)
+        results.append((frequency, len(series), total, best))
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--count", type=int, default=10_000_000)
+    parser.add_argument("--tz", default="America/New_York")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per case; the best is reported")
+    parser.add_argument("--budget", type=float, default=1.0, help="seconds allowed per run")
+    args = parser.parse_args()
+
+    over = False
+    for tz in ("UTC", args.tz):
+        for frequency, periods, total, seconds in run(args.count, tz, args.repeat):
+            flag = "" if seconds <= args.budget else "  OVER BUDGET"
+            over = over or bool(flag)
+            print(f"{tz:<20} {frequency:<10} {periods:>6} periods {total:>10} counted {seconds * 1000:8.1f} ms{flag}")
+    sys.exit(1 if over else 0)
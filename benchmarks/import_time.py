@@ -0,0 +1,93 @@
+"""Cold-start import budget per service.
+
+Each service module is imported in a fresh interpreter with `-X importtime`
+and its cumulative import time is compared with its budget. Exits non-zero
+when a service is over budget, so it can gate CI:
+
+    python benchmarks/import_time.py            # every service in main.SERVICES
+    python benchmarks/import_time.py biding     # just one
+    python benchmarks/import_time.py --top 15   # also list the heaviest imports
+
+Run it from the repository root. Budgets are in milliseconds; IMPORT_BUDGET_SCALE
+scales all of them for slower CI machines.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from main import SERVICES  # noqa: E402
+
+# Budgets are about 25% over the median of seven runs per service (Python 3.11,
+# fastapi 0.143, firebase-admin 7.7); FastAPI alone accounts for ~550 ms of each.
+# Re-measure after a dependency upgrade rather than raising them blindly.
+DEFAULT_BUDGET_MS = 800
+
+# Services that legitimately load more at import time; measured medians in comments
+BUDGETS_MS = {
+    # NumPy for the matching engine (776 ms, 791 ms, 755 ms)
+    "candidates": 1000,
+    "candidate_selling": 1000,
+    "biding": 950,
+    # firebase_admin.auth, google-auth and requests (1020 ms)
+    "auth": 1300,
+    # stripe SDK (801 ms)
+    "stripe_payment": 1000,
+}
+
+_LINE = re.compile(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def measure(module: str):
+    """Return (cumulative microseconds for the module, [(cumulative, name), ...])."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+    # Children are printed before their parent, indented two spaces per level
+    pending = {}
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if not match:
+            continue
+        cumulative, name = int(match.group(2)), match.group(4)
+        level = (len(match.group(3)) - 1) // 2
+        children = pending.pop(level + 1, [])
+        if name == module:
+            return cumulative, sorted(children, reverse=True)
+        pending.setdefault(level, []).append((cumulative, name))
+    return 0, []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("services", nargs="*", default=SERVICES)
+    parser.add_argument("--top", type=int, default=0, help="show the N heaviest direct imports per service")
+    args = parser.parse_args()
+
+    scale = float(os.getenv("IMPORT_BUDGET_SCALE", "1"))
+    failed = []
+    for service in args.services:
+        budget = BUDGETS_MS.get(service, DEFAULT_BUDGET_MS) * scale
+        try:
+            total_us, heaviest = measure(service)
+        except RuntimeError as e:
+            print(f"{service:<36} ERROR  {e}")
+            failed.append(service)
+            continue
+        total_ms = total_us / 1000
+        status = "ok" if total_ms <= budget else "OVER"
+        print(f"{service:<36} {total_ms:8.1f} ms  budget {budget:7.0f} ms  {status}")
+        for us, name in heaviest[:args.top]:
+            print(f"    {us / 1000:8.1f} ms  {name}")
+        if status == "OVER":
+            failed.append(service)
+
+    sys.exit(1 if failed else 0)
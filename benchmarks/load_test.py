@@ -0,0 +1,57 @@
+"""Concurrent-request throughput against a running service.
+
+Start a service (e.g. `python candidates.py`) and run:
+
+    python benchmarks/load_test.py http://localhost:8000/candidates/ --concurrency 50 --requests 1000
+
+Run it once on the previous commit and once on this one to compare how many
+requests per second a single uvicorn worker serves while requests overlap.
+"""
+import argparse
+import statistics
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def timed_get(url: str, timeout: float):
+    started = time.perf_counter()
+    try:
+        with urllib.request.urlopen(url, timeout=timeout) as response:
+            response.read()
+            ok = 200 <= response.status < 300
+    except Exception:
+        ok = False
+    return ok, time.perf_counter() - started
+
+
+def run(url: str, concurrency: int, total: int, timeout: float):
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: timed_get(url, timeout), range(total)))
+    elapsed = time.perf_counter() - started
+
+    latencies = sorted(latency for _, latency in results)
+    failures = sum(1 for ok, _ in results if not ok)
+    return {
+        "requests": total,
+        "concurrency": concurrency,
+        "failures": failures,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(total / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies) * 1000, 1),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95) - 1] * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("url")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    args = parser.parse_args()
+
+    for key, value in run(args.url, args.concurrency, args.requests, args.timeout).items():
+        print(f"{key:>20}: {value}")
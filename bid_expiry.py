@@ -0,0 +1,291 @@
+import asyncio
+import heapq
+import logging
+import os
+import random
+import socket
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bid_metrics import add_to_bid_metrics
+from datastore import transactional
+
+logger = logging.getLogger(__name__)
+
+# Firestore caps a write batch at 500 operations
+BATCH_LIMIT = 500
+
+# Each expiry is one update plus at most a day and a month metrics bucket
+BIDS_PER_BATCH = BATCH_LIMIT // 3
+
+EXPIRED_UPDATE = {"expired": True, "fulfil": False}
+
+# Upper bound on a single sleep of the sweeper
+MAX_SLEEP_SECONDS = 300
+
+# The lease holder queries the bids due within this horizon at most once per
+# MAX_SLEEP_SECONDS, so bids created by other workers expire at most that late
+DUE_HORIZON = timedelta(seconds=2 * MAX_SLEEP_SECONDS)
+
+# Only the worker holding this lease seeds the heap and expires bids; the
+# others check every renewal interval and take over once it lapses
+SWEEPER_LEASE_COLLECTION = "leases"
+SWEEPER_LEASE_DOC = "bid_expiry_sweeper"
+SWEEPER_LEASE_RENEW_SECONDS = MAX_SLEEP_SECONDS
+SWEEPER_LEASE_TTL = timedelta(seconds=3 * SWEEPER_LEASE_RENEW_SECONDS)
+
+
+def as_utc(value: datetime) -> datetime:
+    """Treat naive datetimes as UTC, like the rest of the biding code."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value
+
+
+def compute_expires_at(created_at: datetime, expired_in: int) -> datetime:
+    """Deadline of a bid: created_at plus expired_in days."""
+    return as_utc(created_at) + timedelta(days=expired_in)
+
+
+def is_open(bid: dict) -> bool:
+    return not bid.get("fulfil") and not bid.get("expired")
+
+
+def expiry_entries(bid: dict):
+    """Metric entries moving an open bid to expired."""
+    return [(bid, -1), ({**bid, **EXPIRED_UPDATE}, 1)]
+
+
+def hold_sweeper_lease(client, holder: str, now: Optional[datetime] = None) -> bool:
+    """Take or extend the sweeper lease; False while another live worker holds it."""
+    now = now or datetime.now(timezone.utc)
+
+    @transactional
+    def take(transaction, ref) -> bool:
+        doc = ref.get(transaction=transaction)
+        data = doc.to_dict() if doc.exists else None
+        if data and data.get("holder") != holder and as_utc(data["expires_at"]) > now:
+            return False
+        transaction.set(ref, {"holder": holder, "expires_at": now + SWEEPER_LEASE_TTL})
+        return True
+
+    return take(client.transaction(), client.collection(SWEEPER_LEASE_COLLECTION).document(SWEEPER_LEASE_DOC))
+
+
+@transactional
+def expire_in_transaction(transaction, client, doc_ref) -> bool:
+    """Expire one bid if it is still open."""
+    doc = doc_ref.get(transaction=transaction)
+    if not doc.exists or not is_open(doc.to_dict()):
+        return False
+    transaction.update(doc_ref, EXPIRED_UPDATE)
+    add_to_bid_metrics(client, transaction, expiry_entries(doc.to_dict()))
+    return True
+
+
+class BidExpiryScheduler:
+    """Flips bids to expired when their deadline passes.
+
+    Deadlines live in a min-heap, so each wake-up only touches bids that are
+    actually due. Expired bids are written in batches from a single background
+    task instead of from every GET /biding/ request.
+
+    Every worker starts a scheduler, but only the one holding the sweeper
+    lease in Firestore reads from Firestore and writes expiries. On taking
+    the lease it seeds the heap from every open bid; after that it only
+    queries the open bids due within DUE_HORIZON, on the (fulfil, expired,
+    expires_at) index, so bids created on other workers are picked up
+    within MAX_SLEEP_SECONDS. The others only pass the bids they know of to
+    on_expire when they fall due, to drop in-memory state.
+    Expiring is idempotent in any case: each update is conditional on the
+    bid being unchanged since it was read open.
+    """
+
+    def __init__(self, db, on_expire: Optional[Callable[[List[str]], None]] = None):
+        self.db = db
+        self.on_expire = on_expire
+        self._heap: List[Tuple[float, str]] = []
+        # Current deadline per bid; heap entries that disagree with it are stale and skipped
+        self._deadlines: Dict[str, float] = {}
+        # Sync endpoints call schedule()/cancel() from threadpool threads
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._holder: Optional[str] = None
+        self._leading = False
+        self._lease_checked_at: Optional[datetime] = None
+
+    def schedule(self, bid_id: str, expires_at: datetime):
+        """Track a bid's deadline; wakes the sweeper if this is the new earliest one."""
+        deadline = expires_at.timestamp()
+        with self._lock:
+            if self._deadlines.get(bid_id) == deadline:
+                return
+            self._deadlines[bid_id] = deadline
+            heapq.heappush(self._heap, (deadline, bid_id))
+            earliest = self._heap[0][1] == bid_id
+        if earliest and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel(self, bid_id: str):
+        """Forget a bid (deleted or fulfilled); its heap entry is skipped lazily."""
+        with self._lock:
+            self._deadlines.pop(bid_id, None)
+
+    def load(self):
+        """Seed the heap from open bids, persisting expires_at where it is missing."""
+        docs = self.db.collection("biding")\
+            .where("fulfil", "==", False)\
+            .where("expired", "==", False)\
+            .stream()
+
+        batch = self.db.batch()
+        pending = 0
+        for doc in docs:
+            data = doc.to_dict()
+            expires_at = data.get("expires_at")
+            if expires_at is None:
+                if data.get("created_at") is None or data.get("expired_in") is None:
+                    continue
+                expires_at = compute_expires_at(data["created_at"], data["expired_in"])
+                batch.update(doc.reference, {"expires_at": expires_at})
+                pending += 1
+                if pending == BATCH_LIMIT:
+                    batch.commit()
+                    batch = self.db.batch()
+                    pending = 0
+            self.schedule(doc.id, as_utc(expires_at))
+        if pending:
+            batch.commit()
+
+    def load_due(self, horizon: datetime):
+        """Schedule the open bids due by `horizon`, wherever they were created."""
+        docs = self.db.collection("biding")\
+            .where("fulfil", "==", False)\
+            .where("expired", "==", False)\
+            .where("expires_at", "<=", horizon)\
+            .select(["expires_at"])\
+            .stream()
+        for doc in docs:
+            self.schedule(doc.id, as_utc(doc.to_dict()["expires_at"]))
+
+    async def lead(self, now: datetime) -> bool:
+        """Whether this worker holds the sweeper lease; taken or renewed once per renewal interval."""
+        checked = self._lease_checked_at
+        if checked is not None and (now - checked).total_seconds() < SWEEPER_LEASE_RENEW_SECONDS:
+            return self._leading
+        try:
+            self._leading = await asyncio.to_thread(hold_sweeper_lease, self.db, self._holder, now)
+        except Exception:
+            logger.exception("Failed to take the bid expiry sweeper lease")
+            self._leading = False
+        self._lease_checked_at = now
+        return self._leading
+
+    def pop_due(self, now: datetime) -> List[str]:
+        """Remove and return the IDs of every bid whose deadline has passed."""
+        due = []
+        now_ts = now.timestamp()
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now_ts:
+                deadline, bid_id = heapq.heappop(self._heap)
+                if self._deadlines.get(bid_id) != deadline:
+                    continue
+                del self._deadlines[bid_id]
+                due.append(bid_id)
+        return due
+
+    def expire(self, bid_ids: List[str]):
+        """Mark bids expired in batched writes and move them to the expired metrics.
+
+        Each chunk is read first so bids fulfilled or deleted meanwhile are
+        skipped. The updates only apply if a bid is unchanged since that read.
+        """
+        from google.api_core.exceptions import FailedPrecondition, NotFound
+        collection = self.db.collection("biding")
+        for start in range(0, len(bid_ids), BIDS_PER_BATCH):
+            refs = [collection.document(bid_id) for bid_id in bid_ids[start:start + BIDS_PER_BATCH]]
+            docs = [doc for doc in self.db.get_all(refs) if doc.exists and is_open(doc.to_dict())]
+            if not docs:
+                continue
+            batch = self.db.batch()
+            for doc in docs:
+                batch.update(doc.reference, EXPIRED_UPDATE,
+                             option=self.db.write_option(last_update_time=doc.update_time))
+            add_to_bid_metrics(self.db, batch, [entry for doc in docs for entry in expiry_entries(doc.to_dict())])
+            try:
+                batch.commit()
+            except (FailedPrecondition, NotFound):
+                # A bid changed or was deleted elsewhere; expire this chunk bid by bid
+                for doc in docs:
+                    expire_in_transaction(self.db.transaction(), self.db, doc.reference)
+        if self.on_expire is not None:
+            self.on_expire(bid_ids)
+
+    def seconds_until_next(self, now: datetime) -> float:
+        with self._lock:
+            if not self._heap:
+                return MAX_SLEEP_SECONDS
+            return min(MAX_SLEEP_SECONDS, max(0.0, self._heap[0][0] - now.timestamp()))
+
+    async def reload(self, load, *args) -> bool:
+        try:
+            await asyncio.to_thread(load, *args)
+            return True
+        except Exception:
+            logger.exception("Failed to load open bids from Firestore")
+            return False
+
+    async def run(self):
+        seeded = False
+        polled_at: Optional[datetime] = None
+        while True:
+            now = datetime.now(timezone.utc)
+            leading = await self.lead(now)
+            if not leading:
+                # Seed in full again on taking the lease
+                seeded, polled_at = False, None
+            elif not seeded:
+                seeded = await self.reload(self.load)
+                polled_at = now if seeded else None
+            elif polled_at is None or (now - polled_at).total_seconds() >= MAX_SLEEP_SECONDS:
+                if await self.reload(self.load_due, now + DUE_HORIZON):
+                    polled_at = now
+            due = self.pop_due(now)
+            if due and not leading:
+                # The lease holder writes these expiries
+                if self.on_expire is not None:
+                    self.on_expire(due)
+                continue
+            if due:
+                try:
+                    await asyncio.to_thread(self.expire, due)
+                except Exception:
+                    logger.exception("Failed to expire %d bids", len(due))
+                    for bid_id in due:
+                        self.schedule(bid_id, now + timedelta(seconds=MAX_SLEEP_SECONDS))
+                continue
+
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.seconds_until_next(now))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        # Started in the worker, after fork, so every worker has its own holder
+        self._holder = f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
@@ -0,0 +1,196 @@
+import logging
+import os
+import random
+import socket
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+# Custom epoch (2024-01-01T00:00:00Z) keeps 41 bits of milliseconds good for ~69 years
+EPOCH_MS = 1_704_067_200_000
+
+NODE_BITS = 10
+SEQUENCE_BITS = 12
+MAX_NODE_ID = (1 << NODE_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+CROCKFORD_ALPHABET = "0123456789abcdefghjkmnpqrstvwxyz"
+
+# One lease document per node ID; a process holds one while it issues bid IDs
+NODE_LEASE_COLLECTION = "bid_node_leases"
+
+# A lease not renewed for this long is free again; holders renew well before
+NODE_LEASE_TTL = timedelta(hours=1)
+NODE_LEASE_RENEW_SECONDS = 600
+
+
+def _holder() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}:{random.getrandbits(32):08x}"
+
+
+def claim_node_id(client, holder: str, now: Optional[datetime] = None) -> int:
+    """Lease a node ID no live process holds; starts at a random ID so claims rarely contend."""
+    from firebase_admin import firestore
+    now = now or datetime.now(timezone.utc)
+
+    @firestore.transactional
+    def claim(transaction, ref) -> bool:
+        doc = ref.get(transaction=transaction)
+        data = doc.to_dict() if doc.exists else None
+        if data and data.get("holder") != holder and data["expires_at"] > now:
+            return False
+        transaction.set(ref, {"holder": holder, "expires_at": now + NODE_LEASE_TTL})
+        return True
+
+    collection = client.collection(NODE_LEASE_COLLECTION)
+    first = random.randrange(MAX_NODE_ID + 1)
+    for offset in range(MAX_NODE_ID + 1):
+        node_id = (first + offset) & MAX_NODE_ID
+        if claim(client.transaction(), collection.document(str(node_id))):
+            return node_id
+    raise RuntimeError("Every bid node ID is leased")
+
+
+def renew_node_id(client, node_id: int, holder: str) -> bool:
+    """Extend this process's lease; False if it lapsed and another process took the ID."""
+    from firebase_admin import firestore
+
+    @firestore.transactional
+    def renew(transaction, ref) -> bool:
+        doc = ref.get(transaction=transaction)
+        if doc.exists and (doc.to_dict() or {}).get("holder") != holder:
+            return False
+        transaction.set(ref, {"holder": holder, "expires_at": datetime.now(timezone.utc) + NODE_LEASE_TTL})
+        return True
+
+    return renew(client.transaction(), client.collection(NODE_LEASE_COLLECTION).document(str(node_id)))
+
+
+def fallback_node_id() -> int:
+    """Hash of host name and process ID, for generators made without Firestore; may collide."""
+    return zlib.crc32(f"{socket.gethostname()}:{os.getpid()}".encode()) & MAX_NODE_ID
+
+
+class SnowflakeGenerator:
+    """Time-ordered 63-bit IDs: 41 bits of milliseconds, 10 node bits, 12 sequence bits.
+
+    IDs from one generator are strictly increasing; IDs from generators with
+    different node IDs cannot collide. Node IDs are only distinct when they
+    are leased (see NodeLease); bids are still created with create(), so a
+    collision is caught and retried with a fresh ID.
+    """
+
+    def __init__(self, node_id: Optional[int] = None):
+        self.node_id = fallback_node_id() if node_id is None else node_id & MAX_NODE_ID
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+
+    def next_int(self) -> int:
+        with self._lock:
+            now_ms = int(time.time() * 1000) - EPOCH_MS
+            if now_ms < self._last_ms:
+                # Clock moved backwards; keep issuing from the last timestamp
+                now_ms = self._last_ms
+            if now_ms == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # Sequence exhausted for this millisecond; wait for the next one
+                    while now_ms <= self._last_ms:
+                        time.sleep(0.0001)
+                        now_ms = int(time.time() * 1000) - EPOCH_MS
+            else:
+                self._sequence = 0
+            self._last_ms = now_ms
+            return (now_ms << (NODE_BITS + SEQUENCE_BITS)) | (self.node_id << SEQUENCE_BITS) | self._sequence
+
+
+def encode_base32(value: int, length: int = 13) -> str:
+    """Fixed-width Crockford base32, so string order matches numeric order."""
+    chars = []
+    for _ in range(length):
+        chars.append(CROCKFORD_ALPHABET[value & 31])
+        value >>= 5
+    return "".join(reversed(chars))
+
+
+def format_bid_id(sequence: int) -> str:
+    """Document ID for a bid.
+
+    A two-hex-digit shard derived from the whole ID leads the key, so
+    consecutive bids land in different key ranges instead of hotspotting the
+    end of the index. The sortable part follows; the raw value is also stored
+    as bid_seq for ordering queries.
+    """
+    shard = zlib.crc32(sequence.to_bytes(8, "big")) & 0xFF
+    return f"bid-{shard:02x}-{encode_base32(sequence)}"
+
+
+class NodeLease:
+    """Keeps a leased node ID for a generator, renewing it from a daemon thread.
+
+    If a renewal finds the lease taken (it lapsed, e.g. after a long pause),
+    a new node ID is claimed and handed to the generator.
+    """
+
+    def __init__(self, client, generator: SnowflakeGenerator):
+        self.client = client
+        self.generator = generator
+        self.holder = _holder()
+        generator.node_id = claim_node_id(client, self.holder)
+        self._stopped = threading.Event()
+        threading.Thread(target=self._renew_forever, name="bid-node-lease", daemon=True).start()
+
+    def _renew_forever(self):
+        while not self._stopped.wait(NODE_LEASE_RENEW_SECONDS):
+            try:
+                if not renew_node_id(self.client, self.generator.node_id, self.holder):
+                    logger.warning("Bid node ID %d was taken over; claiming another", self.generator.node_id)
+                    self.generator.node_id = claim_node_id(self.client, self.holder)
+            except Exception:
+                logger.exception("Failed to renew bid node ID lease")
+
+    def stop(self):
+        self._stopped.set()
+
+
+# Created on first use in each process: with gunicorn's preload_app the module is
+# imported by the master, and a generator made there would give every forked
+# worker the master's node ID
+_generator: Optional[SnowflakeGenerator] = None
+_lease: Optional[NodeLease] = None
+_generator_lock = threading.Lock()
+
+
+def get_bid_id_generator() -> SnowflakeGenerator:
+    """This process's generator, with a node ID leased from Firestore on first use."""
+    global _generator, _lease
+    with _generator_lock:
+        if _generator is None:
+            from datastore import sync_db
+            generator = SnowflakeGenerator()
+            _lease = NodeLease(sync_db, generator)
+            _generator = generator
+        return _generator
+
+
+def _reset_after_fork():
+    # The child must lease its own node ID; the parent's renewal thread is not inherited
+    global _generator, _lease, _generator_lock
+    _generator_lock = threading.Lock()
+    _generator = None
+    _lease = None
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def new_bid_id():
+    """Return (document_id, bid_seq) for a new bid."""
+    sequence = get_bid_id_generator().next_int()
+    return format_bid_id(sequence), sequence
@@ -0,0 +1,275 @@
+import math
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional, Tuple
+
+from rollups import DAY, META_DOC, MONTH, as_utc, bucket_id, bucket_start, plan_bucket_ids, write_buckets
+
+# Running bid aggregates per day and month of bid creation. The API's writes
+# keep them current; bids the clients fulfil by writing the document directly
+# are only counted as fulfilled once `bid_metrics.py reconcile` runs.
+BID_METRICS_COLLECTION = "bid_metrics"
+
+# Breakdown name -> bid field it groups by
+BREAKDOWNS = {"role": "role", "recruiter": "recruiter_id"}
+
+# Month buckets answer whole months, day buckets the edges of a window
+GRANULARITIES = (DAY, MONTH)
+
+# Upper edges of the fulfil-time histogram bins in hours; the last bin is open-ended
+HISTOGRAM_EDGES_HOURS = (1, 6, 24, 72, 168, 336, 720)
+HISTOGRAM_BINS = [f"le_{hours}h" for hours in HISTOGRAM_EDGES_HOURS] + [f"gt_{HISTOGRAM_EDGES_HOURS[-1]}h"]
+
+# Breakdown maps hold one entry per role or recruiter; indexing them would only cost writes
+FIELD_OVERRIDES = [
+    {"collectionGroup": BID_METRICS_COLLECTION, "fieldPath": name, "indexes": []}
+    for name in BREAKDOWNS
+]
+
+BID_FIELDS = ["created_at", "fulfil", "fulfil_time", "expired", *BREAKDOWNS.values()]
+
+
+def histogram_bin(seconds: float) -> str:
+    hours = seconds / 3600
+    for edge, name in zip(HISTOGRAM_EDGES_HOURS, HISTOGRAM_BINS):
+        if hours <= edge:
+            return name
+    return HISTOGRAM_BINS[-1]
+
+
+def bid_metrics(bid: dict) -> dict:
+    """What one bid in its current state adds to the aggregates."""
+    metrics = {"created": 1}
+    if bid.get("fulfil"):
+        metrics["fulfilled"] = 1
+        created_at, fulfil_time = bid.get("created_at"), bid.get("fulfil_time")
+        if isinstance(created_at, datetime) and isinstance(fulfil_time, datetime):
+            seconds = max((as_utc(fulfil_time) - as_utc(created_at)).total_seconds(), 0.0)
+            metrics["timed"] = 1
+            metrics["fulfil_seconds"] = seconds
+            metrics["fulfil_seconds_sq"] = seconds * seconds
+            metrics["histogram"] = {histogram_bin(seconds): 1}
+    elif bid.get("expired"):
+        metrics["expired"] = 1
+    return metrics
+
+
+def _accumulate(target: dict, metrics: dict, sign: int):
+    for name, value in metrics.items():
+        if isinstance(value, dict):
+            _accumulate(target.setdefault(name, {}), value, sign)
+        else:
+            target[name] = target.get(name, 0) + sign * value
+
+
+def _group(value) -> str:
+    # Firestore map keys cannot be empty
+    return str(value or "").strip() or "unspecified"
+
+
+def _created_at(bid: dict, default: datetime) -> datetime:
+    created_at = bid.get("created_at")
+    return created_at if isinstance(created_at, datetime) else default
+
+
+def metric_deltas(entries: Iterable[Tuple[dict, int]], now: Optional[datetime] = None) -> Dict[str, dict]:
+    """Per bucket document: start, granularity and metric deltas for (bid, +1/-1) pairs.
+
+    A bid counts in the buckets of its created_at, so a window answers for
+    the bids created in it however long they took to be fulfilled.
+    """
+    now = now or datetime.now(timezone.utc)
+    buckets: Dict[str, dict] = {}
+    for bid, sign in entries:
+        metrics = bid_metrics(bid)
+        created_at = _created_at(bid, now)
+        for granularity in GRANULARITIES:
+            start = bucket_start(created_at, granularity)
+            bucket = buckets.setdefault(bucket_id(start, granularity), {
+                "granularity": granularity, "start": start, "totals": {}, **{name: {} for name in BREAKDOWNS},
+            })
+            _accumulate(bucket["totals"], metrics, sign)
+            for name, field in BREAKDOWNS.items():
+                _accumulate(bucket[name].setdefault(_group(bid.get(field)), {}), metrics, sign)
+    return buckets
+
+
+def _increments(tree: dict) -> dict:
+    from firebase_admin import firestore
+    fields = {}
+    for name, value in tree.items():
+        if isinstance(value, dict):
+            nested = _increments(value)
+            if nested:
+                fields[name] = nested
+        elif value:
+            fields[name] = firestore.Increment(value)
+    return fields
+
+
+def add_to_bid_metrics(client, writer, entries: Iterable[Tuple[dict, int]]):
+    """Queue metric increments on the batch or transaction that writes the bids.
+
+    `entries` are (bid data, +1/-1) pairs; fulfilling or expiring a bid is the
+    bid as it was with -1 and as it is now with +1.
+    """
+    collection = client.collection(BID_METRICS_COLLECTION)
+    for doc_id, bucket in metric_deltas(entries).items():
+        fields = {name: _increments(bucket[name]) for name in ("totals", *BREAKDOWNS)}
+        fields = {name: value for name, value in fields.items() if value}
+        if fields:
+            writer.set(collection.document(doc_id), {
+                "granularity": bucket["granularity"], "start": bucket["start"], **fields,
+            }, merge=True)
+
+
+def merge_buckets(buckets: Iterable[dict]) -> dict:
+    """Sum bucket documents into {"totals": metrics, "role": {...}, "recruiter": {...}}."""
+    merged = {"totals": {}, **{name: {} for name in BREAKDOWNS}}
+    for bucket in buckets:
+        _accumulate(merged["totals"], bucket.get("totals") or {}, 1)
+        for name in BREAKDOWNS:
+            for group, metrics in (bucket.get(name) or {}).items():
+                _accumulate(merged[name].setdefault(group, {}), metrics, 1)
+    return merged
+
+
+async def read_bid_metrics(db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[dict]:
+    """Merged metrics of bids created in [start, end], or of all bids without a window.
+
+    None until a rebuild has seeded the buckets.
+    """
+    from datastore import get_all
+    collection = db.collection(BID_METRICS_COLLECTION)
+    if start is None:
+        meta = await collection.document(META_DOC).get()
+        if not meta.exists:
+            return None
+        docs = [doc async for doc in collection.where("granularity", "==", MONTH).stream()]
+    else:
+        ids = plan_bucket_ids(start, end or datetime.now(timezone.utc), MONTH)
+        docs = await get_all([collection.document(META_DOC)] + [collection.document(doc_id) for doc_id in ids])
+        if not any(doc.id == META_DOC and doc.exists for doc in docs):
+            return None
+        docs = [doc for doc in docs if doc.id != META_DOC]
+    return merge_buckets(doc.to_dict() for doc in docs if doc.exists)
+
+
+def aggregate_bids(bids: Iterable[dict], start: Optional[datetime] = None, end: Optional[datetime] = None) -> dict:
+    """The merged metrics read_bid_metrics returns, computed from bid documents.
+
+    Like the buckets, a window covers whole days from start's to end's.
+    """
+    first_day = bucket_start(start, DAY) if start else None
+    last_day = bucket_start(end or datetime.now(timezone.utc), DAY)
+    selected = []
+    for bid in bids:
+        created_at = bid.get("created_at")
+        if first_day is not None:
+            if not isinstance(created_at, datetime) or not first_day <= bucket_start(created_at, DAY) <= last_day:
+                continue
+        selected.append((bid, 1))
+    buckets = metric_deltas(selected, now=datetime(1970, 1, 1, tzinfo=timezone.utc))
+    return merge_buckets(bucket for bucket in buckets.values() if bucket["granularity"] == MONTH)
+
+
+def summarize(metrics: dict) -> dict:
+    """Endpoint view of merged metrics: counts, fulfil-time mean, spread and histogram."""
+    created = int(metrics.get("created", 0))
+    fulfilled = int(metrics.get("fulfilled", 0))
+    expired = int(metrics.get("expired", 0))
+    timed = metrics.get("timed", 0)
+    mean = metrics.get("fulfil_seconds", 0) / timed if timed else 0.0
+    variance = max(metrics.get("fulfil_seconds_sq", 0) / timed - mean * mean, 0.0) if timed else 0.0
+    histogram = metrics.get("histogram") or {}
+    return {
+        "total_bids": created,
+        "fulfilled_bids": fulfilled,
+        "expired_bids": expired,
+        "open_bids": created - fulfilled - expired,
+        "avg_fulfill_time_days": round(mean / 86400, 2),
+        "stddev_fulfill_time_days": round(math.sqrt(variance) / 86400, 2),
+        "fulfil_time_histogram": [{"bin": name, "count": int(histogram.get(name, 0))} for name in HISTOGRAM_BINS],
+    }
+
+
+def _difference(expected: dict, stored: dict) -> dict:
+    """expected - stored for nested metrics, leaving out the ones that agree."""
+    diff = {}
+    for name in set(expected) | set(stored):
+        want, have = expected.get(name), stored.get(name)
+        if isinstance(want, dict) or isinstance(have, dict):
+            nested = _difference(want if isinstance(want, dict) else {}, have if isinstance(have, dict) else {})
+            if nested:
+                diff[name] = nested
+            continue
+        delta = (want or 0) - (have or 0)
+        # Float sums picked up by increments in another order only differ by rounding
+        if abs(delta) > 1e-9 * max(1.0, abs(want or 0)):
+            diff[name] = delta
+    return diff
+
+
+def _epoch() -> datetime:
+    return datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def reconcile_bid_metrics(sync_db) -> int:
+    """Correct the buckets to the current bid documents; returns the buckets corrected.
+
+    Clients fulfil bids by writing the documents directly, which never passes
+    through add_to_bid_metrics; run this every few hours (e.g. from cron) to
+    fold those in. Corrections are increments, so unlike a rebuild it can run
+    while bids are written; a bid changed during a run can be off until the next.
+    """
+    collection = sync_db.collection(BID_METRICS_COLLECTION)
+    if not collection.document(META_DOC).get().exists:
+        raise RuntimeError("Bid metrics are not built yet; run `python bid_metrics.py rebuild` first")
+    stored = {doc.id: doc.to_dict() or {} for doc in collection.stream() if doc.id != META_DOC}
+    docs = sync_db.collection("biding").select(BID_FIELDS).stream()
+    expected = metric_deltas(((doc.to_dict(), 1) for doc in docs), now=_epoch())
+
+    batch, pending, corrected = sync_db.batch(), 0, 0
+    for doc_id in sorted(set(expected) | set(stored)):
+        want, have = expected.get(doc_id) or {}, stored.get(doc_id) or {}
+        fields = {name: _increments(_difference(want.get(name) or {}, have.get(name) or {}))
+                  for name in ("totals", *BREAKDOWNS)}
+        fields = {name: value for name, value in fields.items() if value}
+        if not fields:
+            continue
+        bucket = want or have
+        batch.set(collection.document(doc_id), {
+            "granularity": bucket["granularity"], "start": bucket["start"], **fields,
+        }, merge=True)
+        corrected += 1
+        pending += 1
+        if pending == 500:
+            batch.commit()
+            batch, pending = sync_db.batch(), 0
+    if pending:
+        batch.commit()
+    return corrected
+
+
+def rebuild_bid_metrics(sync_db) -> int:
+    """Recompute every bucket from the biding collection; returns the buckets written.
+
+    Buckets are overwritten wholesale, so run it while bids are not being
+    written, e.g. once before enabling the metrics read path.
+    """
+    docs = sync_db.collection("biding").select(BID_FIELDS).stream()
+    return write_buckets(sync_db, BID_METRICS_COLLECTION,
+                         metric_deltas(((doc.to_dict(), 1) for doc in docs), now=_epoch()))
+
+
+if __name__ == "__main__":
+    # Run "rebuild" once to initialise and "reconcile" every few hours (e.g. from cron):
+    # python bid_metrics.py reconcile
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    from datastore import sync_db
+    if command == "rebuild":
+        print(f"{rebuild_bid_metrics(sync_db)} bid metric buckets written")
+    elif command == "reconcile":
+        print(f"{reconcile_bid_metrics(sync_db)} bid metric buckets corrected")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -1,30 +1,73 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, HTTPException, Query
 from fastapi.responses import JSONResponse
 from pydantic import BaseModel
-from firebase_admin import credentials, firestore, initialize_app
-from fastapi.middleware.cors import CORSMiddleware
-from typing import List, Dict, Any
-from datetime import datetime, timedelta, timezone
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-initialize_app(cred)
-db = firestore.client()
-
-app = FastAPI()
-
-# Configure CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from typing import List, Dict, Any, Optional
+from datetime import datetime, timezone
+from bid_expiry import BidExpiryScheduler, compute_expires_at
+from bid_ids import get_bid_id_generator, new_bid_id
+from bid_metrics import add_to_bid_metrics
+from matching import MATCH_FIELDS, TOP_K, ensure_engine_loaded, keep_engine_fresh, match_engine
+from datastore import async_transactional, db, get_all, sync_db
+import asyncio
+from service import service_app
+from settings import get_settings
+
+router = APIRouter()
+
+# Firestore caps a write batch at 500 operations
+BATCH_LIMIT = 500
+
+# Each bid is one create plus at most a day and a month metrics bucket
+BIDS_PER_BATCH = BATCH_LIMIT // 3
+
+# Commits retried with fresh IDs when an ID is already taken
+ID_ATTEMPTS = 3
+
+# GET /biding/ and the expiry sweeper combine two equalities with a range on expires_at
+INDEXES = [
+    {"collectionGroup": "biding", "queryScope": "COLLECTION", "fields": [
+        {"fieldPath": "fulfil", "order": "ASCENDING"},
+        {"fieldPath": "expired", "order": "ASCENDING"},
+        {"fieldPath": "expires_at", "order": "ASCENDING"},
+    ]},
+]
+
+def drop_expired_matches(bid_ids: List[str]):
+    for bid_id in bid_ids:
+        match_engine.remove_bid(bid_id)
+
+# Background sweeper that flips bids to expired once their deadline passes
+expiry_scheduler = BidExpiryScheduler(sync_db, on_expire=drop_expired_matches)
+
+def schedule_loaded_bid(bid_id: str, data: dict):
+    # Workers without the sweeper lease still drop bids the engine loaded at their deadline
+    if data.get("expires_at") is not None:
+        expiry_scheduler.schedule(bid_id, data["expires_at"])
+
+@router.on_event("startup")
+async def start_expiry_scheduler():
+    expiry_scheduler.start()
+
+@router.on_event("startup")
+async def lease_bid_node_id():
+    # Claiming the node ID reads Firestore; do it before the first request, off the event loop
+    await asyncio.to_thread(get_bid_id_generator)
+
+@router.on_event("shutdown")
+async def stop_expiry_scheduler():
+    await expiry_scheduler.stop()
+
+engine_refresher: Optional[asyncio.Task] = None
+
+@router.on_event("startup")
+async def start_engine_refresher():
+    global engine_refresher
+    engine_refresher = asyncio.create_task(keep_engine_fresh(sync_db, get_settings().match_engine_refresh))
+
+@router.on_event("shutdown")
+async def stop_engine_refresher():
+    if engine_refresher is not None:
+        engine_refresher.cancel()
 
 # Pydantic model
 class Biding(BaseModel):
@@ -46,24 +89,165 @@ class Biding(BaseModel):
 #     doc_ref = db.collection("biding").add(biding.dict())
 #     return {"id": doc_ref[1].id, "message": "Biding created successfully"}
 
-@app.post("/biding/", response_model=dict)
-def create_biding(biding: Biding):
-    # Generate unique ID using timestamp
-    timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S%f")  # e.g., 20250512-104530123456
-    custom_id = f"bid-{timestamp}"
+def with_new_id(biding_data: dict):
+    """(id, document data) with a freshly issued ID and bid_seq."""
+    custom_id, bid_seq = new_bid_id()
+    return custom_id, {**biding_data, "bid_seq": bid_seq}
+
+def build_biding_doc(biding: Biding):
+    """Assign an ID and derived fields to a new bid; returns (id, document data)."""
+    biding_data = biding.dict()
+    biding_data["expires_at"] = compute_expires_at(biding.created_at, biding.expired_in)
+    return with_new_id(biding_data)
+
+async def create_bids(docs: List[tuple]) -> List[tuple]:
+    """Create bids and their metrics in one batch, with fresh IDs if one is taken.
 
-    db.collection("biding").document(custom_id).set(biding.dict())
+    create() fails instead of silently overwriting if an ID is already taken,
+    and the batch is atomic, so the whole chunk is retried with new IDs.
+    Returns the (id, data) pairs as committed.
+    """
+    from google.api_core.exceptions import AlreadyExists
+    collection = db.collection("biding")
+    for attempt in range(ID_ATTEMPTS):
+        batch = db.batch()
+        for custom_id, biding_data in docs:
+            batch.create(collection.document(custom_id), biding_data)
+        add_to_bid_metrics(db, batch, [(biding_data, 1) for _, biding_data in docs])
+        try:
+            await batch.commit()
+            return docs
+        except AlreadyExists:
+            if attempt == ID_ATTEMPTS - 1:
+                raise
+            docs = [with_new_id(biding_data) for _, biding_data in docs]
+
+@router.post("/biding/", response_model=dict)
+async def create_biding(biding: Biding):
+    from google.api_core.exceptions import AlreadyExists
+    try:
+        [(custom_id, biding_data)] = await create_bids([build_biding_doc(biding)])
+    except AlreadyExists:
+        raise HTTPException(status_code=409, detail="Biding ID collision, please retry")
+
+    expiry_scheduler.schedule(custom_id, biding_data["expires_at"])
+    # Ranking a new bid scans every candidate; keep it off the event loop
+    await asyncio.to_thread(match_engine.add_bid, custom_id, biding_data)
     return {"id": custom_id, "message": "Biding created successfully"}
 
+# Create many Bidings at once (used by the ATS sync job)
+@router.post("/biding/bulk/", response_model=dict)
+async def bulk_create_bidings(bidings: List[Biding]):
+    from google.api_core.exceptions import AlreadyExists
+    docs = [build_biding_doc(biding) for biding in bidings]
+
+    created_ids = []
+    for start in range(0, len(docs), BIDS_PER_BATCH):
+        try:
+            chunk = await create_bids(docs[start:start + BIDS_PER_BATCH])
+        except AlreadyExists:
+            raise HTTPException(
+                status_code=409,
+                detail={"message": "Biding ID collision, please retry the remaining bids", "created_ids": created_ids}
+            )
+        for custom_id, biding_data in chunk:
+            expiry_scheduler.schedule(custom_id, biding_data["expires_at"])
+            created_ids.append(custom_id)
+        # One trip off the event loop ranks the whole chunk
+        await asyncio.to_thread(match_engine.add_bids, chunk)
+
+    return {"ids": created_ids, "message": f"{len(created_ids)} bidings created successfully"}
+
+@async_transactional
+async def delete_in_transaction(transaction, doc_ref) -> bool:
+    """Delete a bid and take it out of the metrics only if it still existed."""
+    doc = await doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        return False
+    transaction.delete(doc_ref)
+    add_to_bid_metrics(db, transaction, [(doc.to_dict(), -1)])
+    return True
+
 # Delete Biding
-@app.delete("/biding/{biding_id}", response_model=dict)
-def delete_biding(biding_id: str):
+@router.delete("/biding/{biding_id}", response_model=dict)
+async def delete_biding(biding_id: str):
     doc_ref = db.collection("biding").document(biding_id)
-    if not doc_ref.get().exists:
+    if not await delete_in_transaction(db.transaction(), doc_ref):
         raise HTTPException(status_code=404, detail="Biding not found")
-    doc_ref.delete()
+    expiry_scheduler.cancel(biding_id)
+    match_engine.remove_bid(biding_id)
     return {"message": "Biding deleted successfully"}
 
+@async_transactional
+async def fulfil_in_transaction(transaction, doc_ref, fulfil_time: datetime) -> dict:
+    """Mark an open bid fulfilled and move it to the fulfilled metrics."""
+    doc = await doc_ref.get(transaction=transaction)
+    if not doc.exists:
+        raise HTTPException(status_code=404, detail="Biding not found")
+    biding_data = doc.to_dict()
+    if biding_data.get("fulfil"):
+        raise HTTPException(status_code=409, detail="Biding already fulfilled")
+    if biding_data.get("expired"):
+        raise HTTPException(status_code=409, detail="Biding has expired")
+
+    update = {"fulfil": True, "fulfil_time": fulfil_time}
+    transaction.update(doc_ref, update)
+    add_to_bid_metrics(db, transaction, [(biding_data, -1), ({**biding_data, **update}, 1)])
+    return {**biding_data, **update}
+
+# Fulfil Biding; bids fulfilled by writing the document directly reach the
+# metrics only through `bid_metrics.py reconcile`
+@router.post("/biding/{biding_id}/fulfil", response_model=dict)
+async def fulfil_biding(biding_id: str):
+    doc_ref = db.collection("biding").document(biding_id)
+    biding_data = await fulfil_in_transaction(db.transaction(), doc_ref, datetime.now(timezone.utc))
+    expiry_scheduler.cancel(biding_id)
+    match_engine.remove_bid(biding_id)
+    return {"id": biding_id, "fulfil_time": biding_data["fulfil_time"], "message": "Biding fulfilled successfully"}
+
+# Best-matching candidates for an open Biding
+@router.get("/biding/{biding_id}/matches", response_model=dict)
+async def get_biding_matches(biding_id: str, limit: int = Query(20, ge=1, le=TOP_K)):
+    try:
+        # Each worker's engine only knows the bids it loaded or wrote; the document is the truth
+        bid = await db.collection("biding").document(biding_id).get(field_paths=MATCH_FIELDS + [
+            "fulfil", "expired", "expires_at",
+        ])
+        bid_data = bid.to_dict() if bid.exists else None
+        expires_at = (bid_data or {}).get("expires_at")
+        if (bid_data is None or bid_data.get("fulfil") or bid_data.get("expired")
+                or (expires_at is not None and expires_at <= datetime.now(timezone.utc))):
+            match_engine.remove_bid(biding_id)
+            raise HTTPException(status_code=404, detail="Open biding not found")
+
+        # Warm-up and first-time ranking scan large arrays; keep them off the event loop
+        engine = await asyncio.to_thread(ensure_engine_loaded, sync_db, on_bid=schedule_loaded_bid)
+        matches = await asyncio.to_thread(engine.matches, biding_id, limit)
+        if matches is None:
+            # Created on another worker after this one warmed up
+            await asyncio.to_thread(engine.add_bid, biding_id, bid_data)
+            schedule_loaded_bid(biding_id, bid_data)
+            matches = await asyncio.to_thread(engine.matches, biding_id, limit) or []
+
+        # One round-trip for the matched candidate documents
+        refs = [db.collection("candidates").document(candidate_id) for candidate_id, _ in matches]
+        docs = {doc.id: doc for doc in await get_all(refs)}
+
+        results = []
+        for candidate_id, match_score in matches:
+            doc = docs.get(candidate_id)
+            # Deleted or sold on another worker since this one last refreshed
+            if doc is None or not doc.exists or doc.to_dict().get("sold"):
+                engine.remove_candidate(candidate_id)
+                continue
+            results.append({"score": round(match_score, 4), "candidate": doc.to_dict()})
+        return {"id": biding_id, "matches": results}
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
 # List all Biding where fulfil == false and expired == false
 # @app.get("/biding/", response_model=Dict[str, List[Dict[str, Any]]])
 # def list_bidings():
@@ -78,44 +262,29 @@ def delete_biding(biding_id: str):
 #     except Exception as e:
 #         return JSONResponse(content={"error": str(e)}, status_code=500)
 
-@app.get("/biding/", response_model=Dict[str, List[Dict[str, Any]]])
-def list_bidings():
+@router.get("/biding/", response_model=Dict[str, List[Dict[str, Any]]])
+async def list_bidings():
     try:
-        now_utc = datetime.utcnow().replace(tzinfo=timezone.utc)
+        now_utc = datetime.now(timezone.utc)
 
-        # Step 1: Check and update expiration status
-        docs_to_check = db.collection("biding").where("expired", "==", False).stream()
-        for doc in docs_to_check:
-            data = doc.to_dict()
-            created_at = data.get("created_at")
-            expired_in = data.get("expired_in")
-
-            if created_at and expired_in is not None:
-                # Ensure created_at is timezone-aware
-                if created_at.tzinfo is None:
-                    created_at = created_at.replace(tzinfo=timezone.utc)
-
-                expiry_time = created_at + timedelta(days=expired_in)
-
-                if expiry_time < now_utc:
-                    db.collection("biding").document(doc.id).update({
-                        "expired": True,
-                        "fulfil": False
-                    })
-
-        # Step 2: Return filtered bidings
+        # Expiry is handled by the background sweeper; filtering on expires_at
+        # keeps bids out of the list even before the sweeper has flipped them
         biding_docs = db.collection("biding")\
             .where("fulfil", "==", False)\
             .where("expired", "==", False)\
+            .where("expires_at", ">", now_utc)\
             .stream()
 
-        bidings = [{"id": doc.id, **doc.to_dict()} for doc in biding_docs]
+        bidings = [{"id": doc.id, **doc.to_dict()} async for doc in biding_docs]
         return {"bidings": bidings}
 
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 # Run the FastAPI app
 if __name__ == "__main__":
     import uvicorn
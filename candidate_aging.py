@@ -0,0 +1,184 @@
+import random
+import sys
+from datetime import date, datetime, timedelta, timezone
+from typing import Iterable, Optional, Tuple
+
+from counters import NUM_SHARDS
+
+# Running aggregates of unsold candidates' created_at, sharded like the counters
+AGING_COLLECTION = "candidate_aging"
+UNSOLD_DOC = "unsold"
+
+# Aging histogram buckets: (label, last day of age in it); the last one is open-ended
+AGING_BUCKETS = [
+    ("0-7d", 7),
+    ("8-30d", 30),
+    ("31-90d", 90),
+    ("91-180d", 180),
+    ("181-365d", 365),
+    ("365d+", None),
+]
+
+# Days older than this are folded into "older" by the daily advance job; they
+# all fall in the open-ended bucket, so the per-day map stays about a year long
+FOLD_AFTER_DAYS = 365
+
+# by_day holds one entry per creation day; indexing it would only cost writes
+FIELD_OVERRIDES = [{
+    "collectionGroup": "shards",
+    "fieldPath": "by_day",
+    "indexes": [],
+}]
+
+
+def shards_collection(client):
+    return client.collection(AGING_COLLECTION).document(UNSOLD_DOC).collection("shards")
+
+
+def _created_at(candidate: dict, default: datetime) -> datetime:
+    created_at = candidate.get("created_at")
+    if not isinstance(created_at, datetime):
+        return default
+    if created_at.tzinfo is None:
+        return created_at.replace(tzinfo=timezone.utc)
+    return created_at
+
+
+def aging_deltas(entries: Iterable[Tuple[dict, int]], now: Optional[datetime] = None) -> dict:
+    """Count, created_at sum (epoch seconds) and per-day deltas for (candidate, +1/-1) pairs.
+
+    Only unsold candidates count; a sale is the candidate as it was with -1
+    and as it is now with +1. Candidates whose created_at is still a server
+    timestamp sentinel are taken as created at `now`.
+    """
+    now = now or datetime.now(timezone.utc)
+    deltas = {"count": 0, "created_sum": 0, "by_day": {}}
+    for candidate, sign in entries:
+        if candidate.get("sold"):
+            continue
+        created_at = _created_at(candidate, now)
+        day = created_at.astimezone(timezone.utc).date().isoformat()
+        deltas["count"] += sign
+        deltas["created_sum"] += sign * int(created_at.timestamp())
+        deltas["by_day"][day] = deltas["by_day"].get(day, 0) + sign
+    return deltas
+
+
+def add_to_aging(client, writer, entries: Iterable[Tuple[dict, int]], now: Optional[datetime] = None):
+    """Queue aging increments on the batch or transaction that writes the candidates."""
+    from firebase_admin import firestore
+    deltas = aging_deltas(entries, now)
+    by_day = {day: firestore.Increment(delta) for day, delta in deltas["by_day"].items() if delta}
+    if not by_day:
+        return
+    shard = shards_collection(client).document(str(random.randrange(NUM_SHARDS)))
+    writer.set(shard, {
+        "count": firestore.Increment(deltas["count"]),
+        "created_sum": firestore.Increment(deltas["created_sum"]),
+        "by_day": by_day,
+    }, merge=True)
+
+
+def merge_shards(shards: Iterable[dict]) -> dict:
+    totals = {"count": 0, "created_sum": 0, "older": 0, "by_day": {}}
+    for shard in shards:
+        for field in ("count", "created_sum", "older"):
+            totals[field] += int(shard.get(field) or 0)
+        for day, count in (shard.get("by_day") or {}).items():
+            totals["by_day"][day] = totals["by_day"].get(day, 0) + int(count or 0)
+    return totals
+
+
+async def read_aging(db) -> Optional[dict]:
+    """Merged aggregates from the shards; None until a rebuild has seeded them."""
+    shards = [shard.to_dict() or {} async for shard in shards_collection(db).stream()]
+    if not any(shard.get("built_at") for shard in shards):
+        return None
+    return merge_shards(shards)
+
+
+def aggregate_candidates(candidates: Iterable[dict]) -> dict:
+    """The merged aggregates read_aging returns, computed from candidate documents."""
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    deltas = aging_deltas(((candidate, 1) for candidate in candidates if candidate.get("created_at")), now=epoch)
+    return {**deltas, "older": 0}
+
+
+def summarize(totals: dict, now: Optional[datetime] = None) -> dict:
+    """Mean age in days and the aging histogram, as of `now`."""
+    now = now or datetime.now(timezone.utc)
+    today = now.astimezone(timezone.utc).date()
+    count = totals["count"]
+    mean_seconds = now.timestamp() - totals["created_sum"] / count if count else 0.0
+
+    histogram = {label: 0 for label, _ in AGING_BUCKETS}
+    histogram[AGING_BUCKETS[-1][0]] += totals.get("older", 0)
+    for day, n in totals["by_day"].items():
+        age = (today - date.fromisoformat(day)).days
+        for label, last in AGING_BUCKETS:
+            if last is None or age <= last:
+                histogram[label] += n
+                break
+
+    return {
+        "average_profile_aging_days": round(mean_seconds / 86400, 2),
+        "unsold_candidates": count,
+        "aging_histogram": [{"bucket": label, "count": n} for label, n in histogram.items()],
+    }
+
+
+def advance(sync_db, now: Optional[datetime] = None) -> int:
+    """Fold creation days past FOLD_AFTER_DAYS into each shard's "older" count.
+
+    Run daily; returns the candidates folded. Each shard is rewritten in a
+    transaction so increments landing on a folded day are not lost.
+    """
+    from firebase_admin import firestore
+    cutoff = ((now or datetime.now(timezone.utc)).astimezone(timezone.utc).date()
+              - timedelta(days=FOLD_AFTER_DAYS)).isoformat()
+
+    @firestore.transactional
+    def fold(transaction, shard_ref) -> int:
+        data = shard_ref.get(transaction=transaction).to_dict() or {}
+        old = {day: int(count or 0) for day, count in (data.get("by_day") or {}).items() if day < cutoff}
+        if not old:
+            return 0
+        update = {f"by_day.`{day}`": firestore.DELETE_FIELD for day in old}
+        update["older"] = firestore.Increment(sum(old.values()))
+        transaction.update(shard_ref, update)
+        return sum(old.values())
+
+    return sum(fold(sync_db.transaction(), shard.reference) for shard in shards_collection(sync_db).stream())
+
+
+def rebuild_aging(sync_db) -> int:
+    """Recompute the aggregates from unsold candidates; returns the candidates counted.
+
+    Shards are overwritten, so run it while candidates are not being written,
+    e.g. once before enabling the aggregate read path.
+    """
+    docs = sync_db.collection("candidates").where("sold", "==", False).select(["created_at", "sold"]).stream()
+    totals = aggregate_candidates(doc.to_dict() for doc in docs)
+
+    batch = sync_db.batch()
+    for shard in shards_collection(sync_db).stream():
+        if shard.id != "0":
+            batch.delete(shard.reference)
+    batch.set(shards_collection(sync_db).document("0"), {**totals, "built_at": datetime.now(timezone.utc)})
+    batch.commit()
+    return totals["count"]
+
+
+if __name__ == "__main__":
+    # Run "advance" daily (e.g. from cron) and "rebuild" once to initialise:
+    # python candidate_aging.py advance
+    command = sys.argv[1] if len(sys.argv) > 1 else "advance"
+    from datastore import sync_db
+    if command == "advance":
+        print(f"{advance(sync_db)} candidates folded into the open-ended bucket")
+    elif command == "rebuild":
+        rebuilt = rebuild_aging(sync_db)
+        advance(sync_db)
+        print(f"{rebuilt} unsold candidates counted")
+    else:
+        sys.exit(f"Unknown command: {command}")
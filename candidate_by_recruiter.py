@@ -1,45 +1,54 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import credentials, firestore
-import os
-from dotenv import load_dotenv
-load_dotenv()
-
-# Initialize Firebase Admin SDK
-cred = credentials.Certificate("path/to/your/firebase_credentials.json")
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-# Initialize FastAPI app
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/get_candidates/{recruiter_id}")
-async def get_candidates(recruiter_id: str):
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, parse_fields, project
+from datastore import db
+from service import service_app
+
+router = APIRouter()
+
+# Pages are created_by == recruiter ordered by created_at, then document ID
+INDEXES = [
+    {"collectionGroup": "candidates", "queryScope": "COLLECTION", "fields": [
+        {"fieldPath": "created_by", "order": "ASCENDING"},
+        {"fieldPath": "created_at", "order": "ASCENDING"},
+    ]},
+]
+
+@router.get("/get_candidates/{recruiter_id}")
+async def get_candidates(
+    recruiter_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+):
     try:
         candidates_ref = db.collection("candidates") 
-        query = candidates_ref.where("created_by", "==", recruiter_id).stream()
+        field_list = parse_fields(fields)
+        query, next_cursor = await fetch_page(
+            candidates_ref,
+            query=candidates_ref.where("created_by", "==", recruiter_id),
+            limit=limit,
+            start_after=start_after,
+            fields=field_list,
+        )
 
         candidates = []
         for doc in query:
-            candidates.append(doc.to_dict())
+            candidates.append(project(doc.to_dict(), field_list))
 
-        if not candidates:
+        if not candidates and not start_after:
             raise HTTPException(status_code=404, detail="No candidates found for this recruiter_id")
 
-        return {"status": "success", "candidates": candidates}
+        return {"status": "success", "candidates": candidates, "next_cursor": next_cursor}
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, List, Optional, Tuple
+
+# Every candidate write the in-process indexes care about (create, sale) stamps
+# this field; deletes leave a tombstone instead, so a worker catches up on other
+# workers' writes by reading only what changed since its last poll
+UPDATED_FIELD = "updated_at"
+TOMBSTONE_COLLECTION = "candidate_tombstones"
+DELETED_FIELD = "deleted_at"
+
+# Polls re-read this far behind the newest change seen: commits are stamped
+# slightly out of order, and the first watermark comes from the local clock
+CHANGE_OVERLAP = timedelta(minutes=2)
+
+# Tombstones older than this are deleted; a reader further behind rebuilds instead
+TOMBSTONE_RETENTION = timedelta(days=1)
+
+
+def change_stamp() -> dict:
+    """Fields to add to a candidate create or update so other workers' polls see it."""
+    from firebase_admin import firestore
+    return {UPDATED_FIELD: firestore.SERVER_TIMESTAMP}
+
+
+def add_tombstones(client, writer, candidate_ids: Iterable[str]):
+    """Queue tombstones on the batch or transaction that deletes the candidates."""
+    from firebase_admin import firestore
+    collection = client.collection(TOMBSTONE_COLLECTION)
+    for candidate_id in candidate_ids:
+        writer.set(collection.document(candidate_id), {DELETED_FIELD: firestore.SERVER_TIMESTAMP})
+
+
+def _as_utc(moment: datetime) -> datetime:
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+class CandidateChanges:
+    """Candidates written and deleted since the previous poll, read with a sync client.
+
+    Created by a full load, which calls mark() before it starts reading, so
+    nothing committed during the load is missed.
+    """
+
+    def __init__(self, fields: List[str]):
+        self.fields = list(dict.fromkeys([*fields, UPDATED_FIELD]))
+        self.since: Optional[datetime] = None
+
+    def mark(self):
+        self.since = datetime.now(timezone.utc)
+
+    def stale(self) -> bool:
+        """True when tombstones this poll needs may have been deleted; reload in full instead."""
+        return self.since is None or datetime.now(timezone.utc) - self.since > TOMBSTONE_RETENTION - CHANGE_OVERLAP
+
+    def poll(self, sync_db) -> Tuple[List[Tuple[str, dict]], List[str]]:
+        """(changed (id, data) pairs, deleted IDs); a change may be reported by more than one poll."""
+        since = self.since - CHANGE_OVERLAP
+        newest = self.since
+
+        changed = []
+        query = sync_db.collection("candidates").where(UPDATED_FIELD, ">", since).select(self.fields)
+        for doc in query.stream():
+            data = doc.to_dict()
+            changed.append((doc.id, data))
+            if isinstance(data.get(UPDATED_FIELD), datetime):
+                newest = max(newest, _as_utc(data[UPDATED_FIELD]))
+
+        deleted = []
+        query = sync_db.collection(TOMBSTONE_COLLECTION).where(DELETED_FIELD, ">", since)
+        for doc in query.stream():
+            deleted.append(doc.id)
+            moment = (doc.to_dict() or {}).get(DELETED_FIELD)
+            if isinstance(moment, datetime):
+                newest = max(newest, _as_utc(moment))
+
+        self.since = newest
+        return changed, deleted
+
+
+def drop_old_tombstones(sync_db) -> int:
+    """Delete tombstones past the retention; returns how many. Any worker may run it."""
+    cutoff = datetime.now(timezone.utc) - TOMBSTONE_RETENTION
+    docs = sync_db.collection(TOMBSTONE_COLLECTION).where(DELETED_FIELD, "<", cutoff).select([]).stream()
+    batch, pending, dropped = sync_db.batch(), 0, 0
+    for doc in docs:
+        batch.delete(doc.reference)
+        pending += 1
+        dropped += 1
+        if pending == 500:
+            batch.commit()
+            batch, pending = sync_db.batch(), 0
+    if pending:
+        batch.commit()
+    return dropped
@@ -1,28 +1,16 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
-from firebase_admin import credentials, firestore, initialize_app
-from fastapi.middleware.cors import CORSMiddleware
 from datetime import datetime
-import os
-from dotenv import load_dotenv
+from search_index import candidate_index
+from matching import match_engine
+from datastore import async_transactional, db
+from rollups import add_to_rollups
+from price_sketch import add_to_price_sketches
+from candidate_aging import add_to_aging
+from candidate_changes import change_stamp
+from service import service_app
 
-load_dotenv()
-
-# Firebase Setup
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-initialize_app(cred)
-db = firestore.client()
-
-app = FastAPI()
-
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
 
 class SellRequest(BaseModel):
     buyer_id: str
@@ -30,63 +18,92 @@ class SellRequest(BaseModel):
     candidate_id: str
     connects: int
 
-@app.post("/sell-candidate/")
+@async_transactional
+async def sell_in_transaction(transaction, data: SellRequest, timestamp: datetime):
+    """Validate and apply a sale atomically; retried by Firestore on contention."""
+    from firebase_admin import firestore
+    buyer_ref = db.collection("recruiters").document(data.buyer_id)
+    seller_ref = db.collection("recruiters").document(data.seller_id)
+    candidate_ref = db.collection("candidates").document(data.candidate_id)
+
+    # 1. Read buyer, seller and candidate in one round-trip
+    docs = {
+        doc.reference.path: doc
+        async for doc in db.get_all([buyer_ref, seller_ref, candidate_ref], transaction=transaction)
+    }
+    buyer_doc = docs.get(buyer_ref.path)
+    seller_doc = docs.get(seller_ref.path)
+    candidate_doc = docs.get(candidate_ref.path)
+
+    if not buyer_doc or not buyer_doc.exists or not seller_doc or not seller_doc.exists:
+        raise HTTPException(status_code=404, detail="Buyer or Seller not found")
+
+    if not candidate_doc or not candidate_doc.exists:
+        raise HTTPException(status_code=404, detail="Candidate not found")
+
+    candidate_data = candidate_doc.to_dict()
+    if candidate_data.get("sold"):
+        raise HTTPException(status_code=409, detail="Candidate already sold")
+
+    if buyer_doc.to_dict().get("connects", 0) < data.connects:
+        raise HTTPException(status_code=400, detail="Buyer doesn't have enough connects")
+
+    # 2. Ledger row, connects transfer and deal counters
+    transaction.set(db.collection("candidate_selling").document(), {
+        "buyer_id": data.buyer_id,
+        "seller_id": data.seller_id,
+        "candidate_id": data.candidate_id,
+        "connects": data.connects,
+        "timestamp": timestamp
+    })
+    transaction.update(buyer_ref, {
+        "connects": firestore.Increment(-data.connects),
+        "num_of_deals": firestore.Increment(1)
+    })
+    transaction.update(seller_ref, {
+        "connects": firestore.Increment(data.connects),
+        "num_of_deals": firestore.Increment(1)
+    })
+
+    # 3. Update candidate info
+    candidate_update = {
+        "purchased_by": data.buyer_id,
+        "sold": True,
+        "sold_time": timestamp,
+        "price": data.connects
+    }
+    transaction.update(candidate_ref, {**candidate_update, **change_stamp()})
+
+    # 4. Move the candidate from the unsold to the sold rollup cell and out of the unsold aging
+    sold_candidate = {**candidate_data, **candidate_update}
+    add_to_rollups(db, transaction, [(candidate_data, -1), (sold_candidate, 1)])
+    add_to_aging(db, transaction, [(candidate_data, -1), (sold_candidate, 1)])
+
+    # 5. Add the price to the sale-price sketches
+    add_to_price_sketches(db, transaction, sold_candidate)
+
+    return sold_candidate
+
+@router.post("/sell-candidate/")
 async def sell_candidate(data: SellRequest):
     try:
-        timestamp = datetime.utcnow()
-
-        # 1. Add to candidate_selling collection
-        db.collection("candidate_selling").add({
-            "buyer_id": data.buyer_id,
-            "seller_id": data.seller_id,
-            "candidate_id": data.candidate_id,
-            "connects": data.connects,
-            "timestamp": timestamp
-        })
-
-        # 2. Update recruiters - decrement buyer connects
-        buyer_ref = db.collection("recruiters").document(data.buyer_id)
-        seller_ref = db.collection("recruiters").document(data.seller_id)
-
-        buyer_doc = buyer_ref.get()
-        seller_doc = seller_ref.get()
-
-        if not buyer_doc.exists or not seller_doc.exists:
-            raise HTTPException(status_code=404, detail="Buyer or Seller not found")
-
-        buyer_connects = buyer_doc.to_dict().get("connects", 0)
-        seller_connects = seller_doc.to_dict().get("connects", 0)
+        if data.buyer_id == data.seller_id:
+            raise HTTPException(status_code=400, detail="Buyer and seller must be different recruiters")
 
-        if buyer_connects < data.connects:
-            raise HTTPException(status_code=400, detail="Buyer doesn't have enough connects")
-
-        buyer_ref.update({"connects": buyer_connects - data.connects})
-        seller_ref.update({"connects": seller_connects + data.connects})
-
-        # Update num_of_deals for both
-        buyer_num_of_deals = buyer_doc.to_dict().get("num_of_deals", 0)
-        seller_num_of_deals = seller_doc.to_dict().get("num_of_deals", 0)
-
-        buyer_ref.update({"num_of_deals": buyer_num_of_deals + 1})
-        seller_ref.update({"num_of_deals": seller_num_of_deals + 1})
-
-        # 3. Update candidate info
-        candidate_ref = db.collection("candidates").document(data.candidate_id)
-        candidate_doc = candidate_ref.get()
-
-        if not candidate_doc.exists:
-            raise HTTPException(status_code=404, detail="Candidate not found")
+        timestamp = datetime.utcnow()
+        updated_candidate = await sell_in_transaction(db.transaction(), data, timestamp)
 
-        candidate_ref.update({
-            "purchased_by": data.buyer_id,
-            "sold": True,
-            "sold_time": timestamp,
-            "price": data.connects
-        })
+        candidate_index.set_sold(data.candidate_id)
+        match_engine.remove_candidate(data.candidate_id)
 
-        updated_candidate = candidate_ref.get().to_dict()
         updated_candidate["id"] = data.candidate_id  # include ID if needed
         return updated_candidate
 
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
+
+
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
@@ -1,27 +1,42 @@
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import APIRouter, HTTPException, Query, Request
 from pydantic import BaseModel
-from firebase_admin import credentials, firestore, initialize_app
-from fastapi.middleware.cors import CORSMiddleware
 from typing import List, Optional
-import os 
-from dotenv import load_dotenv
-from datetime import datetime
-load_dotenv()
-
-# Firebase setup
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))  # Path to your service account key
-initialize_app(cred)
-db = firestore.client()
-app = FastAPI()
-
-# Configure CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+from datetime import datetime, timezone
+from search_index import candidate_index, ensure_index_built, keep_index_fresh
+from matching import match_engine
+from query_planner import plan_candidate_filter, shadow_fields
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, parse_fields, project
+from streaming import ndjson_response, wants_ndjson
+from counters import add_to_counts
+from rollups import MAX_BUCKET_WRITES, add_to_rollups
+from candidate_aging import add_to_aging
+from facet_catalog import add_to_facets
+from price_sketch import add_to_price_sketches
+from candidate_changes import add_tombstones, change_stamp
+from datastore import async_transactional, db, get_all, sync_db
+import asyncio
+import logging
+from service import service_app
+from settings import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Firestore caps a write batch at 500 operations
+BATCH_LIMIT = 500
+
+router = APIRouter()
+
+index_refresher: Optional[asyncio.Task] = None
+
+@router.on_event("startup")
+async def start_index_refresher():
+    global index_refresher
+    index_refresher = asyncio.create_task(keep_index_fresh(sync_db, get_settings().search_index_refresh))
+
+@router.on_event("shutdown")
+async def stop_index_refresher():
+    if index_refresher is not None:
+        index_refresher.cancel()
 
 # Pydantic model to represent candidate data with updated fields
 class Candidate(BaseModel):
@@ -43,7 +58,8 @@ class Candidate(BaseModel):
     sold: Optional[bool] = False
 
 # Helper function to save candidate to Firestore
-def save_candidate(candidate: Candidate):
+async def save_candidate(candidate: Candidate):
+    from firebase_admin import firestore
     candidate_dict = candidate.dict()
     # Initialize empty bookmarked_by array if it doesn't exist
     if candidate_dict.get('bookmarked_by') is None:
@@ -51,69 +67,143 @@ def save_candidate(candidate: Candidate):
     
     # Set created_at timestamp
     candidate_dict['created_at'] = firestore.SERVER_TIMESTAMP
+    candidate_dict.update(shadow_fields(candidate_dict))
+    candidate_dict.update(change_stamp())
     
     # Create a new document in Firestore and get its document ID
     doc_ref = db.collection("candidates").document()
     candidate_dict["candidate_id"] = doc_ref.id  # Assign the document ID as candidate_id
-    doc_ref.set(candidate_dict)  # Save the candidate
+
+    # Save the candidate and bump the counter and time-series rollups in one commit
+    batch = db.batch()
+    batch.set(doc_ref, candidate_dict)
+    add_to_counts(db, batch, candidates=1)
+    add_to_rollups(db, batch, [(candidate_dict, 1)])
+    add_to_aging(db, batch, [(candidate_dict, 1)])
+    add_to_facets(db, batch, [(candidate_dict, 1)])
+    await batch.commit()
+    await asyncio.to_thread(candidate_index.upsert, doc_ref.id, {**candidate_dict, "created_at": datetime.now(timezone.utc)})
+    await asyncio.to_thread(match_engine.add_candidate, doc_ref.id, candidate_dict)
     return doc_ref.id
 
 # Endpoint to create a new candidate
-@app.post("/candidates/")
+@router.post("/candidates/")
 async def create_candidate(candidate: Candidate):
     try:
-        candidate_id = save_candidate(candidate)
+        candidate_id = await save_candidate(candidate)
         return {"message": "Candidate created successfully", "candidate_id": candidate_id}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-# Endpoint to create multiple candidates in bulk
-@app.post("/candidates/bulk/")
-async def bulk_create_candidates(candidates: List[Candidate]):
-    try:
+# A bulk batch also carries the counter, aging and facet writes and the rollup shards
+CANDIDATES_PER_BATCH = BATCH_LIMIT - 3 - MAX_BUCKET_WRITES
+
+async def save_candidates(candidates: List[Candidate]) -> List[str]:
+    """Create candidates in as few batched commits as the batch limit allows; returns their IDs."""
+    from firebase_admin import firestore
+    created = []
+    for start in range(0, len(candidates), CANDIDATES_PER_BATCH):
         batch = db.batch()
-        for candidate in candidates:
+        chunk = []
+        for candidate in candidates[start:start + CANDIDATES_PER_BATCH]:
             doc_ref = db.collection("candidates").document()
             candidate_dict = candidate.dict()
             candidate_dict["candidate_id"] = doc_ref.id  # Assign document ID as candidate_id
             candidate_dict["bookmarked_by"] = []
             candidate_dict["created_at"] = firestore.SERVER_TIMESTAMP
             candidate_dict["sold"] = False
+            candidate_dict.update(shadow_fields(candidate_dict))
+            candidate_dict.update(change_stamp())
             batch.set(doc_ref, candidate_dict)
-        
-        batch.commit()  # Commit all the bulk operations at once
+            chunk.append(candidate_dict)
+        add_to_counts(db, batch, candidates=len(chunk))
+        add_to_rollups(db, batch, [(candidate_dict, 1) for candidate_dict in chunk])
+        add_to_aging(db, batch, [(candidate_dict, 1) for candidate_dict in chunk])
+        add_to_facets(db, batch, [(candidate_dict, 1) for candidate_dict in chunk])
+
+        await batch.commit()
+
+        now = datetime.now(timezone.utc)
+        await asyncio.to_thread(
+            candidate_index.upsert_many,
+            [(candidate_dict["candidate_id"], {**candidate_dict, "created_at": now}) for candidate_dict in chunk]
+        )
+        await asyncio.to_thread(
+            match_engine.add_candidates, [(candidate_dict["candidate_id"], candidate_dict) for candidate_dict in chunk]
+        )
+        created.extend(chunk)
+    return [candidate_dict["candidate_id"] for candidate_dict in created]
+
+# Endpoint to create multiple candidates in bulk
+@router.post("/candidates/bulk/")
+async def bulk_create_candidates(candidates: List[Candidate]):
+    try:
+        await save_candidates(candidates)
         return {"message": f"{len(candidates)} candidates created successfully."}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-# Endpoint to get all candidates
-@app.get("/candidates/")
-async def get_all_candidates():
+# Endpoint to get all candidates, one page at a time
+@router.get("/candidates/")
+async def get_all_candidates(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+):
     try:
-        candidates_ref = db.collection("candidates").stream()
-        candidates = [candidate.to_dict() for candidate in candidates_ref]
-        return {"candidates": candidates}
+        field_list = parse_fields(fields)
+
+        # Full export: stream every document instead of paging
+        if wants_ndjson(request):
+            query = db.collection("candidates")
+            if field_list:
+                query = query.select(field_list)
+            return ndjson_response(candidate.to_dict() async for candidate in query.stream())
+
+        docs, next_cursor = await fetch_page(
+            db.collection("candidates"),
+            limit=limit,
+            start_after=start_after,
+            fields=field_list,
+        )
+        candidates = [project(candidate.to_dict(), field_list) for candidate in docs]
+        return {"candidates": candidates, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-# Endpoint to search candidates by keyword (match in any field)
-@app.get("/candidates/search/")
-async def search_candidates(keyword: str):
+# Endpoint to search candidates by keyword (match in any indexed field)
+@router.get("/candidates/search/")
+async def search_candidates(
+    keyword: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+):
     try:
-        candidates_ref = db.collection("candidates").stream()
+        # The first search builds the index from a full read; keep that off the event loop
+        index = candidate_index if candidate_index.ready else await asyncio.to_thread(ensure_index_built, sync_db)
+        candidate_ids, _ = index.search(keyword, limit=limit, offset=offset)
+
+        # Fetch only the requested page, preserving rank order
+        refs = [db.collection("candidates").document(candidate_id) for candidate_id in candidate_ids]
+        docs = {doc.id: doc for doc in await get_all(refs)}
+
         matched_candidates = []
-        
-        for candidate in candidates_ref:
-            candidate_data = candidate.to_dict()
-            if any(keyword.lower() in str(value).lower() for value in candidate_data.values() if isinstance(value, (str, int, float))):
-                matched_candidates.append(candidate_data)
+        for candidate_id in candidate_ids:
+            doc = docs.get(candidate_id)
+            if doc is not None and doc.exists:
+                matched_candidates.append(doc.to_dict())
+            else:
+                index.remove(candidate_id)
 
         return matched_candidates
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # Endpoint to filter candidates by multiple fields
-@app.get("/candidates/filter/")
+@router.get("/candidates/filter/")
 async def filter_candidates(
     city: Optional[str] = Query(None),
     country: Optional[str] = Query(None),
@@ -124,22 +214,31 @@ async def filter_candidates(
     skills: Optional[List[str]] = Query(None),
     sold: Optional[bool] = Query(None),
 ):
+    from google.api_core.exceptions import FailedPrecondition
     try:
-        candidates_ref = db.collection("candidates").stream()
-        filtered_candidates = []
+        plan = plan_candidate_filter(
+            city=city,
+            country=country,
+            ctc=ctc,
+            role=role,
+            experience=experience,
+            notice_period=notice_period,
+            skills=skills,
+            sold=sold,
+        )
+        candidates_ref = db.collection("candidates")
+        try:
+            docs = [doc async for doc in plan.apply(candidates_ref).stream()]
+        except FailedPrecondition:
+            # Composite index not deployed yet; narrow by the best single filter instead
+            logger.warning("Missing Firestore index for candidate filter: %s", plan.index_definition())
+            docs = [doc async for doc in plan.fallback().apply(candidates_ref).stream()]
 
-        for candidate in candidates_ref:
+        # Check the remaining predicates on the narrowed candidate set
+        filtered_candidates = []
+        for candidate in docs:
             candidate_data = candidate.to_dict()
-            if (
-                (city is None or candidate_data.get("city", "").lower() == city.lower()) and
-                (country is None or candidate_data.get("country", "").lower() == country.lower()) and
-                (ctc is None or candidate_data.get("ctc", float("inf")) <= ctc) and
-                (role is None or candidate_data.get("role", "").lower() == role.lower()) and
-                (experience is None or candidate_data.get("experience", 0) >= experience) and
-                (notice_period is None or candidate_data.get("notice_period", "").lower() == notice_period.lower()) and
-                (skills is None or ("skills" in candidate_data and all(skill.lower() in [s.lower() for s in candidate_data["skills"]] for skill in skills))) and
-                (sold is None or candidate_data.get("sold", False) == sold)
-            ):
+            if plan.matches(candidate_data):
                 filtered_candidates.append(candidate_data)
 
         return filtered_candidates
@@ -147,45 +246,73 @@ async def filter_candidates(
         raise HTTPException(status_code=400, detail=str(e))
 
 # Endpoint to bookmark a candidate
-@app.post("/candidates/{candidate_id}/bookmark/")
+@router.post("/candidates/{candidate_id}/bookmark/")
 async def bookmark_candidate(candidate_id: str, recruiter_id: str):
+    from firebase_admin import firestore
+    from google.api_core.exceptions import NotFound
     try:
         candidate_ref = db.collection("candidates").document(candidate_id)
         recruiter_ref = db.collection("recruiters").document(recruiter_id)
-        
-        candidate = candidate_ref.get()
-        recruiter = recruiter_ref.get()
-        
-        if not candidate.exists:
-            raise HTTPException(status_code=404, detail="Candidate not found")
-        
-        candidate_data = candidate.to_dict()
-        if recruiter_id not in candidate_data.get("bookmarked_by", []):
-            # Update bookmarked_by list in candidate document
-            bookmarked_by = candidate_data.get("bookmarked_by", [])
-            bookmarked_by.append(recruiter_id)
-            candidate_ref.update({"bookmarked_by": bookmarked_by})
-        
-        if recruiter.exists:
-            recruiter_data = recruiter.to_dict()
-            if "bookmarked_candidates" not in recruiter_data:
-                recruiter_data["bookmarked_candidates"] = []
-            if candidate_id not in recruiter_data["bookmarked_candidates"]:
-                recruiter_data["bookmarked_candidates"].append(candidate_id)
-                recruiter_ref.update({"bookmarked_candidates": recruiter_data["bookmarked_candidates"]})
-        else:
-            recruiter_ref.set({"bookmarked_candidates": [candidate_id]})
-        
+
+        # update() only succeeds if the candidate exists, so the batch doubles as the existence check
+        batch = db.batch()
+        batch.update(candidate_ref, {"bookmarked_by": firestore.ArrayUnion([recruiter_id])})
+        batch.set(recruiter_ref, {"bookmarked_candidates": firestore.ArrayUnion([candidate_id])}, merge=True)
+        await batch.commit()
+
         return {"message": "Candidate bookmarked successfully."}
+    except NotFound:
+        raise HTTPException(status_code=404, detail="Candidate not found")
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+# Endpoint to bookmark many candidates at once
+@router.post("/recruiters/{recruiter_id}/bookmarks/bulk/")
+async def bulk_bookmark_candidates(recruiter_id: str, candidate_ids: List[str]):
+    from firebase_admin import firestore
+    from google.api_core.exceptions import NotFound
+    try:
+        candidate_ids = list(dict.fromkeys(candidate_ids))  # Drop duplicates, keep order
+        candidates_ref = db.collection("candidates")
+        recruiter_ref = db.collection("recruiters").document(recruiter_id)
+
+        # Skip unknown IDs up front instead of failing the whole batch
+        refs = [candidates_ref.document(candidate_id) for candidate_id in candidate_ids]
+        existing = {doc.id for doc in await get_all(refs, field_paths=["candidate_id"]) if doc.exists}
+        bookmarked = [candidate_id for candidate_id in candidate_ids if candidate_id in existing]
+        missing = [candidate_id for candidate_id in candidate_ids if candidate_id not in existing]
+
+        # One write per candidate plus the recruiter write in each batch
+        chunk_size = BATCH_LIMIT - 1
+        for start in range(0, len(bookmarked), chunk_size):
+            chunk = bookmarked[start:start + chunk_size]
+            batch = db.batch()
+            for candidate_id in chunk:
+                batch.update(candidates_ref.document(candidate_id), {"bookmarked_by": firestore.ArrayUnion([recruiter_id])})
+            batch.set(recruiter_ref, {"bookmarked_candidates": firestore.ArrayUnion(chunk)}, merge=True)
+            await batch.commit()
+
+        return {
+            "message": f"{len(bookmarked)} candidates bookmarked successfully.",
+            "bookmarked": bookmarked,
+            "not_found": missing
+        }
+    except NotFound:
+        raise HTTPException(status_code=404, detail="Candidate not found")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # Endpoint to list all bookmarks for a recruiter
-@app.get("/recruiters/{recruiter_id}/bookmarks/")
-async def list_bookmarked_candidates(recruiter_id: str):
+@router.get("/recruiters/{recruiter_id}/bookmarks/")
+async def list_bookmarked_candidates(
+    recruiter_id: str,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    offset: int = Query(0, ge=0),
+):
+    from firebase_admin import firestore
     try:
         recruiter_ref = db.collection("recruiters").document(recruiter_id)
-        recruiter = recruiter_ref.get()
+        recruiter = await recruiter_ref.get()
         
         if not recruiter.exists:
             return {"message": "No bookmarks found"}
@@ -195,63 +322,87 @@ async def list_bookmarked_candidates(recruiter_id: str):
         
         if not candidate_ids:
             return {"message": "No bookmarks found"}
-        
+
+        # Fetch the page in concurrent get_all() chunks instead of one get() per bookmark
+        page_ids = candidate_ids[offset:offset + limit]
+        candidates_ref = db.collection("candidates")
+        refs = [candidates_ref.document(candidate_id) for candidate_id in page_ids]
+        docs = {doc.id: doc for doc in await get_all(refs)}
+
+        # Keep bookmark order; deleted candidates are pruned from the recruiter lazily
         candidates = []
-        for candidate_id in candidate_ids:
-            candidate_ref = db.collection("candidates").document(candidate_id)
-            candidate_doc = candidate_ref.get()
-            if candidate_doc.exists:
+        missing = []
+        for candidate_id in page_ids:
+            candidate_doc = docs.get(candidate_id)
+            if candidate_doc is not None and candidate_doc.exists:
                 candidates.append(candidate_doc.to_dict())
+            else:
+                missing.append(candidate_id)
+
+        if missing:
+            await recruiter_ref.update({"bookmarked_candidates": firestore.ArrayRemove(missing)})
         
         return candidates
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 # Endpoint to remove a bookmark
-@app.delete("/candidates/{candidate_id}/bookmark/")
+@router.delete("/candidates/{candidate_id}/bookmark/")
 async def remove_bookmark(candidate_id: str, recruiter_id: str):
+    from firebase_admin import firestore
+    from google.api_core.exceptions import NotFound
     try:
         candidate_ref = db.collection("candidates").document(candidate_id)
         recruiter_ref = db.collection("recruiters").document(recruiter_id)
-        
-        candidate = candidate_ref.get()
-        recruiter = recruiter_ref.get()
-        
-        if not candidate.exists:
-            raise HTTPException(status_code=404, detail="Candidate not found")
-        
-        candidate_data = candidate.to_dict()
-        if recruiter_id in candidate_data.get("bookmarked_by", []):
-            bookmarked_by = candidate_data.get("bookmarked_by", [])
-            bookmarked_by.remove(recruiter_id)
-            candidate_ref.update({"bookmarked_by": bookmarked_by})
-        
-        if recruiter.exists:
-            recruiter_data = recruiter.to_dict()
-            if "bookmarked_candidates" in recruiter_data and candidate_id in recruiter_data["bookmarked_candidates"]:
-                recruiter_data["bookmarked_candidates"].remove(candidate_id)
-                recruiter_ref.update({"bookmarked_candidates": recruiter_data["bookmarked_candidates"]})
-        
+
+        batch = db.batch()
+        batch.update(candidate_ref, {"bookmarked_by": firestore.ArrayRemove([recruiter_id])})
+        batch.set(recruiter_ref, {"bookmarked_candidates": firestore.ArrayRemove([candidate_id])}, merge=True)
+        await batch.commit()
+
         return {"message": "Bookmark removed successfully."}
+    except NotFound:
+        raise HTTPException(status_code=404, detail="Candidate not found")
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 
+@async_transactional
+async def delete_in_transaction(transaction, candidate_ref) -> bool:
+    """Delete a candidate and decrement the counter only if it still existed."""
+    candidate = await candidate_ref.get(transaction=transaction)
+    if not candidate.exists:
+        return False
+    transaction.delete(candidate_ref)
+    add_tombstones(db, transaction, [candidate_ref.id])
+    add_to_counts(db, transaction, candidates=-1)
+    candidate_data = candidate.to_dict()
+    add_to_rollups(db, transaction, [(candidate_data, -1)])
+    add_to_price_sketches(db, transaction, candidate_data, -1)
+    add_to_aging(db, transaction, [(candidate_data, -1)])
+    add_to_facets(db, transaction, [(candidate_data, -1)])
+    return True
+
 # Endpoint to delete a candidate
-@app.delete("/candidates/{candidate_id}/")
+@router.delete("/candidates/{candidate_id}/")
 async def delete_candidate(candidate_id: str):
     try:
         candidate_ref = db.collection("candidates").document(candidate_id)
-        candidate = candidate_ref.get()
 
-        if candidate.exists:
-            candidate_ref.delete()
+        if await delete_in_transaction(db.transaction(), candidate_ref):
+            candidate_index.remove(candidate_id)
+            match_engine.remove_candidate(candidate_id)
             return {"message": "Candidate deleted successfully"}
         else:
             raise HTTPException(status_code=404, detail="Candidate not found")
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 # Run the application
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,307 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional
+
+from rollups import DAY, HOUR, META_DOC, MONTH, as_utc, bucket_id, bucket_start, plan_bucket_ids, write_buckets
+
+# Chat message counts per day and month, overall and per sending recruiter
+CHAT_ROLLUP_COLLECTION = "chat_rollups"
+MESSAGES_COLLECTION = "messages"
+
+# Message fields as the chat clients write them
+TYPE_FIELD = "content.type"
+TIME_FIELD = "timestamp"
+SENDER_FIELD = "sender_id"
+
+# content.type of the card that opens a chat about a candidate, and of a price quote
+CHAT_TYPE = "candidate_card"
+QUOTE_TYPE = "quote_price"
+MESSAGE_TYPES = (CHAT_TYPE, QUOTE_TYPE)
+
+# Month buckets answer whole months, day buckets the edges of a window
+GRANULARITIES = (DAY, MONTH)
+
+# The sync re-reads this far behind its watermark, so messages committed up to
+# this long after their timestamp (slow or briefly offline clients) are still
+# counted. Later ones are only counted by a rebuild.
+SYNC_LOOKBACK = timedelta(hours=1)
+
+# IDs of the messages the sync counted, one document per hour of message
+# timestamps, kept in the rollup collection so the messages themselves are
+# never written. Documents older than the lookback are deleted by the sync.
+COUNTED_PREFIX = "_counted-"
+
+# Messages counted per transaction; its writes are a few buckets and ID documents
+MESSAGES_PER_COMMIT = 500
+
+# Composite indexes for the count() baseline and the funnel's sale counts
+INDEXES = [
+    {"collectionGroup": MESSAGES_COLLECTION, "queryScope": "COLLECTION", "fields": [
+        {"fieldPath": TYPE_FIELD, "order": "ASCENDING"},
+        {"fieldPath": TIME_FIELD, "order": "ASCENDING"},
+    ]},
+    {"collectionGroup": MESSAGES_COLLECTION, "queryScope": "COLLECTION", "fields": [
+        {"fieldPath": TYPE_FIELD, "order": "ASCENDING"},
+        {"fieldPath": SENDER_FIELD, "order": "ASCENDING"},
+        {"fieldPath": TIME_FIELD, "order": "ASCENDING"},
+    ]},
+    {"collectionGroup": "candidate_selling", "queryScope": "COLLECTION", "fields": [
+        {"fieldPath": "seller_id", "order": "ASCENDING"},
+        {"fieldPath": "timestamp", "order": "ASCENDING"},
+    ]},
+]
+
+# The recruiter map holds one entry per sender and the counted map one per
+# message; indexing them would only cost writes
+FIELD_OVERRIDES = [
+    {"collectionGroup": CHAT_ROLLUP_COLLECTION, "fieldPath": field, "indexes": []}
+    for field in ("recruiter", "counted")
+]
+
+
+def message_type(message: dict) -> Optional[str]:
+    content = message.get("content")
+    if isinstance(content, dict) and content.get("type") in MESSAGE_TYPES:
+        return content["type"]
+    return None
+
+
+def message_time(message: dict) -> Optional[datetime]:
+    moment = message.get(TIME_FIELD)
+    return as_utc(moment) if isinstance(moment, datetime) else None
+
+
+def _sender(message: dict) -> str:
+    # Firestore map keys cannot be empty
+    return str(message.get(SENDER_FIELD) or "").strip() or "unspecified"
+
+
+def chat_deltas(messages: Iterable[dict]) -> Dict[str, dict]:
+    """Per bucket document: start, granularity and count deltas for chat and quote messages."""
+    buckets: Dict[str, dict] = {}
+    for message in messages:
+        kind, moment = message_type(message), message_time(message)
+        if kind is None or moment is None:
+            continue
+        for granularity in GRANULARITIES:
+            start = bucket_start(moment, granularity)
+            bucket = buckets.setdefault(bucket_id(start, granularity), {
+                "granularity": granularity, "start": start, "totals": {}, "recruiter": {},
+            })
+            bucket["totals"][kind] = bucket["totals"].get(kind, 0) + 1
+            sender = bucket["recruiter"].setdefault(_sender(message), {})
+            sender[kind] = sender.get(kind, 0) + 1
+    return buckets
+
+
+def add_to_chat_rollups(client, writer, messages: Iterable[dict]):
+    """Queue rollup increments on the batch or transaction that writes or flags the messages."""
+    from firebase_admin import firestore
+    collection = client.collection(CHAT_ROLLUP_COLLECTION)
+    for doc_id, bucket in chat_deltas(messages).items():
+        writer.set(collection.document(doc_id), {
+            "granularity": bucket["granularity"],
+            "start": bucket["start"],
+            "totals": {kind: firestore.Increment(n) for kind, n in bucket["totals"].items()},
+            "recruiter": {
+                sender: {kind: firestore.Increment(n) for kind, n in counts.items()}
+                for sender, counts in bucket["recruiter"].items()
+            },
+        }, merge=True)
+
+
+def counted_doc_id(moment: datetime) -> str:
+    return f"{COUNTED_PREFIX}{bucket_start(moment, HOUR):%Y-%m-%dT%H}"
+
+
+def _count_chunk(sync_db, messages: Dict[str, dict]) -> int:
+    """Count the messages ({id: data}) not counted yet, with their IDs, in one transaction.
+
+    The ID documents are read in the transaction, so concurrent syncs never
+    count a message twice. Returns the messages counted.
+    """
+    from firebase_admin import firestore
+    collection = sync_db.collection(CHAT_ROLLUP_COLLECTION)
+    hours: Dict[str, List[str]] = {}
+    for message_id, data in messages.items():
+        hours.setdefault(counted_doc_id(message_time(data)), []).append(message_id)
+
+    @firestore.transactional
+    def count(transaction) -> int:
+        refs = [collection.document(doc_id) for doc_id in hours]
+        counted = {doc.id: (doc.to_dict() or {}).get("counted") or {}
+                   for doc in sync_db.get_all(refs, transaction=transaction) if doc.exists}
+        fresh = {doc_id: [message_id for message_id in ids if message_id not in counted.get(doc_id, {})]
+                 for doc_id, ids in hours.items()}
+        add_to_chat_rollups(sync_db, transaction, [messages[message_id] for ids in fresh.values() for message_id in ids])
+        for doc_id, ids in fresh.items():
+            if ids:
+                transaction.set(collection.document(doc_id), {"counted": {message_id: True for message_id in ids}},
+                                merge=True)
+        return sum(len(ids) for ids in fresh.values())
+
+    return count(sync_db.transaction())
+
+
+def sync_chat_rollups(sync_db) -> int:
+    """Count chat and quote messages written since the last sync; returns the messages counted.
+
+    Run every few minutes (e.g. from cron). Each run re-reads SYNC_LOOKBACK
+    behind the newest message seen so far and skips the messages whose IDs
+    are already recorded, so overlapping or repeated runs never count a
+    message twice.
+    """
+    collection = sync_db.collection(CHAT_ROLLUP_COLLECTION)
+    meta_ref = collection.document(META_DOC)
+    meta = meta_ref.get().to_dict() or {}
+    if not meta.get("built_at"):
+        raise RuntimeError("Chat rollups are not built yet; run `python chat_rollups.py rebuild` first")
+
+    # Messages up to rebuilt_through were counted by the rebuild without recording their IDs
+    watermark = as_utc(meta["watermark"])
+    since = max(watermark - SYNC_LOOKBACK, as_utc(meta["rebuilt_through"]))
+    query = sync_db.collection(MESSAGES_COLLECTION)\
+        .where(TYPE_FIELD, "in", list(MESSAGE_TYPES))\
+        .where(TIME_FIELD, ">", since)\
+        .order_by(TIME_FIELD)
+
+    # Most of the lookback was counted by earlier runs; skip those without a transaction
+    first = bucket_start(since, HOUR)
+    id_refs = [collection.document(counted_doc_id(first + timedelta(hours=n)))
+               for n in range(int((datetime.now(timezone.utc) - first) / timedelta(hours=1)) + 2)]
+    known = {doc.id: set((doc.to_dict() or {}).get("counted") or {}) for doc in sync_db.get_all(id_refs) if doc.exists}
+
+    counted, pending = 0, {}
+    for doc in query.stream():
+        data = doc.to_dict()
+        moment = message_time(data)
+        if moment is None or message_type(data) is None:
+            continue
+        watermark = max(watermark, moment)
+        if doc.id in known.get(counted_doc_id(moment), ()):
+            continue
+        pending[doc.id] = data
+        if len(pending) == MESSAGES_PER_COMMIT:
+            counted += _count_chunk(sync_db, pending)
+            pending = {}
+    if pending:
+        counted += _count_chunk(sync_db, pending)
+
+    meta_ref.update({"watermark": watermark})
+    _drop_counted_before(sync_db, bucket_start(watermark - SYNC_LOOKBACK, HOUR))
+    return counted
+
+
+def _drop_counted_before(sync_db, cutoff: datetime):
+    """Delete the ID documents of hours the sync no longer re-reads."""
+    collection = sync_db.collection(CHAT_ROLLUP_COLLECTION)
+    stale = collection\
+        .where("__name__", ">=", collection.document(COUNTED_PREFIX))\
+        .where("__name__", "<", collection.document(counted_doc_id(cutoff)))\
+        .select([])\
+        .stream()
+    batch, pending = sync_db.batch(), 0
+    for doc in stale:
+        batch.delete(doc.reference)
+        pending += 1
+        if pending == 500:
+            batch.commit()
+            batch, pending = sync_db.batch(), 0
+    if pending:
+        batch.commit()
+
+
+def _merge(docs: Iterable[dict]) -> dict:
+    merged = {"totals": {}, "recruiter": {}}
+    for data in docs:
+        for kind, n in (data.get("totals") or {}).items():
+            merged["totals"][kind] = merged["totals"].get(kind, 0) + int(n or 0)
+        for sender, counts in (data.get("recruiter") or {}).items():
+            target = merged["recruiter"].setdefault(sender, {})
+            for kind, n in counts.items():
+                target[kind] = target.get(kind, 0) + int(n or 0)
+    return merged
+
+
+async def read_chat_rollups(db, start: Optional[datetime] = None, end: Optional[datetime] = None) -> Optional[dict]:
+    """{"totals": {type: n}, "recruiter": {sender: {type: n}}} for messages in [start, end].
+
+    Without a window every message is covered; None until a rebuild has seeded the rollups.
+    """
+    from datastore import get_all
+    collection = db.collection(CHAT_ROLLUP_COLLECTION)
+    if start is None:
+        meta = await collection.document(META_DOC).get()
+        if not meta.exists:
+            return None
+        docs = [doc async for doc in collection.where("granularity", "==", MONTH).stream()]
+    else:
+        ids = plan_bucket_ids(start, end or datetime.now(timezone.utc), MONTH)
+        docs = await get_all([collection.document(META_DOC)] + [collection.document(doc_id) for doc_id in ids])
+        if not any(doc.id == META_DOC and doc.exists for doc in docs):
+            return None
+        docs = [doc for doc in docs if doc.id != META_DOC]
+    return _merge(doc.to_dict() for doc in docs if doc.exists)
+
+
+def _windowed(query, field: str, start: Optional[datetime], end: Optional[datetime]):
+    if start is not None:
+        query = query.where(field, ">=", start)
+    if end is not None:
+        query = query.where(field, "<", end)
+    return query
+
+
+async def count_messages(db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                         sender: Optional[str] = None) -> Dict[str, int]:
+    """Messages per type from count() aggregations; billed per 1000 index entries, not per message."""
+    async def count(kind: str) -> int:
+        query = db.collection(MESSAGES_COLLECTION).where(TYPE_FIELD, "==", kind)
+        if sender is not None:
+            query = query.where(SENDER_FIELD, "==", sender)
+        result = await _windowed(query, TIME_FIELD, start, end).count(alias="count").get()
+        return int(result[0][0].value)
+
+    counts = await asyncio.gather(*(count(kind) for kind in MESSAGE_TYPES))
+    return dict(zip(MESSAGE_TYPES, counts))
+
+
+async def count_sales(db, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                      seller: Optional[str] = None) -> int:
+    query = db.collection("candidate_selling")
+    if seller is not None:
+        query = query.where("seller_id", "==", seller)
+    result = await _windowed(query, "timestamp", start, end).count(alias="count").get()
+    return int(result[0][0].value)
+
+
+def rebuild_chat_rollups(sync_db) -> int:
+    """Recompute every bucket from the messages collection; returns the buckets written.
+
+    Messages up to the newest one read are counted here without recording
+    their IDs; the sync continues from there.
+    """
+    docs = sync_db.collection(MESSAGES_COLLECTION).select([TYPE_FIELD, TIME_FIELD, SENDER_FIELD]).stream()
+    messages = [doc.to_dict() for doc in docs]
+    buckets = chat_deltas(messages)
+    written = write_buckets(sync_db, CHAT_ROLLUP_COLLECTION, buckets)
+
+    newest = max((moment for moment in map(message_time, messages) if moment), default=datetime.now(timezone.utc))
+    sync_db.collection(CHAT_ROLLUP_COLLECTION).document(META_DOC).update({
+        "watermark": newest, "rebuilt_through": newest,
+    })
+    return written
+
+
+if __name__ == "__main__":
+    # Run "sync" every few minutes (e.g. from cron) and "rebuild" once to initialise:
+    # python chat_rollups.py sync
+    command = sys.argv[1] if len(sys.argv) > 1 else "sync"
+    from datastore import sync_db
+    if command == "sync":
+        print(f"{sync_chat_rollups(sync_db)} messages counted")
+    elif command == "rebuild":
+        print(f"{rebuild_chat_rollups(sync_db)} chat rollup buckets written")
+    else:
+        sys.exit(f"Unknown command: {command}")
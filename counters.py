@@ -0,0 +1,95 @@
+import asyncio
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Collections with a materialised document count
+COUNTED_COLLECTIONS = ("recruiters", "candidates")
+
+# Shards spread counter writes; one Firestore document sustains about one write per second
+NUM_SHARDS = 10
+
+COUNTERS_COLLECTION = "counters"
+TOTALS_DOC = "totals"
+
+
+def shards_collection(client):
+    return client.collection(COUNTERS_COLLECTION).document(TOTALS_DOC).collection("shards")
+
+
+def shard_ref(client):
+    """A random counter shard."""
+    return shards_collection(client).document(str(random.randrange(NUM_SHARDS)))
+
+
+def add_to_counts(client, writer, **deltas: int):
+    """Queue counter increments on the batch or transaction that writes the counted documents.
+
+    The counter then changes in the same commit as the documents themselves,
+    e.g. add_to_counts(db, batch, candidates=len(created)).
+    """
+    from firebase_admin import firestore
+    increments = {field: firestore.Increment(delta) for field, delta in deltas.items() if delta}
+    if increments:
+        writer.set(shard_ref(client), increments, merge=True)
+
+
+def _sum_shards(shards) -> Dict[str, int]:
+    totals = {field: 0 for field in COUNTED_COLLECTIONS}
+    for shard in shards:
+        for field, value in (shard.to_dict() or {}).items():
+            if field in totals:
+                totals[field] += int(value or 0)
+    return totals
+
+
+async def read_counts(db) -> Optional[Dict[str, int]]:
+    """Counts from the counter shards; None until a reconcile run has seeded them.
+
+    Increments that land before the first reconcile only hold deltas, so the
+    shards are trusted once one of them carries reconciled_at.
+    """
+    shards = [shard async for shard in shards_collection(db).stream()]
+    if not any((shard.to_dict() or {}).get("reconciled_at") for shard in shards):
+        return None
+    return _sum_shards(shards)
+
+
+async def aggregate_counts(db) -> Dict[str, int]:
+    """Exact counts from count() aggregation queries; billed per 1000 index entries, not per document."""
+    results = await asyncio.gather(*(
+        db.collection(name).count(alias="count").get() for name in COUNTED_COLLECTIONS
+    ))
+    return {name: int(result[0][0].value) for name, result in zip(COUNTED_COLLECTIONS, results)}
+
+
+def reconcile_counts(sync_db) -> Dict[str, int]:
+    """Correct counter drift against count() aggregations; returns the applied corrections.
+
+    The correction is written as an increment, so writes that land between the
+    aggregation and the correction are kept; any remaining skew is picked up
+    by the next run.
+    """
+    from firebase_admin import firestore
+    current = _sum_shards(shards_collection(sync_db).stream())
+    drift = {}
+    for name in COUNTED_COLLECTIONS:
+        actual = int(sync_db.collection(name).count(alias="count").get()[0][0].value)
+        if actual != current[name]:
+            drift[name] = actual - current[name]
+    update = {field: firestore.Increment(delta) for field, delta in drift.items()}
+    update["reconciled_at"] = datetime.now(timezone.utc)
+    shard_ref(sync_db).set(update, merge=True)
+    return drift
+
+
+if __name__ == "__main__":
+    # Run periodically (e.g. hourly from cron) and once to initialise the counters:
+    # python counters.py reconcile
+    command = sys.argv[1] if len(sys.argv) > 1 else "reconcile"
+    if command == "reconcile":
+        from datastore import sync_db
+        print(f"Corrections applied: {reconcile_counts(sync_db) or 'none'}")
+    else:
+        sys.exit(f"Unknown command: {command}")
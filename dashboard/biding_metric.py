@@ -1,66 +1,67 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import credentials, firestore
-from datetime import datetime
-from dotenv import load_dotenv
-import os
-load_dotenv()
+from fastapi import APIRouter, HTTPException
+from datetime import datetime, timezone
+from enum import Enum
+from typing import Optional
+from bid_metrics import BID_FIELDS, aggregate_bids, read_bid_metrics, summarize
+from datastore import db
+from service import service_app
 
-# Initialize FastAPI app
-app = FastAPI()
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("CRED_PATH"))  # Replace with your actual JSON file path
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+router = APIRouter()
 
-@app.get("/bids/metrics")
-async def get_bid_metrics():
-    try:
-        # Fetch all documents from 'biding' collection
-        bids_ref = db.collection("biding")
-        bids = bids_ref.stream()
-
-        total_bids = 0
-        fulfilled_bids = 0
-        fulfill_times = []
+class Breakdown(str, Enum):
+    role = "role"
+    recruiter = "recruiter"
 
-        for bid in bids:
-            data = bid.to_dict()
-            total_bids += 1
+def parse_date(value: str) -> datetime:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-            # Check if the bid is fulfilled
-            if data.get("fulfil") == True:
-                fulfilled_bids += 1
+@router.get("/bids/metrics")
+async def get_bid_metrics(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    breakdown: Optional[Breakdown] = None
+):
+    """
+    Bid totals, fulfilment rate and fulfil-time statistics.
 
-                # Ensure created_at and fulfil_time exist and are timestamps
-                created_at = data.get("created_at")
-                fulfil_time = data.get("fulfil_time")
+    Served from running aggregates kept per day and month of bid creation;
+    until `bid_metrics.py rebuild` has run it scans the biding collection.
+    Bids fulfilled outside `POST /biding/{id}/fulfil` are counted once
+    `bid_metrics.py reconcile` has run.
 
-                if isinstance(created_at, datetime) and isinstance(fulfil_time, datetime):
-                    fulfill_times.append((fulfil_time - created_at).total_seconds())
+    - **start_date**: Only bids created on or after this day (format: YYYY-MM-DD)
+    - **end_date**: Only bids created on or before this day; defaults to today
+    - **breakdown**: Also report the metrics per role or per recruiter
+    """
+    if end_date and not start_date:
+        raise HTTPException(status_code=400, detail="start_date is required with end_date")
+    start = parse_date(start_date) if start_date else None
+    end = parse_date(end_date) if end_date else None
 
-        # Calculate average fulfill time (convert seconds to days)
-        avg_fulfill_time_seconds = sum(fulfill_times) / len(fulfill_times) if fulfill_times else 0
-        avg_fulfill_time_days = avg_fulfill_time_seconds / 86400  # Convert to days
+    try:
+        metrics = await read_bid_metrics(db, start, end)
+        source = "rollup"
+        if metrics is None:
+            bids = [doc.to_dict() async for doc in db.collection("biding").select(BID_FIELDS).stream()]
+            metrics = aggregate_bids(bids, start, end)
+            source = "raw"
 
-        return {
-            "total_bids": total_bids,
-            "fulfilled_bids": fulfilled_bids,
-            "avg_fulfill_time_days": round(avg_fulfill_time_days, 2)  # Rounded to 2 decimal places
-        }
+        result = summarize(metrics["totals"])
+        result["source"] = source
+        if breakdown:
+            result[f"by_{breakdown.value}"] = {
+                group: summarize(values) for group, values in sorted(metrics[breakdown.value].items())
+            }
+        return result
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,33 +1,20 @@
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-import firebase_admin
-from firebase_admin import credentials, firestore
+from fastapi import APIRouter, Query, HTTPException, Request
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, List, Optional
 from dateutil.relativedelta import relativedelta
-import pandas as pd
 from enum import Enum
-import os
-from dotenv import load_dotenv
-load_dotenv()
+from streaming import ndjson_response, wants_ndjson
+from datastore import db
+from facet_catalog import CANDIDATE_FIELDS, TTLCache, build_catalog, read_catalog, summarize as summarize_facets
+from rollups import ROLLUP_GRANULARITY, CellFilter, read_rollups, series_from_buckets
+from service import service_app
+from settings import get_settings
 
-# Initialize FastAPI
-app = FastAPI(title="Admin Dashboard API", description="API for admin dashboard time series data")
+# pandas adds noticeably to cold start; it is imported where a DataFrame is built
+if TYPE_CHECKING:
+    import pandas as pd
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Initialize Firebase
-# Replace with your Firebase service account credentials path
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+router = APIRouter()
 
 class TimeRange(str, Enum):
     one_day = "1d"
@@ -48,14 +35,24 @@ class Frequency(str, Enum):
     quarterly = "quarterly"
     yearly = "yearly"
 
-def get_date_range(time_range: str, start_date: Optional[str] = None, end_date: Optional[str] = None):
-    """Generate start and end dates based on selected time range or custom range."""
-    today = datetime.now()
+def get_date_range(time_range: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   tz: str = "UTC"):
+    """Generate start and end dates based on selected time range or custom range.
+
+    Both are aware datetimes in `tz`; custom dates start at its midnight.
+    """
+    from timebuckets import resolve_tz
+
+    try:
+        zone = resolve_tz(tz) or timezone.utc
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    today = datetime.now(zone)
     
     if time_range == TimeRange.custom and start_date and end_date:
         try:
-            start = datetime.strptime(start_date, "%Y-%m-%d")
-            end = datetime.strptime(end_date, "%Y-%m-%d")
+            start = datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=zone)
+            end = datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=zone)
             return start, end
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
@@ -121,7 +118,7 @@ def build_firestore_query(
     return query
 
 def apply_additional_filters(
-    df: pd.DataFrame,
+    df: "pd.DataFrame",
     roles: Optional[List[str]] = None,
     city: Optional[List[str]] = None,
     min_experience: Optional[float] = None,
@@ -160,7 +157,7 @@ def apply_additional_filters(
     
     return df
 
-def fetch_candidates_data(
+async def fetch_candidates_data(
     start_date: datetime, 
     end_date: datetime,
     roles: Optional[List[str]] = None,
@@ -172,6 +169,8 @@ def fetch_candidates_data(
     sold: Optional[bool] = None
 ):
     """Fetch candidate registration data from Firebase Firestore with filters."""
+    import pandas as pd
+
     # Assuming 'candidates' is your collection and it has a 'created_at' timestamp field
     candidates_ref = db.collection('candidates')
     
@@ -194,7 +193,7 @@ def fetch_candidates_data(
     
     # Convert to DataFrame for easier filtering and aggregation
     records = []
-    for doc in docs:
+    async for doc in docs:
         data = doc.to_dict()
         records.append({
             'id': doc.id,
@@ -223,89 +222,17 @@ def fetch_candidates_data(
     
     return filtered_df
 
-def aggregate_data(df: pd.DataFrame, start_date: datetime, end_date: datetime, frequency: str):
-    """Aggregate data based on the specified frequency."""
-    if df.empty:
-        return []
-    
-    # Convert timestamp to datetime
-    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
-    
-    # Set up time bins based on frequency
-    if frequency == Frequency.hourly:
-        df['time_bin'] = df['created_at'].dt.floor('H')
-        date_range = pd.date_range(start=start_date.replace(minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(minute=0, second=0, microsecond=0), 
-                                  freq='H')
-        format_str = '%Y-%m-%d %H:00'
-        
-    elif frequency == Frequency.daily:
-        df['time_bin'] = df['created_at'].dt.floor('D')
-        date_range = pd.date_range(start=start_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='D')
-        format_str = '%Y-%m-%d'
-        
-    elif frequency == Frequency.weekly:
-        df['time_bin'] = df['created_at'].dt.to_period('W').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='W-MON')
-        format_str = '%Y-%m-%d'
-        
-    elif frequency == Frequency.monthly:
-        df['time_bin'] = df['created_at'].dt.to_period('M').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='MS')
-        format_str = '%Y-%m'
-        
-    elif frequency == Frequency.quarterly:
-        df['time_bin'] = df['created_at'].dt.to_period('Q').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='QS')
-        format_str = '%Y-Q%q'
-        
-    else:  # yearly
-        df['time_bin'] = df['created_at'].dt.to_period('Y').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='YS')
-        format_str = '%Y'
+def aggregate_data(df: "pd.DataFrame", start_date: datetime, end_date: datetime, frequency: str):
+    """Count candidates per period of the specified frequency, zero-filled for empty periods.
 
-    # Count candidates per time bin
-    counts = df.groupby('time_bin').size().reset_index(name='count')
-    counts_dict = dict(zip(counts['time_bin'], counts['count']))
-    
-    # Create full date range with zeros for missing dates
-    result = []
-    for date in date_range:
-        period_start = date
-        
-        # For weekly, we want the week ending date too
-        if frequency == Frequency.weekly:
-            period_end = date + timedelta(days=6)
-            label = f"{period_start.strftime('%Y-%m-%d')} to {period_end.strftime('%Y-%m-%d')}"
-        elif frequency == Frequency.monthly:
-            label = period_start.strftime('%b %Y')
-        elif frequency == Frequency.quarterly:
-            quarter = (period_start.month - 1) // 3 + 1
-            label = f"Q{quarter} {period_start.year}"
-        elif frequency == Frequency.yearly:
-            label = str(period_start.year)
-        else:
-            label = period_start.strftime(format_str)
-            
-        result.append({
-            'period': label,
-            'count': counts_dict.get(period_start, 0),
-            'timestamp': period_start.timestamp()
-        })
-    
-    return result
+    Periods are cut in the timezone of `start_date` (UTC when it is naive).
+    """
+    import timebuckets
+
+    instants = df['created_at'].to_numpy() if not df.empty else []
+    return timebuckets.series(instants, start_date, end_date, Frequency(frequency).value, start_date.tzinfo)
 
-@app.get("/candidates/time-series")
+@router.get("/candidates/time-series")
 async def get_candidates_time_series(
     time_range: TimeRange = TimeRange.seven_days,
     frequency: Optional[Frequency] = None,
@@ -317,7 +244,8 @@ async def get_candidates_time_series(
     max_experience: Optional[float] = None,
     min_ctc: Optional[float] = None,
     max_ctc: Optional[float] = None,
-    sold: Optional[bool] = None
+    sold: Optional[bool] = None,
+    tz: str = "UTC"
 ):
     """
     Get time series data for candidate registrations with filtering options.
@@ -333,36 +261,53 @@ async def get_candidates_time_series(
     - **min_ctc**: Filter by minimum CTC (in whatever currency unit you use)
     - **max_ctc**: Filter by maximum CTC
     - **sold**: Filter by sold status (true/false)
+    - **tz**: IANA timezone the range and periods are cut in (default UTC)
     """
     try:
         # Get date range
-        start, end = get_date_range(time_range, start_date, end_date)
+        start, end = get_date_range(time_range, start_date, end_date, tz)
         
         # Determine appropriate frequency if not specified
         freq = determine_frequency(start, end, frequency)
         
-        # Fetch and filter data from Firebase
-        df = fetch_candidates_data(
-            start, 
-            end,
-            roles,
-            city,
-            min_experience,
-            max_experience,
-            min_ctc,
-            max_ctc,
-            sold
-        )
-        
-        # Aggregate data
-        time_series_data = aggregate_data(df, start, end, freq)
+        # Serve from the hourly/daily/monthly rollups; the bucket reads depend on
+        # the range, not on how many candidates it holds. Buckets are cut at UTC
+        # boundaries, so other timezones are binned from the candidates themselves.
+        counts = None
+        if start.tzinfo is timezone.utc:
+            cell_filter = CellFilter(roles, city, min_experience, max_experience, min_ctc, max_ctc, sold)
+            counts = await read_rollups(db, start, end, ROLLUP_GRANULARITY[Frequency(freq).value], cell_filter)
+
+        if counts is not None:
+            time_series_data = series_from_buckets(counts, start, end, freq)
+            total_candidates = sum(values["count"] for values in counts.values())
+            source = "rollup"
+        else:
+            # Rollups not built yet, a range filter that splits a band, or a local timezone: scan candidates
+            df = await fetch_candidates_data(
+                start, 
+                end,
+                roles,
+                city,
+                min_experience,
+                max_experience,
+                min_ctc,
+                max_ctc,
+                sold
+            )
+            
+            # Aggregate data
+            time_series_data = aggregate_data(df, start, end, freq)
+            total_candidates = int(df['id'].count()) if not df.empty else 0
+            source = "raw"
         
         # Get active filters for response metadata
         active_filters = {
             "time_range": time_range,
             "frequency": freq,
             "start_date": start.strftime("%Y-%m-%d"),
-            "end_date": end.strftime("%Y-%m-%d")
+            "end_date": end.strftime("%Y-%m-%d"),
+            "tz": tz
         }
         
         if roles:
@@ -383,59 +328,58 @@ async def get_candidates_time_series(
         return {
             "filters": active_filters,
             "data_points": len(time_series_data),
-            "total_candidates": int(df['id'].count()) if not df.empty else 0,
+            "total_candidates": total_candidates,
+            "source": source,
             "data": time_series_data
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def load_filter_options():
+    """Filter options from the facet catalog, or from a candidate scan until it is built."""
+    catalog = await read_catalog(db)
+    source = "catalog"
+    if catalog is None:
+        docs = db.collection('candidates').select(CANDIDATE_FIELDS).stream()
+        catalog = build_catalog([doc.to_dict() async for doc in docs])
+        source = "raw"
+    return {**summarize_facets(catalog), "source": source}
+
+# Every worker reads the catalog at most once per TTL, however many dashboards load at once
+filter_options_cache = TTLCache(load_filter_options, get_settings().facet_cache_ttl)
+
 # Add endpoint to get available filter options
-@app.get("/candidates/filter-options")
-async def get_filter_options():
-    """Get all available options for filtering candidates."""
+@router.get("/candidates/filter-options")
+async def get_filter_options(request: Request):
+    """Get all available options for filtering candidates.
+
+    Values come with their candidate counts and the numeric ranges with
+    histograms, under "counts". With Accept: application/x-ndjson, one line is
+    sent per role and city, followed by one line per numeric range.
+    """
     try:
-        candidates_ref = db.collection('candidates')
-        docs = candidates_ref.stream()
-        
-        # Extract unique values for each filter
-        roles = set()
-        city = set()
-        experience_values = []
-        ctc_values = []
-        
-        for doc in docs:
-            data = doc.to_dict()
-            if 'role' in data and data['role']:
-                roles.add(data['role'])
-            if 'city' in data and data['city']:
-                city.add(data['city'])
-            if 'experience' in data and data['experience'] is not None:
-                experience_values.append(data['experience'])
-            if 'ctc' in data and data['ctc'] is not None:
-                ctc_values.append(data['ctc'])
-        
-        # Calculate min/max ranges for numeric fields
-        experience_range = {
-            "min": min(experience_values) if experience_values else 0,
-            "max": max(experience_values) if experience_values else 0
-        }
-        
-        ctc_range = {
-            "min": min(ctc_values) if ctc_values else 0,
-            "max": max(ctc_values) if ctc_values else 0
-        }
-        
-        return {
-            "roles": sorted(list(roles)),
-            "city": sorted(list(city)),
-            "experience_range": experience_range,
-            "ctc_range": ctc_range
-        }
+        options = await filter_options_cache.get()
+
+        if wants_ndjson(request):
+            async def records():
+                for field, name in (("role", "roles"), ("city", "city")):
+                    for value in options[name]:
+                        yield {"field": field, "value": value}
+                yield {"field": "experience_range", "value": options["experience_range"]}
+                yield {"field": "ctc_range", "value": options["ctc_range"]}
+            return ndjson_response(records())
+
+        return options
     
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router, title="Admin Dashboard API", description="API for admin dashboard time series data")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
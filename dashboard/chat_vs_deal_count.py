@@ -1,59 +1,102 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import credentials, firestore
-from dotenv import load_dotenv
-import os
-load_dotenv()
-
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("CRED_PATH"))  # Update the path
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-app = FastAPI()
-
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/chat-deal-counts")
-def get_chat_deal_counts():
+from fastapi import APIRouter, HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from chat_rollups import CHAT_TYPE, QUOTE_TYPE, count_messages, count_sales, read_chat_rollups
+from datastore import db
+from service import service_app
+
+router = APIRouter()
+
+def parse_date(value: str) -> datetime:
     try:
-        # Reference to 'messages' collection
-        messages_ref = db.collection("messages")
-        messages = messages_ref.get()
+        return datetime.strptime(value, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
 
-        # Initialize counters
-        total_chat_initialize = 0
-        total_deal_final = 0
+def parse_window(start_date: Optional[str], end_date: Optional[str]):
+    """First day and the day after the last one; like the rollups, a window covers whole days."""
+    if end_date and not start_date:
+        raise HTTPException(status_code=400, detail="start_date is required with end_date")
+    start = parse_date(start_date) if start_date else None
+    end = parse_date(end_date) if end_date else None
+    if start and end and end < start:
+        raise HTTPException(status_code=400, detail="end_date must not be before start_date")
+    if start and end is None:
+        end = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return start, end + timedelta(days=1) if end else None
 
-        # Iterate through each document in the messages collection
-        for message in messages:
-            data = message.to_dict()
-            content = data.get("content", {})
+async def message_counts(start: Optional[datetime], end: Optional[datetime], recruiter_id: Optional[str] = None):
+    """Chat and quote counts from the rollups, or from count() aggregations until they are built."""
+    rollup = await read_chat_rollups(db, start, end - timedelta(days=1) if end else None)
+    if rollup is not None:
+        counts = rollup["recruiter"].get(recruiter_id, {}) if recruiter_id else rollup["totals"]
+        return counts, "rollup"
+    return await count_messages(db, start, end, recruiter_id), "count"
 
-            if isinstance(content, dict):  # Ensure content is a dictionary
-                content_type = content.get("type", "")
+@router.get("/chat-deal-counts")
+async def get_chat_deal_counts(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None
+):
+    """
+    Chats opened with a candidate card and deals quoted with a price.
 
-                if content_type == "candidate_card":
-                    total_chat_initialize += 1
-                elif content_type == "quote_price":
-                    total_deal_final += 1
+    - **start_date**: Only messages sent on or after this day (format: YYYY-MM-DD)
+    - **end_date**: Only messages sent on or before this day; defaults to today
+    """
+    start, end = parse_window(start_date, end_date)
+    try:
+        counts, source = await message_counts(start, end)
+        return {
+            "total_chat_initialize": counts.get(CHAT_TYPE, 0),
+            "total_deal_final": counts.get(QUOTE_TYPE, 0),
+            "source": source
+        }
 
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/chat-deal-funnel")
+async def get_chat_deal_funnel(
+    start_date: Optional[str] = None,
+    end_date: Optional[str] = None,
+    recruiter_id: Optional[str] = None
+):
+    """
+    Chat-to-deal funnel: chats opened, prices quoted and candidates sold, with conversion rates.
+
+    - **start_date**: Only activity on or after this day (format: YYYY-MM-DD)
+    - **end_date**: Only activity on or before this day; defaults to today
+    - **recruiter_id**: Only chats and quotes sent by, and sales made by, this recruiter
+    """
+    start, end = parse_window(start_date, end_date)
+    try:
+        counts, source = await message_counts(start, end, recruiter_id)
+        sales = await count_sales(db, start, end, recruiter_id)
+
+        chats = counts.get(CHAT_TYPE, 0)
+        quotes = counts.get(QUOTE_TYPE, 0)
         return {
-            "total_chat_initialize": total_chat_initialize,
-            "total_deal_final": total_deal_final
+            "start_date": start_date,
+            "end_date": (end - timedelta(days=1)).strftime("%Y-%m-%d") if end else None,
+            "recruiter_id": recruiter_id,
+            "stages": [
+                {"stage": "chat_initiated", "count": chats},
+                {"stage": "price_quoted", "count": quotes},
+                {"stage": "sold", "count": sales}
+            ],
+            "chat_to_quote_rate": round(quotes / chats, 4) if chats else None,
+            "quote_to_sale_rate": round(sales / quotes, 4) if quotes else None,
+            "chat_to_sale_rate": round(sales / chats, 4) if chats else None,
+            "source": source
         }
 
     except Exception as e:
-        return {"error": str(e)}
+        raise HTTPException(status_code=500, detail=str(e))
+
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,28 +1,13 @@
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import credentials, firestore
-from dotenv import load_dotenv 
-import os
-load_dotenv()
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, parse_fields, project
+from streaming import ndjson_response, wants_ndjson
+from datastore import db
+from service import service_app
 
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+router = APIRouter()
 
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.post("/submit-feedback/")
-def submit_feedback(user_id: str, rating: int = 0, feedback: str | None = None):
+@router.post("/submit-feedback/")
+async def submit_feedback(user_id: str, rating: int = 0, feedback: str | None = None):
     if rating < 0 or rating > 5:
         raise HTTPException(status_code=400, detail="Rating must be between 0 and 5")
     
@@ -31,15 +16,42 @@ def submit_feedback(user_id: str, rating: int = 0, feedback: str | None = None):
         "rating": rating,
         "feedback": feedback,
     }
-    db.collection("feedbacks").add(feedback_data)
+    await db.collection("feedbacks").add(feedback_data)
     return {"message": "Feedback submitted successfully"}
 
-@app.get("/feedbacks/")
-def get_feedbacks():
-    feedbacks_ref = db.collection("feedbacks").stream()
-    feedback_list = [fb.to_dict() for fb in feedbacks_ref]
+@router.get("/feedbacks/")
+async def get_feedbacks(
+    request: Request,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: str | None = Query(None),
+    fields: str | None = Query(None),
+):
+    field_list = parse_fields(fields)
+
+    # Full export: stream every document instead of paging
+    if wants_ndjson(request):
+        query = db.collection("feedbacks")
+        if field_list:
+            query = query.select(field_list)
+        return ndjson_response(fb.to_dict() async for fb in query.stream())
+
+    feedbacks_ref, next_cursor = await fetch_page(
+        db.collection("feedbacks"),
+        order_by=(),
+        limit=limit,
+        start_after=start_after,
+        fields=field_list,
+    )
+    feedback_list = [project(fb.to_dict(), field_list) for fb in feedbacks_ref]
+    # The body stays a plain list, so the next page cursor travels in a header
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return feedback_list
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
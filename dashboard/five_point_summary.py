@@ -1,53 +1,60 @@
-import numpy as np
-from fastapi import FastAPI, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-import firebase_admin
-from firebase_admin import credentials, firestore
-from dotenv import load_dotenv 
-import os
-load_dotenv()
-
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
-
-app = FastAPI()
-
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-@app.get("/price-summary")
-async def get_price_summary():
-    # Fetch data from Firebase Firestore where 'sold' is True
-    docs = db.collection("candidates").where("sold", "==", True).stream()
-    
-    prices = [doc.to_dict().get("price", 0) for doc in docs if "price" in doc.to_dict()]
-
-    if not prices:
+from fastapi import APIRouter, HTTPException, Query
+from enum import Enum
+from typing import List, Optional
+from datastore import db
+from price_sketch import BREAKDOWNS, RELATIVE_ACCURACY, build_sketches, read_price_sketches
+from service import service_app
+
+router = APIRouter()
+
+class Breakdown(str, Enum):
+    role = "role"
+    city = "city"
+
+@router.get("/price-summary")
+async def get_price_summary(
+    percentiles: Optional[List[float]] = Query(None),
+    breakdown: Optional[Breakdown] = None
+):
+    """
+    Five-point summary of sale prices, from the sketch updated on every sale.
+
+    - **percentiles**: Extra percentiles to report (0-100), e.g. 90 and 99
+    - **breakdown**: Also summarise per role or per city
+
+    count, min, max and mean are exact; every percentile is within
+    `relative_error` (1%) of the exact sale price at that rank. Until
+    `price_sketch.py rebuild` has run, the sketch is built from a scan of the
+    sold candidates.
+    """
+    percentiles = percentiles or []
+    if any(not 0 <= p <= 100 for p in percentiles):
+        raise HTTPException(status_code=400, detail="Percentiles must be between 0 and 100")
+
+    try:
+        sketches = await read_price_sketches(db)
+        source = "sketch"
+        if sketches is None:
+            docs = db.collection("candidates").where("sold", "==", True).select(["price", *BREAKDOWNS]).stream()
+            sketches = build_sketches([doc.to_dict() async for doc in docs])
+            source = "raw"
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if sketches["all"].count <= 0:
         return {"message": "No data found for sold candidates"}
 
-    # Compute five-point summary
-    min_price = np.min(prices)
-    max_price = np.max(prices)
-    mean_price = np.mean(prices)
-    q25 = np.percentile(prices, 25)
-    q75 = np.percentile(prices, 75)
-
-    # Convert NumPy types to native Python types
-    return {
-        "min": float(min_price),
-        "max": float(max_price),
-        "mean": float(mean_price),
-        "25th_percentile": float(q25),
-        "75th_percentile": float(q75)
-    }
-
+    result = sketches["all"].summary(percentiles)
+    result["relative_error"] = RELATIVE_ACCURACY
+    result["source"] = source
+    if breakdown:
+        result[f"by_{breakdown.value}"] = {
+            name: sketch.summary(percentiles) for name, sketch in sorted(sketches[breakdown.value].items())
+        }
+    return result
+
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,42 +1,31 @@
-from fastapi import FastAPI
-from fastapi.middleware.cors import CORSMiddleware
-import os   
-from dotenv import load_dotenv
-load_dotenv()
-import firebase_admin
-from firebase_admin import credentials, firestore
+from fastapi import APIRouter
+from datastore import db
+from counters import aggregate_counts, read_counts
+from service import service_app
 
-# Initialize Firebase
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+router = APIRouter()
 
-app = FastAPI()
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+@router.get("/counts")
+async def get_counts(exact: bool = False):
+    """Recruiter and candidate totals.
 
-@app.get("/counts")
-def get_counts():
+    Served from the sharded counter, a read of a few small documents;
+    exact=true, or counters not yet seeded by counters.py reconcile, fall back
+    to count() aggregation queries.
+    """
     try:
-        # Fetch recruiters count
-        recruiters_ref = db.collection("recruiters")
-        recruiters_count = len(recruiters_ref.get())
+        counts = None if exact else await read_counts(db)
+        if counts is None:
+            counts = await aggregate_counts(db)
 
-        # Fetch candidates count
-        candidates_ref = db.collection("candidates")
-        candidates_count = len(candidates_ref.get())
-
-        return {"recruiters_count": recruiters_count, "candidates_count": candidates_count}
+        return {"recruiters_count": counts["recruiters"], "candidates_count": counts["candidates"]}
 
     except Exception as e:
         return {"error": str(e)}
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -1,34 +1,19 @@
 # transaction_api.py
-from fastapi import FastAPI, Query, HTTPException
-from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
-import firebase_admin
-from firebase_admin import credentials, firestore
+from fastapi import APIRouter, Query, HTTPException
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, List, Dict, Any, Optional
 from dateutil.relativedelta import relativedelta
-import pandas as pd
 from enum import Enum
-import os
-from dotenv import load_dotenv  
-load_dotenv()
+from datastore import db
+from rollups import ROLLUP_GRANULARITY, series_from_buckets
+from transaction_rollups import read_transaction_buckets
+from service import service_app
 
-# Initialize FastAPI
-app = FastAPI(title="Transaction Dashboard API", description="API for transaction time series data")
+# pandas adds noticeably to cold start; it is imported where a DataFrame is built
+if TYPE_CHECKING:
+    import pandas as pd
 
-# Configure CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # In production, specify exact origins
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-
-# Initialize Firebase
-# Replace with your Firebase service account credentials path
-cred = credentials.Certificate(os.getenv("CRED_PATH"))
-firebase_admin.initialize_app(cred)
-db = firestore.client()
+router = APIRouter()
 
 class TimeRange(str, Enum):
     one_day = "1d"
@@ -49,14 +34,24 @@ class Frequency(str, Enum):
     quarterly = "quarterly"
     yearly = "yearly"
 
-def get_date_range(time_range: str, start_date: Optional[str] = None, end_date: Optional[str] = None):
-    """Generate start and end dates based on selected time range or custom range."""
-    today = datetime.now()
+def get_date_range(time_range: str, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                   tz: str = "UTC"):
+    """Generate start and end dates based on selected time range or custom range.
+
+    Both are aware datetimes in `tz`; custom dates start at its midnight.
+    """
+    from timebuckets import resolve_tz
+
+    try:
+        zone = resolve_tz(tz) or timezone.utc
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    today = datetime.now(zone)
     
     if time_range == TimeRange.custom and start_date and end_date:
         try:
-            start = datetime.strptime(start_date, "%Y-%m-%d")
-            end = datetime.strptime(end_date, "%Y-%m-%d")
+            start = datetime.strptime(start_date, "%Y-%m-%d").replace(tzinfo=zone)
+            end = datetime.strptime(end_date, "%Y-%m-%d").replace(tzinfo=zone)
             return start, end
         except ValueError:
             raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
@@ -100,11 +95,13 @@ def determine_frequency(start_date: datetime, end_date: datetime, frequency: Opt
     else:
         return Frequency.yearly
 
-def fetch_transactions_data(
+async def fetch_transactions_data(
     start_date: datetime, 
     end_date: datetime
 ):
     """Fetch transaction data from Firebase Firestore within a date range."""
+    import pandas as pd
+
     # Using 'transactions' collection with a 'timestamp' field
     transactions_ref = db.collection('transactions')
     
@@ -116,7 +113,7 @@ def fetch_transactions_data(
     
     # Convert to DataFrame for easier aggregation
     records = []
-    for doc in docs:
+    async for doc in docs:
         data = doc.to_dict()
         records.append({
             'id': doc.id,
@@ -127,135 +124,94 @@ def fetch_transactions_data(
     df = pd.DataFrame(records)
     return df
 
-def aggregate_transaction_data(df: pd.DataFrame, start_date: datetime, end_date: datetime, frequency: str):
-    """Aggregate transaction data based on the specified frequency."""
-    if df.empty:
-        return []
-    
-    # Convert timestamp to datetime
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s')
-    
-    # Set up time bins based on frequency
-    if frequency == Frequency.hourly:
-        df['time_bin'] = df['timestamp'].dt.floor('H')
-        date_range = pd.date_range(start=start_date.replace(minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(minute=0, second=0, microsecond=0), 
-                                  freq='H')
-        format_str = '%Y-%m-%d %H:00'
-        
-    elif frequency == Frequency.daily:
-        df['time_bin'] = df['timestamp'].dt.floor('D')
-        date_range = pd.date_range(start=start_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='D')
-        format_str = '%Y-%m-%d'
-        
-    elif frequency == Frequency.weekly:
-        df['time_bin'] = df['timestamp'].dt.to_period('W').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='W-MON')
-        format_str = '%Y-%m-%d'
-        
-    elif frequency == Frequency.monthly:
-        df['time_bin'] = df['timestamp'].dt.to_period('M').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='MS')
-        format_str = '%Y-%m'
-        
-    elif frequency == Frequency.quarterly:
-        df['time_bin'] = df['timestamp'].dt.to_period('Q').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='QS')
-        format_str = '%Y-Q%q'
-        
-    else:  # yearly
-        df['time_bin'] = df['timestamp'].dt.to_period('Y').dt.start_time
-        date_range = pd.date_range(start=start_date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  end=end_date.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0), 
-                                  freq='YS')
-        format_str = '%Y'
+def aggregate_transaction_data(df: "pd.DataFrame", start_date: datetime, end_date: datetime, frequency: str):
+    """Count transactions per period of the specified frequency, zero-filled for empty periods.
 
-    # Count transactions per time bin
-    counts = df.groupby('time_bin').size().reset_index(name='count')
-    counts_dict = dict(zip(counts['time_bin'], counts['count']))
-    
-    # Create full date range with zeros for missing dates
-    result = []
-    for date in date_range:
-        period_start = date
-        
-        # For weekly, we want the week ending date too
-        if frequency == Frequency.weekly:
-            period_end = date + timedelta(days=6)
-            label = f"{period_start.strftime('%Y-%m-%d')} to {period_end.strftime('%Y-%m-%d')}"
-        elif frequency == Frequency.monthly:
-            label = period_start.strftime('%b %Y')
-        elif frequency == Frequency.quarterly:
-            quarter = (period_start.month - 1) // 3 + 1
-            label = f"Q{quarter} {period_start.year}"
-        elif frequency == Frequency.yearly:
-            label = str(period_start.year)
-        else:
-            label = period_start.strftime(format_str)
-            
-        result.append({
-            'period': label,
-            'count': counts_dict.get(period_start, 0),
-            'timestamp': period_start.timestamp()
-        })
-    
-    return result
+    Periods are cut in the timezone of `start_date` (UTC when it is naive).
+    """
+    import timebuckets
+
+    instants = df['timestamp'].to_numpy() if not df.empty else []
+    return timebuckets.series(instants, start_date, end_date, Frequency(frequency).value, start_date.tzinfo)
 
-@app.get("/transactions/time-series")
+@router.get("/transactions/time-series")
 async def get_transactions_time_series(
     time_range: TimeRange = TimeRange.seven_days,
     frequency: Optional[Frequency] = None,
     start_date: Optional[str] = None,
-    end_date: Optional[str] = None
+    end_date: Optional[str] = None,
+    tz: str = "UTC"
 ):
     """
     Get time series data for transactions with customizable time range.
+
+    Served from the hourly/daily/monthly buckets the Stripe webhook maintains,
+    with revenue (amount) next to counts; until `transaction_rollups.py
+    backfill` has run, or when periods are cut in a timezone other than UTC,
+    it falls back to scanning the transactions collection.
     
     - **time_range**: Predefined time range (1d, 7d, 1m, 3m, 6m, 1y, 2y, 5y, or custom)
     - **frequency**: Data aggregation frequency (hourly, daily, weekly, monthly, quarterly, yearly)
     - **start_date**: Required for custom time range (format: YYYY-MM-DD)
     - **end_date**: Required for custom time range (format: YYYY-MM-DD)
+    - **tz**: IANA timezone the range and periods are cut in (default UTC)
     """
     try:
         # Get date range
-        start, end = get_date_range(time_range, start_date, end_date)
+        start, end = get_date_range(time_range, start_date, end_date, tz)
         
         # Determine appropriate frequency if not specified
         freq = determine_frequency(start, end, frequency)
         
-        # Fetch transaction data from Firebase
-        df = fetch_transactions_data(start, end)
-        
-        # Aggregate data
-        time_series_data = aggregate_transaction_data(df, start, end, freq)
+        # Buckets are cut at UTC boundaries
+        buckets = None
+        if start.tzinfo is timezone.utc:
+            buckets = await read_transaction_buckets(db, start, end, ROLLUP_GRANULARITY[Frequency(freq).value])
+
+        if buckets is not None:
+            time_series_data = series_from_buckets(buckets, start, end, freq, metrics=("count", "amount_cents"))
+            for point in time_series_data:
+                point["amount"] = point.pop("amount_cents") / 100
+            total_transactions = sum(values["count"] for values in buckets.values())
+            total_amount = sum(values["amount_cents"] for values in buckets.values()) / 100
+            source = "rollup"
+        else:
+            # Fetch transaction data from Firebase
+            df = await fetch_transactions_data(start, end)
+            
+            # Aggregate data
+            time_series_data = aggregate_transaction_data(df, start, end, freq)
+            total_transactions = int(df['id'].count()) if not df.empty else 0
+            total_amount = None
+            source = "raw"
         
         # Prepare response metadata
         active_filters = {
             "time_range": time_range,
             "frequency": freq,
             "start_date": start.strftime("%Y-%m-%d"),
-            "end_date": end.strftime("%Y-%m-%d")
+            "end_date": end.strftime("%Y-%m-%d"),
+            "tz": tz
         }
         
         return {
             "filters": active_filters,
             "data_points": len(time_series_data),
-            "total_transactions": int(df['id'].count()) if not df.empty else 0,
+            "total_transactions": total_transactions,
+            "total_amount": total_amount,
+            "source": source,
             "data": time_series_data
         }
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router, title="Transaction Dashboard API", description="API for transaction time series data")
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
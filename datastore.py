@@ -0,0 +1,125 @@
+import asyncio
+import functools
+import os
+import threading
+from typing import List
+
+from settings import get_settings
+
+# Document references per get_all() call
+GET_ALL_CHUNK = 100
+
+_init_lock = threading.RLock()
+
+
+def credentials_path():
+    return get_settings().firebase_credentials_path
+
+
+def ensure_firebase_app():
+    """Initialize Firebase once per process, however many service modules use it."""
+    import firebase_admin
+    from firebase_admin import credentials
+    if not firebase_admin._apps:
+        with _init_lock:
+            if not firebase_admin._apps:
+                firebase_admin.initialize_app(credentials.Certificate(credentials_path()))
+
+
+class LazyClient:
+    """Firestore client created on first attribute access and shared by every router.
+
+    Nothing is imported, parsed or connected at import time: the Firestore
+    libraries load, the service-account certificate is read and gRPC channels
+    open on the first request. A pre-forking server can therefore load the app
+    in its master and each worker opens its own channels after fork.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+
+    def get_client(self):
+        if self._client is None:
+            with _init_lock:
+                if self._client is None:
+                    ensure_firebase_app()
+                    self._client = self._factory()
+        return self._client
+
+    def reset(self):
+        self._client = None
+
+    def __getattr__(self, name):
+        return getattr(self.get_client(), name)
+
+
+def _async_client():
+    from firebase_admin import firestore_async
+    return firestore_async.client()
+
+
+def _sync_client():
+    from firebase_admin import firestore
+    return firestore.client()
+
+
+# Async client for request handlers; iterating it never blocks the event loop
+db = LazyClient(_async_client)
+
+# Sync client for work that already runs off the event loop (threadpool, background jobs)
+sync_db = LazyClient(_sync_client)
+
+
+def _reset_after_fork():
+    # gRPC channels do not survive fork(); a child that inherits a client reconnects
+    global _init_lock
+    _init_lock = threading.RLock()
+    db.reset()
+    sync_db.reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _firestore_decorator(name: str):
+    def decorate(func):
+        wrapped = None
+
+        @functools.wraps(func)
+        def call(transaction, *args, **kwargs):
+            nonlocal wrapped
+            if wrapped is None:
+                from firebase_admin import firestore
+                wrapped = getattr(firestore, name)(func)
+            return wrapped(transaction, *args, **kwargs)
+        return call
+    return decorate
+
+
+# firestore.transactional and async_transactional, applied on the first call, so
+# importing a service module loads neither google-cloud-firestore nor gRPC
+transactional = _firestore_decorator("transactional")
+async_transactional = _firestore_decorator("async_transactional")
+
+
+async def stream_dicts(query) -> List[dict]:
+    """Documents of a query as dicts, read with async iteration."""
+    return [doc.to_dict() async for doc in query.stream()]
+
+
+async def _get_chunk(refs, **kwargs):
+    return [doc async for doc in db.get_all(refs, **kwargs)]
+
+
+async def get_all(refs, **kwargs) -> list:
+    """Fetch many documents in concurrent get_all() chunks; order is not preserved."""
+    refs = list(refs)
+    if not refs:
+        return []
+    chunks = await asyncio.gather(*(
+        _get_chunk(refs[start:start + GET_ALL_CHUNK], **kwargs)
+        for start in range(0, len(refs), GET_ALL_CHUNK)
+    ))
+    return [doc for chunk in chunks for doc in chunk]
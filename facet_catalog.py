@@ -0,0 +1,212 @@
+import asyncio
+import random
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+from counters import NUM_SHARDS
+from rollups import band, band_bounds
+
+# Distinct filter values with candidate counts, sharded like the counters
+FACET_COLLECTION = "facet_catalog"
+CANDIDATES_DOC = "candidates"
+
+# Facets whose values are listed: facet name -> candidate field; skills is a list field
+VALUE_FACETS = {"roles": "role", "city": "city", "country": "country", "skills": "skills"}
+
+# Numeric facets, kept as histograms over the rollups' two-significant-digit bands
+RANGE_FACETS = {"experience_range": "experience", "ctc_range": "ctc"}
+
+# Facet maps hold one entry per value; indexing them would only cost writes
+FIELD_OVERRIDES = [
+    {"collectionGroup": "shards", "fieldPath": name, "indexes": []}
+    for name in (*VALUE_FACETS, *RANGE_FACETS)
+]
+
+CANDIDATE_FIELDS = [*VALUE_FACETS.values(), *RANGE_FACETS.values()]
+
+
+def shards_collection(client):
+    return client.collection(FACET_COLLECTION).document(CANDIDATES_DOC).collection("shards")
+
+
+def _values(candidate: dict, field: str) -> set:
+    raw = candidate.get(field)
+    values = raw if isinstance(raw, (list, tuple, set)) else [raw]
+    # Firestore map keys cannot be empty, and __name__-style keys are reserved
+    labels = {str(value).strip() for value in values if value is not None}
+    return {label for label in labels if label and not (label.startswith("__") and label.endswith("__"))}
+
+
+def facet_deltas(entries: Iterable[Tuple[dict, int]]) -> dict:
+    """Per-facet count deltas for (candidate, +1/-1) pairs, plus the values seen per range."""
+    deltas = {name: {} for name in (*VALUE_FACETS, *RANGE_FACETS)}
+    extremes = {name: [] for name in RANGE_FACETS}
+    for candidate, sign in entries:
+        for name, field in VALUE_FACETS.items():
+            for value in _values(candidate, field):
+                deltas[name][value] = deltas[name].get(value, 0) + sign
+        for name, field in RANGE_FACETS.items():
+            value = candidate.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                key = band(value)
+                deltas[name][key] = deltas[name].get(key, 0) + sign
+                if sign > 0:
+                    extremes[name].append(float(value))
+    return {"counts": deltas, "extremes": extremes}
+
+
+def add_to_facets(client, writer, entries: Iterable[Tuple[dict, int]]):
+    """Queue facet increments on the batch or transaction that writes the candidates."""
+    from firebase_admin import firestore
+    deltas = facet_deltas(entries)
+    update = {}
+    for name, counts in deltas["counts"].items():
+        increments = {value: firestore.Increment(delta) for value, delta in counts.items() if delta}
+        if not increments:
+            continue
+        if name in RANGE_FACETS:
+            update[name] = {"bins": increments}
+            seen = deltas["extremes"][name]
+            if seen:
+                # A removal cannot restore the previous extremes; they stay as bounds
+                update[name].update({"min": firestore.Minimum(min(seen)), "max": firestore.Maximum(max(seen))})
+        else:
+            update[name] = increments
+    if update:
+        writer.set(shards_collection(client).document(str(random.randrange(NUM_SHARDS))), update, merge=True)
+
+
+def merge_shards(shards: Iterable[dict]) -> dict:
+    merged = {name: {} for name in VALUE_FACETS}
+    merged.update({name: {"bins": {}, "min": None, "max": None} for name in RANGE_FACETS})
+    for shard in shards:
+        for name in VALUE_FACETS:
+            for value, count in (shard.get(name) or {}).items():
+                merged[name][value] = merged[name].get(value, 0) + int(count or 0)
+        for name in RANGE_FACETS:
+            data, target = shard.get(name) or {}, merged[name]
+            for key, count in (data.get("bins") or {}).items():
+                target["bins"][key] = target["bins"].get(key, 0) + int(count or 0)
+            for bound, pick in (("min", min), ("max", max)):
+                if data.get(bound) is not None:
+                    target[bound] = data[bound] if target[bound] is None else pick(target[bound], data[bound])
+    return merged
+
+
+def _range(facet: dict) -> dict:
+    """Min and max of a range facet: the stored extremes, tightened by the occupied bands."""
+    keys = [key for key, count in facet["bins"].items() if count > 0]
+    if not keys:
+        return {"min": 0, "max": 0}
+    lows, highs = zip(*(band_bounds(key)[:2] for key in keys))
+    low, high = min(lows), max(highs)
+    if facet["min"] is not None:
+        low = max(low, facet["min"])
+    if facet["max"] is not None:
+        high = min(high, facet["max"])
+    return {"min": low, "max": high}
+
+
+def summarize(catalog: dict) -> dict:
+    """Endpoint view: sorted values per facet, value counts, and ranges with their histograms."""
+    result = {}
+    counts = {}
+    for name in VALUE_FACETS:
+        present = {value: count for value, count in catalog[name].items() if count > 0}
+        result[name] = sorted(present)
+        counts[name] = dict(sorted(present.items(), key=lambda item: (-item[1], item[0])))
+    for name in RANGE_FACETS:
+        facet = catalog[name]
+        result[name] = _range(facet)
+        bins = sorted((band_bounds(key)[0], key, count) for key, count in facet["bins"].items() if count > 0)
+        counts[name] = [{"band": key, "count": count} for _, key, count in bins]
+    result["counts"] = counts
+    return result
+
+
+async def read_catalog(db) -> Optional[dict]:
+    """Merged catalog from the shards; None until a rebuild has seeded it."""
+    shards = [shard.to_dict() or {} async for shard in shards_collection(db).stream()]
+    if not any(shard.get("built_at") for shard in shards):
+        return None
+    return merge_shards(shards)
+
+
+def build_catalog(candidates: Iterable[dict]) -> dict:
+    """The merged catalog read_catalog returns, computed from candidate documents."""
+    deltas = facet_deltas((candidate, 1) for candidate in candidates)
+    catalog = {name: deltas["counts"][name] for name in VALUE_FACETS}
+    for name in RANGE_FACETS:
+        seen = deltas["extremes"][name]
+        catalog[name] = {
+            "bins": deltas["counts"][name],
+            "min": min(seen) if seen else None,
+            "max": max(seen) if seen else None,
+        }
+    return catalog
+
+
+class TTLCache:
+    """One value, loaded at most once per `ttl` seconds however many requests ask for it.
+
+    Requests arriving while a load is in flight await that same load, so a
+    burst of dashboard requests costs a single read. A failed load is not
+    cached; every waiter sees its error and the next request retries.
+    """
+
+    def __init__(self, loader: Callable[[], Awaitable], ttl: float):
+        self._loader = loader
+        self.ttl = ttl
+        self._value = None
+        self._expires = 0.0
+        self._pending: Optional[asyncio.Future] = None
+
+    async def get(self):
+        if time.monotonic() < self._expires:
+            return self._value
+        if self._pending is None:
+            self._pending = asyncio.ensure_future(self._load())
+        # A disconnecting client must not cancel the load the other requests wait on
+        return await asyncio.shield(self._pending)
+
+    async def _load(self):
+        try:
+            value = await self._loader()
+            self._value, self._expires = value, time.monotonic() + self.ttl
+            return value
+        finally:
+            self._pending = None
+
+    def invalidate(self):
+        self._expires = 0.0
+
+
+def rebuild_catalog(sync_db) -> int:
+    """Recompute the catalog from every candidate; returns the candidates counted.
+
+    Shards are overwritten, so run it while candidates are not being written,
+    e.g. once before enabling the catalog read path.
+    """
+    docs = sync_db.collection("candidates").select(CANDIDATE_FIELDS).stream()
+    candidates = [doc.to_dict() for doc in docs]
+    catalog = build_catalog(candidates)
+
+    batch = sync_db.batch()
+    for shard in shards_collection(sync_db).stream():
+        if shard.id != "0":
+            batch.delete(shard.reference)
+    batch.set(shards_collection(sync_db).document("0"), {**catalog, "built_at": datetime.now(timezone.utc)})
+    batch.commit()
+    return len(candidates)
+
+
+if __name__ == "__main__":
+    # python facet_catalog.py rebuild
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command == "rebuild":
+        from datastore import sync_db
+        print(f"{rebuild_catalog(sync_db)} candidates catalogued")
+    else:
+        sys.exit(f"Unknown command: {command}")
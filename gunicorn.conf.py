@@ -0,0 +1,25 @@
+# gunicorn -c gunicorn.conf.py
+from settings import get_settings
+
+settings = get_settings()
+
+wsgi_app = "main:create_app()"
+worker_class = "uvicorn.workers.UvicornWorker"
+workers = settings.workers
+bind = f"{settings.host}:{settings.port}"
+
+# Import the app once in the master and fork workers from it. Anything bound to
+# a process is created after fork: Firestore clients open their gRPC channels
+# on first use and the bid ID generator takes its node ID in the worker.
+#
+# In-memory state is per worker and is not shared or invalidated across
+# workers. The candidate search index is built from Firestore when first
+# needed and rebuilt every SEARCH_INDEX_REFRESH seconds, so other workers'
+# writes show up within that interval. The match engine is built when first
+# needed and afterwards only sees its own worker's writes. The bid expiry
+# sweeper starts in every worker, but only the one holding its Firestore lease
+# loads and expires bids.
+preload_app = True
+
+timeout = 120
+graceful_timeout = 30
@@ -0,0 +1,48 @@
+import importlib
+from typing import Iterable, Optional
+
+from fastapi import FastAPI
+
+from service import add_cors
+from settings import get_settings
+
+# Every service module exposes a `router`; they are mounted in this order
+SERVICES = [
+    "auth",
+    "candidates",
+    "candidate_selling",
+    "candidate_by_recruiter",
+    "recruiters",
+    "biding",
+    "stripe_payment",
+    "pdf_data_extraction_ocr",
+    "dashboard.biding_metric",
+    "dashboard.candidates_timeseries",
+    "dashboard.chat_vs_deal_count",
+    "dashboard.feedback",
+    "dashboard.five_point_summary",
+    "dashboard.profile_aging",
+    "dashboard.total_count",
+    "dashboard.transaction_count",
+]
+
+
+def create_app(services: Optional[Iterable[str]] = None) -> FastAPI:
+    """One app serving every service, sharing settings and the Firestore clients.
+
+    `services` (or the SERVICES setting) limits which modules are mounted, so
+    the same factory can still run a single service per deployment.
+    """
+    settings = get_settings()
+    app = FastAPI(title="Recruiters Connect API")
+    add_cors(app)
+    for name in services or settings.services or SERVICES:
+        app.include_router(importlib.import_module(name).router)
+    return app
+
+
+# Run the combined app; use gunicorn (see gunicorn.conf.py) for one worker per core
+if __name__ == "__main__":
+    import uvicorn
+    settings = get_settings()
+    uvicorn.run("main:create_app", factory=True, host=settings.host, port=settings.port)
@@ -0,0 +1,443 @@
+import asyncio
+import logging
+import threading
+import zlib
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from candidate_changes import CandidateChanges, drop_old_tombstones
+
+logger = logging.getLogger(__name__)
+
+# Matches kept per bid
+TOP_K = 50
+
+# Score weights; they sum to 1 so a perfect match scores 1.0
+SKILL_WEIGHT = 0.40
+ROLE_WEIGHT = 0.20
+CITY_WEIGHT = 0.12
+COUNTRY_WEIGHT = 0.08
+CTC_WEIGHT = 0.10
+EXPERIENCE_WEIGHT = 0.10
+
+# When fewer than this share of a bid's stored matches are still available, rescore it
+MIN_LIVE_FRACTION = 0.5
+
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount_rows(bits: np.ndarray) -> np.ndarray:
+    """Number of set bits per row of a uint64 matrix."""
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits).sum(axis=-1, dtype=np.int64)
+    return _POPCOUNT_TABLE[bits.view(np.uint8)].sum(axis=-1, dtype=np.int64)
+
+
+def _hash(value) -> int:
+    """Stable non-zero hash of a categorical value; 0 means missing and never matches."""
+    text = str(value or "").strip().lower()
+    if not text:
+        return 0
+    return zlib.crc32(text.encode()) + 1
+
+
+def score(side_a: Dict[str, np.ndarray], side_b: Dict[str, np.ndarray]) -> np.ndarray:
+    """Vectorised bid/candidate score; one side is a single row, the other a column block.
+
+    Both dicts hold ctc, experience, role, city, country, skills (uint64 bitset)
+    and skill_count; "a" is the bid side (ctc budget, minimum experience) and
+    "b" the candidate side.
+    """
+    inter = _popcount_rows(side_a["skills"] & side_b["skills"])
+    union = side_a["skill_count"] + side_b["skill_count"] - inter
+    jaccard = np.divide(inter, union, out=np.zeros(np.broadcast(inter, union).shape), where=union > 0)
+
+    budget = side_a["ctc"]
+    over_budget = (side_b["ctc"] - budget) / np.maximum(budget, 1.0)
+    ctc_fit = np.where(side_b["ctc"] <= budget, 1.0, np.clip(1.0 - over_budget, 0.0, 1.0))
+
+    required = side_a["experience"]
+    exp_ratio = np.divide(side_b["experience"], required, out=np.ones(np.broadcast(side_b["experience"], required).shape), where=required > 0)
+    exp_fit = np.clip(exp_ratio, 0.0, 1.0)
+
+    def same(field):
+        return (side_a[field] == side_b[field]) & (side_a[field] != 0)
+
+    return (
+        SKILL_WEIGHT * jaccard
+        + ROLE_WEIGHT * same("role")
+        + CITY_WEIGHT * same("city")
+        + COUNTRY_WEIGHT * same("country")
+        + CTC_WEIGHT * ctc_fit
+        + EXPERIENCE_WEIGHT * exp_fit
+    )
+
+
+class _Table:
+    """Columnar, growable store of one side of the match (bids or candidates)."""
+
+    def __init__(self, words: int):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.size = 0
+        capacity = 1024
+        self.ctc = np.zeros(capacity)
+        self.experience = np.zeros(capacity)
+        self.role = np.zeros(capacity, dtype=np.int64)
+        self.city = np.zeros(capacity, dtype=np.int64)
+        self.country = np.zeros(capacity, dtype=np.int64)
+        self.skills = np.zeros((capacity, words), dtype=np.uint64)
+        self.skill_count = np.zeros(capacity, dtype=np.int64)
+        self.active = np.zeros(capacity, dtype=bool)
+
+    def _grow(self):
+        capacity = len(self.ctc) * 2
+        for name in ("ctc", "experience", "role", "city", "country", "skill_count", "active"):
+            column = getattr(self, name)
+            grown = np.zeros(capacity, dtype=column.dtype)
+            grown[:self.size] = column[:self.size]
+            setattr(self, name, grown)
+        skills = np.zeros((capacity, self.skills.shape[1]), dtype=np.uint64)
+        skills[:self.size] = self.skills[:self.size]
+        self.skills = skills
+
+    def widen(self, words: int):
+        """Make room for a larger skill vocabulary."""
+        if words > self.skills.shape[1]:
+            self.skills = np.pad(self.skills, ((0, 0), (0, words - self.skills.shape[1])))
+
+    def upsert(self, item_id: str, ctc, experience, role, city, country, skills: np.ndarray) -> int:
+        row = self.rows.get(item_id)
+        if row is None:
+            if self.size == len(self.ctc):
+                self._grow()
+            row = self.size
+            self.size += 1
+            self.rows[item_id] = row
+            self.ids.append(item_id)
+        self.ctc[row] = ctc
+        self.experience[row] = experience
+        self.role[row] = role
+        self.city[row] = city
+        self.country[row] = country
+        self.skills[row] = skills
+        self.skill_count[row] = sum(int(word).bit_count() for word in skills)
+        self.active[row] = True
+        return row
+
+    def one(self, row: int) -> Dict[str, np.ndarray]:
+        return {
+            "ctc": self.ctc[row], "experience": self.experience[row], "role": self.role[row],
+            "city": self.city[row], "country": self.country[row],
+            "skills": self.skills[row], "skill_count": self.skill_count[row],
+        }
+
+    def block(self) -> Dict[str, np.ndarray]:
+        n = self.size
+        return {
+            "ctc": self.ctc[:n], "experience": self.experience[:n], "role": self.role[:n],
+            "city": self.city[:n], "country": self.country[:n],
+            "skills": self.skills[:n], "skill_count": self.skill_count[:n],
+        }
+
+
+class MatchEngine:
+    """Keeps the top-K candidates for every open bid, updated per event.
+
+    A new bid is scored against all candidates in one vectorised pass. A new
+    candidate is scored against all bids in one pass and only bids whose
+    current K-th best score it beats are touched. Bids loaded at startup are
+    scored lazily the first time their matches are requested.
+
+    A bid's full scan runs on a snapshot of the candidate columns without the
+    lock; candidates written meanwhile are rescored under it before the
+    result is stored.
+    """
+
+    def __init__(self, top_k: int = TOP_K):
+        self.top_k = top_k
+        self._lock = threading.RLock()
+        self._skills: Dict[str, int] = {}
+        self.bids = _Table(1)
+        self.candidates = _Table(1)
+        # Per bid: sorted (score, candidate row) pairs, best first
+        self._top: Dict[int, List[Tuple[float, int]]] = {}
+        # K-th best score per bid row; +inf for bids not scored yet so events skip them
+        self._floor = np.full(len(self.bids.ctc), np.inf)
+        self.loaded = False
+        # Events seen while a warm-up is reading Firestore; replayed onto its result
+        self._pending: Optional[List[Tuple[str, tuple]]] = None
+        # Serialises warm-ups; held while streaming, unlike _lock
+        self._load_lock = threading.Lock()
+        # Candidate rows written during each full scan in progress
+        self._scans: List[Set[int]] = []
+        # Where refreshes continue from; set by the warm-up
+        self.changes: Optional[CandidateChanges] = None
+
+    def _defer(self, method: str, *args) -> bool:
+        """Record an event for the warm-up in progress; True when the engine is not loaded."""
+        if self.loaded:
+            return False
+        if self._pending is not None:
+            self._pending.append((method, args))
+        return True
+
+    def _skill_bits(self, skills) -> np.ndarray:
+        names = {str(s).strip().lower() for s in skills or [] if s}
+        for skill in names:
+            if skill not in self._skills:
+                self._skills[skill] = len(self._skills)
+        words = max(1, (len(self._skills) + 63) // 64)
+        if words > self.candidates.skills.shape[1]:
+            self.bids.widen(words)
+            self.candidates.widen(words)
+        bits = np.zeros(words, dtype=np.uint64)
+        for skill in names:
+            bit = self._skills[skill]
+            bits[bit // 64] |= np.uint64(1 << (bit % 64))
+        return bits
+
+    def _fields(self, data: dict):
+        return (
+            float(data.get("ctc") or 0), float(data.get("experience") or 0),
+            _hash(data.get("role")), _hash(data.get("city")), _hash(data.get("country")),
+            self._skill_bits(data.get("skills")),
+        )
+
+    def _sync_floor(self):
+        if len(self._floor) < len(self.bids.ctc):
+            floor = np.full(len(self.bids.ctc), np.inf)
+            floor[:len(self._floor)] = self._floor
+            self._floor = floor
+
+    def _best(self, scores: np.ndarray, rows: np.ndarray) -> List[Tuple[float, int]]:
+        """Top-K (score, candidate row) pairs, best first, skipping -inf."""
+        k = min(self.top_k, len(scores))
+        if k == 0:
+            return []
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(float(scores[i]), int(rows[i])) for i in best if np.isfinite(scores[i])]
+
+    def _rank_bid(self, bid_row: int):
+        """Full vectorised scan for one bid; call without holding the lock."""
+        with self._lock:
+            bid = self.bids.one(bid_row)
+            bid["skills"] = bid["skills"].copy()
+            # Growing or widening replaces the arrays, so these stay consistent
+            block = self.candidates.block()
+            active = self.candidates.active[:self.candidates.size].copy()
+            changed: Set[int] = set()
+            self._scans.append(changed)
+
+        try:
+            scores = np.where(active, score(bid, block), -np.inf) if len(active) else np.zeros(0)
+            top = self._best(scores, np.arange(len(scores)))
+        finally:
+            with self._lock:
+                self._scans.remove(changed)
+
+        with self._lock:
+            if not self.bids.active[bid_row]:
+                return
+            if changed:
+                rows = np.fromiter(changed, dtype=np.int64, count=len(changed))
+                block = {name: column[rows] for name, column in self.candidates.block().items()}
+                fresh = np.where(self.candidates.active[rows], score(self.bids.one(bid_row), block), -np.inf)
+                top = [entry for entry in top if entry[1] not in changed]
+                top = sorted(top + self._best(fresh, rows), key=lambda entry: -entry[0])[:self.top_k]
+            self._top[bid_row] = top
+            self._floor[bid_row] = top[-1][0] if len(top) >= self.top_k else -np.inf
+
+    def add_bid(self, bid_id: str, data: dict):
+        with self._lock:
+            if self._defer("add_bid", bid_id, data):
+                return
+            row = self.bids.upsert(bid_id, *self._fields(data))
+            self._sync_floor()
+            # Skipped by candidate events until ranked
+            self._floor[row] = np.inf
+            self._top.pop(row, None)
+        self._rank_bid(row)
+
+    def add_bids(self, bids):
+        """add_bid for each (id, data) pair."""
+        for bid_id, data in bids:
+            self.add_bid(bid_id, data)
+
+    def remove_bid(self, bid_id: str):
+        with self._lock:
+            if self._defer("remove_bid", bid_id):
+                return
+            row = self.bids.rows.get(bid_id)
+            if row is not None:
+                self.bids.active[row] = False
+                self._floor[row] = np.inf
+                self._top.pop(row, None)
+
+    def add_candidate(self, candidate_id: str, data: dict):
+        with self._lock:
+            if self._defer("add_candidate", candidate_id, data):
+                return
+            row = self.candidates.upsert(candidate_id, *self._fields(data))
+            for changed in self._scans:
+                changed.add(row)
+            n = self.bids.size
+            if n == 0:
+                return
+            scores = score(self.bids.block(), self.candidates.one(row))
+            improved = np.nonzero(self.bids.active[:n] & (scores > self._floor[:n]))[0]
+            for bid_row in improved:
+                top = [entry for entry in self._top.get(bid_row, []) if entry[1] != row]
+                top.append((float(scores[bid_row]), row))
+                top.sort(key=lambda entry: -entry[0])
+                del top[self.top_k:]
+                self._top[bid_row] = top
+                self._floor[bid_row] = top[-1][0] if len(top) >= self.top_k else -np.inf
+
+    def add_candidates(self, candidates):
+        """add_candidate for each (id, data) pair, e.g. off the event loop after a bulk create."""
+        for candidate_id, data in candidates:
+            self.add_candidate(candidate_id, data)
+
+    def remove_candidate(self, candidate_id: str):
+        """Sold or deleted; dropped from match lists when they are read."""
+        with self._lock:
+            if self._defer("remove_candidate", candidate_id):
+                return
+            row = self.candidates.rows.get(candidate_id)
+            if row is not None:
+                self.candidates.active[row] = False
+
+    def matches(self, bid_id: str, limit: Optional[int] = None) -> Optional[List[Tuple[str, float]]]:
+        """(candidate_id, score) pairs for a bid, best first; None for unknown bids."""
+        with self._lock:
+            row = self.bids.rows.get(bid_id)
+            if row is None or not self.bids.active[row]:
+                return None
+            top = self._top.get(row)
+            live = [(s, c) for s, c in top or [] if self.candidates.active[c]]
+            stale = top is None or (top and len(live) < len(top) * MIN_LIVE_FRACTION)
+        if stale:
+            self._rank_bid(row)
+        with self._lock:
+            if not self.bids.active[row]:
+                return None
+            live = [(s, c) for s, c in self._top.get(row) or [] if self.candidates.active[c]]
+            return [(self.candidates.ids[c], s) for s, c in live[:limit or self.top_k]]
+
+    def load(self, bids, candidates):
+        """Bulk-load (id, data) pairs; bid match lists are computed on first request."""
+        with self._lock:
+            for candidate_id, data in candidates:
+                self.candidates.upsert(candidate_id, *self._fields(data))
+            for bid_id, data in bids:
+                row = self.bids.upsert(bid_id, *self._fields(data))
+                self._sync_floor()
+                self._floor[row] = np.inf
+                self._top.pop(row, None)
+            self.loaded = True
+
+    def warm(self, bids, candidates):
+        """Load into a fresh engine without holding the lock, then swap its state in.
+
+        Events arriving while Firestore is streamed are recorded and replayed
+        onto the fresh engine before the swap, so none is lost.
+        """
+        with self._load_lock:
+            with self._lock:
+                if self.loaded:
+                    return
+                self._pending = []
+            fresh = MatchEngine(self.top_k)
+            try:
+                fresh.load(bids, candidates)
+            except BaseException:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                for method, args in self._pending:
+                    getattr(fresh, method)(*args)
+                state = vars(fresh)
+                for name in ("_skills", "bids", "candidates", "_top", "_floor"):
+                    setattr(self, name, state[name])
+                self._pending = None
+                self.loaded = True
+
+
+match_engine = MatchEngine()
+
+MATCH_FIELDS = ["ctc", "experience", "role", "city", "country", "skills"]
+
+
+def ensure_engine_loaded(db, engine: Optional[MatchEngine] = None,
+                         on_bid: Optional[Callable[[str, dict], None]] = None) -> MatchEngine:
+    """Warm the engine from open bids and unsold candidates on first use.
+
+    on_bid sees every bid loaded, e.g. to schedule dropping it at its deadline.
+    """
+    engine = engine or match_engine
+    if engine.loaded:
+        return engine
+    bids = db.collection("biding")\
+        .where("fulfil", "==", False)\
+        .where("expired", "==", False)\
+        .select(MATCH_FIELDS + ["expires_at"])\
+        .stream()
+    candidates = db.collection("candidates").where("sold", "==", False).select(MATCH_FIELDS).stream()
+
+    def open_bids():
+        for doc in bids:
+            data = doc.to_dict()
+            if on_bid is not None:
+                on_bid(doc.id, data)
+            yield doc.id, data
+
+    changes = CandidateChanges(MATCH_FIELDS + ["sold"])
+    changes.mark()
+    engine.warm(open_bids(), ((doc.id, doc.to_dict()) for doc in candidates))
+    engine.changes = changes
+    return engine
+
+
+def apply_candidate_changes(db, engine: Optional[MatchEngine] = None) -> MatchEngine:
+    """Bring a warmed engine's candidates up to date with other workers' writes and deletes."""
+    engine = engine or match_engine
+    with engine._load_lock:
+        changes = engine.changes
+        if changes is None:
+            return engine
+        if changes.stale():
+            # Too far behind for the tombstones; the next request warms it again
+            with engine._lock:
+                engine.loaded = False
+            engine.changes = None
+            return engine
+        changed, deleted = changes.poll(db)
+    for candidate_id, data in changed:
+        if data.get("sold"):
+            engine.remove_candidate(candidate_id)
+        else:
+            engine.add_candidate(candidate_id, data)
+    for candidate_id in deleted:
+        engine.remove_candidate(candidate_id)
+    return engine
+
+
+async def keep_engine_fresh(db, interval: float, engine: Optional[MatchEngine] = None):
+    """Every `interval` seconds, apply other workers' candidate writes once this worker has warmed the engine.
+
+    Bids are not polled: the matches endpoint checks the bid document on every request.
+    """
+    engine = engine or match_engine
+    while True:
+        await asyncio.sleep(interval)
+        if not engine.loaded:
+            continue
+        try:
+            await asyncio.to_thread(apply_candidate_changes, db, engine)
+            await asyncio.to_thread(drop_old_tombstones, db)
+        except Exception:
+            logger.exception("Failed to refresh the match engine's candidates")
@@ -0,0 +1,85 @@
+import base64
+import json
+from datetime import datetime
+from typing import Iterable, List, Optional, Sequence
+
+from fastapi import HTTPException
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(values: list) -> str:
+    """Opaque, URL-safe token holding the order-by values of the last document on a page."""
+    encoded = []
+    for value in values:
+        if isinstance(value, datetime):
+            encoded.append({"dt": value.isoformat()})
+        else:
+            encoded.append(value)
+    return base64.urlsafe_b64encode(json.dumps(encoded).encode()).decode()
+
+
+def decode_cursor(token: str) -> list:
+    try:
+        encoded = json.loads(base64.urlsafe_b64decode(token.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid start_after cursor")
+    return [
+        datetime.fromisoformat(value["dt"]) if isinstance(value, dict) and "dt" in value else value
+        for value in encoded
+    ]
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Split a comma-separated fields= parameter."""
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def project(data: dict, fields: Optional[Iterable[str]]) -> dict:
+    """Keep only the requested fields (all of them when no projection was asked for)."""
+    if not fields:
+        return data
+    return {field: data[field] for field in fields if field in data}
+
+
+async def fetch_page(
+    collection_ref,
+    query=None,
+    order_by: Sequence[str] = ("created_at",),
+    limit: int = DEFAULT_PAGE_SIZE,
+    start_after: Optional[str] = None,
+    fields: Optional[List[str]] = None,
+):
+    """Fetch one page ordered by order_by plus document ID.
+
+    query must come from the async client. Returns the page's document snapshots and the cursor for the next page
+    (None on the last page). With fields set, only those columns (plus the
+    order-by fields the cursor needs) are transferred via select().
+    """
+    query = query if query is not None else collection_ref
+    for field in order_by:
+        query = query.order_by(field)
+    query = query.order_by("__name__")
+
+    if fields:
+        query = query.select(sorted(set(fields) | set(order_by)))
+
+    if start_after:
+        values = decode_cursor(start_after)
+        if len(values) != len(order_by) + 1:
+            raise HTTPException(status_code=400, detail="Invalid start_after cursor")
+        cursor = dict(zip(order_by, values[:-1]))
+        cursor["__name__"] = collection_ref.document(values[-1])
+        query = query.start_after(cursor)
+
+    # Read one extra document to learn whether another page exists
+    docs = [doc async for doc in query.limit(limit + 1).stream()]
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor([last.get(field) for field in order_by] + [last.id])
+    return docs, next_cursor
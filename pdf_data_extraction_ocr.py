@@ -1,31 +1,113 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-import fitz  # PyMuPDF
-from fastapi.middleware.cors import CORSMiddleware
-from docx import Document
-from openai import OpenAI
-import os
+from fastapi import APIRouter, File, UploadFile, HTTPException, Query, Response
+from functools import lru_cache
+from typing import List, Optional, Tuple
+import asyncio
+import io
 import json
-from dotenv import load_dotenv
+import logging
+import multiprocessing
+import os
+import random
+import zipfile
+from resume_cache import ResumeCache, content_key
+from resume_rules import ALWAYS_ASKED, CONFIDENCE_THRESHOLD, extract_fields
+from service import service_app
+from settings import get_settings
+from streaming import ndjson_response
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+# PyMuPDF, python-docx and OpenAI are imported on first use; together they
+# dominate this service's cold start
+
+MODEL = "gpt-4-turbo"
+
+# Bump when the prompt or its parsing changes, so cached results of the old one stop matching
+PROMPT_VERSION = "2"
+
+# RESUME_LLM value that answers without OpenAI, for offline runs; only the rules fill fields
+STUB_LLM = "stub"
 
-# Load environment variables
-load_dotenv()
+# Fields the extraction returns, as the prompt describes them to the model
+RESUME_FIELDS = {
+    "name": '""',
+    "city": '""',
+    "country": '""',
+    "ctc": "float",
+    "notice_period": '""',
+    "linkedin": '""',
+    "role": '""',
+    "skills": '["", "", "", ...]',
+    "experience": "float",
+    "contact_number": '""',
+    "email": '""',
+}
 
-app = FastAPI()
+PDF_TYPES = ["application/pdf"]
+DOCX_TYPES = ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]
+ZIP_TYPES = ["application/zip", "application/x-zip-compressed"]
 
-# Enable CORS
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Content type of batch documents named by extension, e.g. inside a ZIP
+EXTENSION_TYPES = {".pdf": PDF_TYPES[0], ".docx": DOCX_TYPES[0], ".doc": DOCX_TYPES[1]}
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Bounds on one batch upload, after ZIPs are expanded. The uploads and the
+# decompressed members are all held in memory, so their bytes are capped together.
+MAX_BATCH_DOCUMENTS = 5000
+MAX_DOCUMENT_BYTES = 20 * 1024 * 1024
+MAX_BATCH_BYTES = 256 * 1024 * 1024
+TOO_LARGE = f"File is larger than {MAX_DOCUMENT_BYTES // (1024 * 1024)} MB."
+BATCH_TOO_LARGE = f"A batch holds at most {MAX_BATCH_BYTES // (1024 * 1024)} MB of files, ZIP members uncompressed."
+
+# Documents of a batch being parsed or extracted at once; the rest wait unread
+BATCH_IN_FLIGHT = 64
+
+# OpenAI calls are retried on rate limits, timeouts and server errors with jittered exponential backoff
+LLM_ATTEMPTS = 4
+LLM_BACKOFF_SECONDS = 1.0
+
+@lru_cache
+def get_resume_cache() -> ResumeCache:
+    settings = get_settings()
+    return ResumeCache(
+        settings.resume_cache_dir, settings.resume_cache_size,
+        max_bytes=settings.resume_cache_max_mb * 1024 * 1024,
+        max_age=settings.resume_cache_max_age_days * 24 * 3600,
+    )
+
+@lru_cache
+def get_openai_client():
+    """OpenAI client, created on the first extraction."""
+    from openai import OpenAI
+    # Retries are done by extract_information_async, which also frees the worker while waiting
+    return OpenAI(api_key=get_settings().openai_api_key, max_retries=0)
+
+@lru_cache
+def get_parse_pool():
+    """Process pool for PDF/DOCX parsing, which is CPU-bound and holds the GIL.
+
+    Its processes are started by a forkserver (spawned where that is not
+    available), not forked from this worker, which has gRPC threads running.
+    Unless RESUME_PARSE_WORKERS is set, the cores are split between the
+    gunicorn workers, so a deployment runs about one parser per core.
+    """
+    settings = get_settings()
+    return _new_parse_pool(settings.resume_parse_workers or max(1, multiprocessing.cpu_count() // settings.workers))
+
+def _new_parse_pool(size: int):
+    from concurrent.futures import ProcessPoolExecutor
+    method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+    return ProcessPoolExecutor(max_workers=size, mp_context=multiprocessing.get_context(method))
+
+@lru_cache
+def get_llm_semaphore() -> asyncio.Semaphore:
+    """Bounds this worker's concurrent OpenAI calls."""
+    return asyncio.Semaphore(get_settings().resume_llm_concurrency)
 
 def extract_text_from_pdf(pdf_file):
     """Extract text from a PDF file."""
+    import fitz  # PyMuPDF
     try:
         pdf_bytes = pdf_file.read()  # Read file bytes
         doc = fitz.open(stream=pdf_bytes, filetype="pdf")  # Open as a stream
@@ -37,6 +119,7 @@ def extract_text_from_pdf(pdf_file):
 
 def extract_text_from_docx(docx_file):
     """Extract text from a DOCX file."""
+    from docx import Document
     try:
         doc = Document(docx_file)
         text = "\n".join([para.text for para in doc.paragraphs])
@@ -44,23 +127,14 @@ def extract_text_from_docx(docx_file):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error reading DOCX: {str(e)}")
 
-def extract_information_from_text(text):
-    """Extract structured resume information using OpenAI API."""
-    prompt = f"""
+def build_prompt(text: str, fields: List[str]) -> str:
+    """Prompt asking only for `fields`, the ones the rules could not settle."""
+    schema = "\n".join(f'        "{field}": {RESUME_FIELDS[field]},' for field in fields)
+    return f"""
     Extract the following information from the given resume text and return a valid JSON object:
     
     {{
-        "name": "",
-        "city": "",
-        "country": "",
-        "ctc": float,
-        "notice_period": "",
-        "linkedin": "",
-        "role": "",
-        "skills": ["", "", "", ...],
-        "experience": float,
-        "contact_number": "",
-        "email": "",
+{schema}
     }}
     
     Resume Text:
@@ -69,8 +143,13 @@ def extract_information_from_text(text):
     Ensure the response is in valid JSON format.
     """
 
-    response = client.chat.completions.create(
-        model="gpt-4-turbo",
+def complete_json(prompt: str, fields: List[str]) -> dict:
+    """The model's JSON answer to `prompt`; the stub model answers every field empty."""
+    if get_settings().resume_llm == STUB_LLM:
+        return {field: [] if field == "skills" else None if RESUME_FIELDS[field] == "float" else "" for field in fields}
+
+    response = get_openai_client().chat.completions.create(
+        model=MODEL,
         messages=[{"role": "system", "content": prompt}],
         temperature=0.2,
     )
@@ -83,15 +162,271 @@ def extract_information_from_text(text):
     except json.JSONDecodeError:
         raise HTTPException(status_code=500, detail="Invalid JSON format in response.")
 
-@app.post("/extract_resume_info/")
-async def extract_resume_info(file: UploadFile = File(...)):
-    """API endpoint to upload and extract resume information."""
-    if file.content_type == "application/pdf":
-        text = extract_text_from_pdf(file.file)
-    elif file.content_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-        text = extract_text_from_docx(file.file)
-    else:
+def _empty(value) -> bool:
+    return value is None or value == "" or value == []
+
+def extract_information_from_text(text):
+    """Extract structured resume information: rules first, the OpenAI API for the rest.
+
+    Fields the rules find with enough confidence are kept as found and left
+    out of the prompt. A guess below the threshold is used only when the
+    model leaves that field empty. Skills are always asked, since the
+    dictionary only knows some, and dictionary skills are merged with the
+    model's. field_confidence holds the rules' scores and llm_fields the
+    fields the model was asked for.
+    """
+    found = extract_fields(text)
+    settled = {
+        field: value for field, (value, confidence) in found.items()
+        if confidence >= CONFIDENCE_THRESHOLD and field not in ALWAYS_ASKED
+    }
+    asked = [field for field in RESUME_FIELDS if field not in settled]
+    answered = complete_json(build_prompt(text, asked), asked) if asked else {}
+
+    extracted_info = {}
+    for field in RESUME_FIELDS:
+        if field in settled:
+            value = settled[field]
+        else:
+            value = answered.get(field)
+            guess = found[field][0] if field in found else None
+            if field == "skills" and guess:
+                known = {skill.lower() for skill in guess}
+                value = guess + [skill for skill in (value or []) if str(skill).lower() not in known]
+            elif _empty(value) and guess is not None:
+                value = guess
+        extracted_info[field] = value
+    extracted_info["field_confidence"] = {field: confidence for field, (_, confidence) in found.items()}
+    extracted_info["llm_fields"] = asked
+    return extracted_info
+
+def extract_text(content_type: str, data: bytes) -> str:
+    if content_type in PDF_TYPES:
+        return extract_text_from_pdf(io.BytesIO(data))
+    return extract_text_from_docx(io.BytesIO(data))
+
+def parse_document(content_type: str, data: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """(text, None) or (None, error); runs in the parse pool, so errors come back as values."""
+    try:
+        return extract_text(content_type, data), None
+    except HTTPException as e:
+        return None, e.detail
+    except Exception as e:
+        return None, str(e)
+
+def _retryable(error: Exception) -> bool:
+    if get_settings().resume_llm == STUB_LLM:
+        return False
+    import openai
+    return isinstance(error, (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError))
+
+async def extract_information_async(text: str) -> dict:
+    """extract_information_from_text off the event loop, bounded and retried."""
+    async with get_llm_semaphore():
+        for attempt in range(LLM_ATTEMPTS):
+            try:
+                return await asyncio.to_thread(extract_information_from_text, text)
+            except Exception as e:
+                if attempt == LLM_ATTEMPTS - 1 or not _retryable(e):
+                    raise
+                await asyncio.sleep(LLM_BACKOFF_SECONDS * 2 ** attempt * (0.5 + random.random()))
+
+async def parse_in_pool(content_type: str, data: bytes) -> Tuple[Optional[str], Optional[str]]:
+    """parse_document in the parse pool, replacing the pool when a parser process died.
+
+    A crashed or OOM-killed parser breaks the whole pool, failing every file
+    in flight. The pool is replaced and each of those files is retried once
+    in a process of its own, so the file that crashed it only breaks its own
+    retry and is reported as an error.
+    """
+    from concurrent.futures.process import BrokenProcessPool
+    loop = asyncio.get_running_loop()
+    pool = get_parse_pool()
+    try:
+        return await loop.run_in_executor(pool, parse_document, content_type, data)
+    except BrokenProcessPool:
+        # Every file in flight sees the same broken pool; replace it once
+        if get_parse_pool.cache_info().currsize and get_parse_pool() is pool:
+            logger.warning("Resume parse pool broke; starting a new one")
+            get_parse_pool.cache_clear()
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    solo = _new_parse_pool(1)
+    try:
+        return await loop.run_in_executor(solo, parse_document, content_type, data)
+    except BrokenProcessPool:
+        return None, "The document parser crashed on this file"
+    finally:
+        solo.shutdown(wait=False)
+
+async def extract_document(content_type: str, data: bytes) -> Tuple[dict, str]:
+    """Structured resume information and the cache tier that answered it."""
+    # Stub answers must not be served once the real model is back
+    key = content_key(data, f"{get_settings().resume_llm}:{MODEL}:{PROMPT_VERSION}")
+    cache = get_resume_cache()
+    extracted_info, tier = await asyncio.to_thread(cache.get, key)
+    if extracted_info is None:
+        text, error = await parse_in_pool(content_type, data)
+        if error is not None:
+            raise HTTPException(status_code=500, detail=error)
+        extracted_info = await extract_information_async(text)
+        await asyncio.to_thread(cache.put, key, extracted_info)
+    return extracted_info, tier
+
+@router.post("/extract_resume_info/")
+async def extract_resume_info(response: Response, file: UploadFile = File(...)):
+    """API endpoint to upload and extract resume information.
+
+    Results are cached by file content, so re-uploading the same CV returns
+    at once without another OpenAI call; X-Cache says which tier answered
+    (memory, disk or miss).
+    """
+    if file.content_type not in PDF_TYPES + DOCX_TYPES:
         raise HTTPException(status_code=400, detail="Unsupported file format. Use PDF or DOCX.")
 
-    extracted_info = extract_information_from_text(text)
+    extracted_info, tier = await extract_document(file.content_type, await file.read())
+    response.headers["X-Cache"] = tier
     return extracted_info  # Directly return JSON response
+
+def _document(name: str, content_type: Optional[str], data: bytes) -> dict:
+    if content_type not in PDF_TYPES + DOCX_TYPES:
+        content_type = EXTENSION_TYPES.get(os.path.splitext(name.lower())[1])
+    error = None
+    if content_type is None:
+        error = "Unsupported file format. Use PDF or DOCX."
+    elif len(data) > MAX_DOCUMENT_BYTES:
+        error = TOO_LARGE
+    return {"file": name, "content_type": content_type, "data": data if error is None else b"", "error": error}
+
+def expand_uploads(uploads: List[Tuple[str, Optional[str], bytes]]) -> List[dict]:
+    """One entry per document to extract; ZIP archives are replaced by their members.
+
+    Raises a 413 once the uploads and the members decompressed so far exceed MAX_BATCH_BYTES.
+    """
+    documents = []
+    held = sum(len(data) for _, _, data in uploads)
+    for name, content_type, data in uploads:
+        if content_type not in ZIP_TYPES and not name.lower().endswith(".zip"):
+            documents.append(_document(name, content_type, data))
+            continue
+        try:
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for member in archive.infolist():
+                    base = os.path.basename(member.filename)
+                    # Skip folders and the metadata macOS adds to archives
+                    if member.is_dir() or not base or base.startswith(".") or member.filename.startswith("__MACOSX/"):
+                        continue
+                    member_name = f"{name}/{member.filename}"
+                    # Checked before decompressing, so an archive bomb is never inflated
+                    if member.file_size > MAX_DOCUMENT_BYTES:
+                        documents.append({"file": member_name, "content_type": None, "data": b"", "error": TOO_LARGE})
+                        continue
+                    held += member.file_size
+                    if held > MAX_BATCH_BYTES:
+                        raise HTTPException(status_code=413, detail=BATCH_TOO_LARGE)
+                    documents.append(_document(member_name, None, archive.read(member)))
+                    if len(documents) > MAX_BATCH_DOCUMENTS:
+                        return documents
+        except zipfile.BadZipFile:
+            documents.append({"file": name, "content_type": None, "data": b"", "error": "Invalid ZIP archive."})
+    return documents
+
+@router.post("/extract_resume_info/batch")
+async def extract_resume_info_batch(
+    files: List[UploadFile] = File(...),
+    save: bool = Query(False),
+    created_by: Optional[str] = Query(None)
+):
+    """Extract resume information from many PDF/DOCX files, or ZIP archives of them.
+
+    Results are streamed as NDJSON, one line per document in completion
+    order: {"file", "status": "ok", "cache", "data"} or {"file", "status":
+    "error", "error"}. Parsing runs in a process pool and OpenAI calls are
+    bounded and retried.
+
+    - **save**: Also create a candidate from every extracted resume, in batched writes.
+      Each committed batch is reported by a {"saved", "candidate_ids"} line mapping
+      files to candidate IDs; a batch that fails is reported by {"save_error", "files"}
+      and the stream goes on
+    - **created_by**: Recruiter the saved candidates are created by; required with save
+    """
+    if save and not created_by:
+        raise HTTPException(status_code=400, detail="created_by is required with save")
+
+    uploads, held = [], 0
+    for file in files:
+        data = await file.read()
+        held += len(data)
+        if held > MAX_BATCH_BYTES:
+            raise HTTPException(status_code=413, detail=BATCH_TOO_LARGE)
+        uploads.append((file.filename or "upload", file.content_type, data))
+    documents = expand_uploads(uploads)
+    # Expanded archives are not kept while the batch runs
+    del uploads
+    if len(documents) > MAX_BATCH_DOCUMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_DOCUMENTS} documents per batch.")
+
+    async def process(document: dict) -> dict:
+        if document["error"]:
+            return {"file": document["file"], "status": "error", "error": document["error"]}
+        try:
+            extracted_info, tier = await extract_document(document["content_type"], document["data"])
+        except HTTPException as e:
+            return {"file": document["file"], "status": "error", "error": e.detail}
+        except Exception as e:
+            return {"file": document["file"], "status": "error", "error": str(e)}
+        return {"file": document["file"], "status": "ok", "cache": tier, "data": extracted_info}
+
+    async def save_chunk(chunk: List[tuple]) -> dict:
+        """Create one batch of candidates; the line reporting it, saved or failed."""
+        from candidates import save_candidates
+        try:
+            candidate_ids = await save_candidates([candidate for _, candidate in chunk])
+        except Exception as e:
+            return {"save_error": str(e), "files": [file for file, _ in chunk]}
+        return {"saved": len(candidate_ids),
+                "candidate_ids": {file: candidate_id for (file, _), candidate_id in zip(chunk, candidate_ids)}}
+
+    async def records():
+        from candidates import CANDIDATES_PER_BATCH, Candidate
+        queued = iter(documents)
+        tasks = set()
+        to_save = []
+        try:
+            while True:
+                # Keep a bounded number of documents in progress; the rest are started as these finish
+                for document in queued:
+                    tasks.add(asyncio.ensure_future(process(document)))
+                    if len(tasks) >= BATCH_IN_FLIGHT:
+                        break
+                if not tasks:
+                    break
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    record = task.result()
+                    if save and record["status"] == "ok":
+                        try:
+                            to_save.append((record["file"], Candidate(**{**record["data"], "created_by": created_by})))
+                        except ValueError as e:
+                            record["candidate_error"] = str(e)
+                    yield record
+                    if len(to_save) == CANDIDATES_PER_BATCH:
+                        yield await save_chunk(to_save)
+                        to_save = []
+            if to_save:
+                yield await save_chunk(to_save)
+        finally:
+            # A client that disconnects stops the extractions in progress
+            for task in tasks:
+                task.cancel()
+
+    return ndjson_response(records())
+
+@router.get("/extract_resume_info/cache-stats")
+async def resume_cache_stats():
+    """Hits per tier, misses and hit rate of this worker's resume cache since it started."""
+    return get_resume_cache().stats()
+
+
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
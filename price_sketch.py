@@ -0,0 +1,262 @@
+import math
+import random
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Iterable, Optional
+
+from counters import NUM_SHARDS
+
+# The sale-price sketches, overall and per role and per city, sharded like the
+# counters so concurrent sales write different documents; reads merge the shards.
+# A sketch needs about 35 bins per doubling of the price range, so even a few
+# hundred roles and cities stay inside Firestore's 1 MiB / 20,000-field limits.
+SKETCH_COLLECTION = "price_sketches"
+SKETCH_DOC = "sold"
+
+# Breakdowns kept next to the overall sketch; each is a candidate field
+BREAKDOWNS = ("role", "city")
+
+# Every quantile is within this relative error of the exact sale price at that rank
+RELATIVE_ACCURACY = 0.01
+
+# Bins are map entries of the sketch document; indexing them would only cost writes
+FIELD_OVERRIDES = [{
+    "collectionGroup": "shards",
+    "fieldPath": "sketches",
+    "indexes": [],
+}]
+
+
+class QuantileSketch:
+    """DDSketch of non-negative values with relative accuracy `alpha`.
+
+    A value v > 0 is counted in bin ceil(log_gamma(v)), gamma = (1 + alpha) /
+    (1 - alpha), and bin k answers with 2 * gamma^k / (gamma + 1), which is
+    within alpha of every value in it. The q-quantile is therefore within
+    alpha relative error of the exact value at rank q * (n - 1). Zeros (and
+    negatives) are counted separately and answer 0.
+
+    Bins are plain counters, so sketches merge by adding bins and can be kept
+    in Firestore with Increment transforms. count, sum, min and max are exact.
+    """
+
+    def __init__(self, alpha: float = RELATIVE_ACCURACY):
+        self.alpha = alpha
+        self.gamma = (1 + alpha) / (1 - alpha)
+        self._log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min: Optional[float] = None
+        self.max: Optional[float] = None
+
+    def key(self, value: float) -> int:
+        return math.ceil(math.log(value) / self._log_gamma)
+
+    def value(self, key: int) -> float:
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def add(self, value: float, weight: int = 1):
+        value = float(value)
+        if value > 0:
+            key = self.key(value)
+            self.bins[key] = self.bins.get(key, 0) + weight
+        else:
+            self.zero += weight
+        self.count += weight
+        self.sum += value * weight
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def merge(self, other: "QuantileSketch"):
+        if other.gamma != self.gamma:
+            raise ValueError("Sketches with different accuracy cannot be merged")
+        for key, weight in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + weight
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        for bound, pick in (("min", min), ("max", max)):
+            theirs = getattr(other, bound)
+            if theirs is not None:
+                mine = getattr(self, bound)
+                setattr(self, bound, theirs if mine is None else pick(mine, theirs))
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Value at quantile q (0..1), or None for an empty sketch."""
+        if self.count <= 0:
+            return None
+        # The extremes are kept exactly; a bin's value can fall either side of them
+        if q <= 0 and self.min is not None:
+            return self.min
+        if q >= 1 and self.max is not None:
+            return self.max
+        rank = q * (self.count - 1)
+        seen = self.zero
+        estimate = 0.0 if rank < seen else self.max
+        if rank >= seen:
+            for key in sorted(self.bins):
+                seen += self.bins[key]
+                if seen > rank:
+                    estimate = self.value(key)
+                    break
+        # Clamping to the exact extremes keeps the bound
+        if self.min is not None:
+            estimate = max(estimate, self.min)
+        if self.max is not None:
+            estimate = min(estimate, self.max)
+        return estimate
+
+    def summary(self, percentiles: Iterable[float] = ()) -> dict:
+        """Five-point summary plus any extra percentiles (0..100)."""
+        result = {
+            "count": self.count,
+            "min": self.min,
+            "max": self.max,
+            "mean": self.sum / self.count if self.count else None,
+            "25th_percentile": self.quantile(0.25),
+            "75th_percentile": self.quantile(0.75),
+        }
+        extra = {f"{p:g}": self.quantile(p / 100) for p in percentiles}
+        if extra:
+            result["percentiles"] = extra
+        return result
+
+    @classmethod
+    def from_doc(cls, data: dict) -> "QuantileSketch":
+        sketch = cls()
+        sketch.bins = {int(key): int(weight) for key, weight in (data.get("bins") or {}).items() if weight}
+        sketch.zero = int(data.get("zero") or 0)
+        sketch.count = int(data.get("count") or 0)
+        sketch.sum = float(data.get("sum") or 0)
+        sketch.min = data.get("min")
+        sketch.max = data.get("max")
+        return sketch
+
+    def to_doc(self) -> dict:
+        return {
+            "bins": {str(key): weight for key, weight in self.bins.items()},
+            "zero": self.zero,
+            "count": self.count,
+            "sum": self.sum,
+            "min": self.min,
+            "max": self.max,
+        }
+
+
+def _group(value) -> str:
+    # Firestore map keys cannot be empty
+    return str(value or "").strip() or "unspecified"
+
+
+def shards_collection(client):
+    return client.collection(SKETCH_COLLECTION).document(SKETCH_DOC).collection("shards")
+
+
+def _increments(price: float, sign: int) -> dict:
+    from firebase_admin import firestore
+    fields = {"count": firestore.Increment(sign), "sum": firestore.Increment(sign * price)}
+    if price > 0:
+        fields["bins"] = {str(QuantileSketch().key(price)): firestore.Increment(sign)}
+    else:
+        fields["zero"] = firestore.Increment(sign)
+    if sign > 0:
+        # A removal cannot restore the previous extremes; they stay as bounds
+        fields["min"] = firestore.Minimum(price)
+        fields["max"] = firestore.Maximum(price)
+    return fields
+
+
+def add_to_price_sketches(client, writer, candidate: dict, sign: int = 1):
+    """Queue a sold candidate's price on the batch or transaction that records the sale.
+
+    Pass sign=-1 when a sold candidate is deleted. Unsold candidates and
+    candidates without a price are ignored.
+    """
+    price = candidate.get("price")
+    if not candidate.get("sold") or price is None:
+        return
+    price = float(price)
+    sketches = {"all": _increments(price, sign)}
+    for field in BREAKDOWNS:
+        sketches[field] = {_group(candidate.get(field)): _increments(price, sign)}
+    writer.set(shards_collection(client).document(str(random.randrange(NUM_SHARDS))), {"sketches": sketches}, merge=True)
+
+
+def parse_sketches(data: dict) -> Dict[str, object]:
+    """{"all": sketch, "role": {role: sketch}, "city": {city: sketch}} from a sketch shard."""
+    sketches = data.get("sketches") or {}
+    parsed = {"all": QuantileSketch.from_doc(sketches.get("all") or {})}
+    for field in BREAKDOWNS:
+        groups = {name: QuantileSketch.from_doc(group) for name, group in (sketches.get(field) or {}).items()}
+        parsed[field] = {name: sketch for name, sketch in groups.items() if sketch.count > 0}
+    return parsed
+
+
+def merge_sketches(parsed: Iterable[Dict[str, object]]) -> Dict[str, object]:
+    """One set of sketches from parse_sketches() of every shard."""
+    merged = {"all": QuantileSketch(), **{field: {} for field in BREAKDOWNS}}
+    for sketches in parsed:
+        merged["all"].merge(sketches["all"])
+        for field in BREAKDOWNS:
+            for name, sketch in sketches[field].items():
+                merged[field].setdefault(name, QuantileSketch()).merge(sketch)
+    return merged
+
+
+async def read_price_sketches(db) -> Optional[Dict[str, object]]:
+    """Sketches merged from their shards; None until a rebuild has seeded them."""
+    shards = [shard.to_dict() or {} async for shard in shards_collection(db).stream()]
+    if not any(shard.get("built_at") for shard in shards):
+        return None
+    return merge_sketches(parse_sketches(shard) for shard in shards)
+
+
+def build_sketches(candidates: Iterable[dict]) -> Dict[str, object]:
+    """Sketches of the given sold candidates, in the shape parse_sketches returns."""
+    sketches = {"all": QuantileSketch(), **{field: {} for field in BREAKDOWNS}}
+    for candidate in candidates:
+        price = candidate.get("price")
+        if price is None:
+            continue
+        sketches["all"].add(price)
+        for field in BREAKDOWNS:
+            sketches[field].setdefault(_group(candidate.get(field)), QuantileSketch()).add(price)
+    return sketches
+
+
+def rebuild_price_sketches(sync_db) -> int:
+    """Recompute the sketches from every sold candidate; returns the sales counted.
+
+    Shards are overwritten, so sales recorded while it runs can be lost; run
+    it when no sales are in flight, e.g. once before enabling the sketch.
+    """
+    docs = sync_db.collection("candidates").where("sold", "==", True).select(["price", *BREAKDOWNS]).stream()
+    sketches = build_sketches(doc.to_dict() for doc in docs)
+
+    batch = sync_db.batch()
+    # The single sketch document written before the sketches were sharded
+    batch.delete(sync_db.collection(SKETCH_COLLECTION).document(SKETCH_DOC))
+    for shard in shards_collection(sync_db).stream():
+        if shard.id != "0":
+            batch.delete(shard.reference)
+    batch.set(shards_collection(sync_db).document("0"), {
+        "sketches": {
+            "all": sketches["all"].to_doc(),
+            **{field: {name: sketch.to_doc() for name, sketch in sketches[field].items()} for field in BREAKDOWNS},
+        },
+        "built_at": datetime.now(timezone.utc),
+    })
+    batch.commit()
+    return sketches["all"].count
+
+
+if __name__ == "__main__":
+    # python price_sketch.py rebuild
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command == "rebuild":
+        from datastore import sync_db
+        print(f"{rebuild_price_sketches(sync_db)} sales sketched")
+    else:
+        sys.exit(f"Unknown command: {command}")
@@ -0,0 +1,182 @@
+import json
+import sys
+from itertools import combinations
+from typing import Any, Dict, List, Optional
+
+# Equality filters in the order we expect them to narrow the result set
+EQUALITY_FIELDS = ["role", "city", "notice_period", "country", "sold"]
+
+# Range filters; only one can be pushed down per query, earlier entries win
+RANGE_FIELDS = {
+    "ctc": "<=",
+    "experience": ">=",
+}
+
+# Composite indexes grow combinatorially, so cap the equality filters sent to Firestore
+MAX_EQUALITY_PUSHDOWN = 2
+
+# Firestore rejects array_contains_any with more values than this
+MAX_ARRAY_VALUES = 10
+
+# Fields stored lowercased next to the originals so equality filters stay case-insensitive
+SHADOW_FIELDS = ["city", "country", "role", "notice_period"]
+
+
+def shadow_field(field: str) -> str:
+    return f"{field}_lower"
+
+
+def shadow_fields(data: dict) -> Dict[str, Any]:
+    """Normalized copies of the filterable fields to store alongside a candidate."""
+    shadows = {shadow_field(field): (data.get(field) or "").lower() for field in SHADOW_FIELDS}
+    shadows["skills_lower"] = sorted({skill.lower() for skill in data.get("skills") or []})
+    return shadows
+
+
+class QueryPlan:
+    """Filters split between what Firestore evaluates and what is checked in memory."""
+
+    def __init__(self):
+        self.equalities: List[tuple] = []
+        self.array_filter: Optional[tuple] = None
+        self.range_filter: Optional[tuple] = None
+        self.filters: Dict[str, Any] = {}
+
+    def apply(self, query):
+        """Attach the pushed-down filters to a Firestore query."""
+        for field, value in self.equalities:
+            query = query.where(field, "==", value)
+        if self.array_filter:
+            query = query.where(self.array_filter[0], "array_contains_any", self.array_filter[1])
+        if self.range_filter:
+            query = query.where(*self.range_filter)
+        return query
+
+    def matches(self, candidate_data: dict) -> bool:
+        """Check every requested filter in memory (cheap for the predicates already pushed down)."""
+        f = self.filters
+        return (
+            (f.get("city") is None or candidate_data.get("city", "").lower() == f["city"].lower()) and
+            (f.get("country") is None or candidate_data.get("country", "").lower() == f["country"].lower()) and
+            (f.get("ctc") is None or candidate_data.get("ctc", float("inf")) <= f["ctc"]) and
+            (f.get("role") is None or candidate_data.get("role", "").lower() == f["role"].lower()) and
+            (f.get("experience") is None or candidate_data.get("experience", 0) >= f["experience"]) and
+            (f.get("notice_period") is None or candidate_data.get("notice_period", "").lower() == f["notice_period"].lower()) and
+            (f.get("skills") is None or ("skills" in candidate_data and all(skill.lower() in [s.lower() for s in candidate_data["skills"]] for skill in f["skills"]))) and
+            (f.get("sold") is None or candidate_data.get("sold", False) == f["sold"])
+        )
+
+    def index_definition(self) -> Optional[dict]:
+        """Composite index Firestore needs for this plan, or None when single-field indexes suffice."""
+        fields = [{"fieldPath": field, "order": "ASCENDING"} for field, _ in self.equalities]
+        if self.array_filter:
+            fields.append({"fieldPath": self.array_filter[0], "arrayConfig": "CONTAINS"})
+        if self.range_filter:
+            fields.append({"fieldPath": self.range_filter[0], "order": "ASCENDING"})
+        if len(fields) < 2:
+            return None
+        return {"collectionGroup": "candidates", "queryScope": "COLLECTION", "fields": fields}
+
+    def fallback(self) -> "QueryPlan":
+        """Plan that pushes down only the most selective filter, served by automatic indexes."""
+        plan = QueryPlan()
+        plan.filters = self.filters
+        if self.equalities:
+            plan.equalities = self.equalities[:1]
+        elif self.array_filter:
+            plan.array_filter = self.array_filter
+        else:
+            plan.range_filter = self.range_filter
+        return plan
+
+
+def plan_candidate_filter(**filters) -> QueryPlan:
+    """Choose which candidate filters Firestore evaluates; the rest run on the narrowed result."""
+    plan = QueryPlan()
+    plan.filters = filters
+
+    for field in EQUALITY_FIELDS:
+        if len(plan.equalities) >= MAX_EQUALITY_PUSHDOWN:
+            break
+        value = filters.get(field)
+        if value is None:
+            continue
+        if field == "sold":
+            plan.equalities.append(("sold", value))
+        else:
+            plan.equalities.append((shadow_field(field), value.lower()))
+
+    skills = filters.get("skills")
+    if skills:
+        plan.array_filter = ("skills_lower", sorted({skill.lower() for skill in skills})[:MAX_ARRAY_VALUES])
+
+    for field, op in RANGE_FIELDS.items():
+        if filters.get(field) is not None:
+            plan.range_filter = (field, op, filters[field])
+            break
+
+    return plan
+
+
+def all_index_definitions() -> List[dict]:
+    """Every composite index the planner can ask for, in firestore.indexes.json form."""
+    indexes = []
+    for size in range(MAX_EQUALITY_PUSHDOWN + 1):
+        for equality_fields in combinations(EQUALITY_FIELDS, size):
+            for use_skills in (False, True):
+                for range_field in [None, *RANGE_FIELDS]:
+                    filters = {field: "x" if field != "sold" else False for field in equality_fields}
+                    if use_skills:
+                        filters["skills"] = ["x"]
+                    if range_field:
+                        filters[range_field] = 0
+                    definition = plan_candidate_filter(**filters).index_definition()
+                    if definition:
+                        indexes.append(definition)
+    return indexes
+
+
+def backfill_shadow_fields(db, batch_size: int = 500):
+    """Write shadow fields onto candidates created before they existed."""
+    batch = db.batch()
+    pending = 0
+    updated = 0
+    for doc in db.collection("candidates").stream():
+        data = doc.to_dict()
+        shadows = shadow_fields(data)
+        if all(data.get(key) == value for key, value in shadows.items()):
+            continue
+        batch.update(doc.reference, shadows)
+        pending += 1
+        updated += 1
+        if pending == batch_size:
+            batch.commit()
+            batch = db.batch()
+            pending = 0
+    if pending:
+        batch.commit()
+    return updated
+
+
+if __name__ == "__main__":
+    # python query_planner.py indexes > firestore.indexes.json
+    # python query_planner.py backfill
+    command = sys.argv[1] if len(sys.argv) > 1 else "indexes"
+    if command == "indexes":
+        from bid_metrics import FIELD_OVERRIDES as BID_METRIC_OVERRIDES
+        from biding import INDEXES as BID_INDEXES
+        from candidate_aging import FIELD_OVERRIDES as AGING_OVERRIDES
+        from candidate_by_recruiter import INDEXES as RECRUITER_INDEXES
+        from chat_rollups import FIELD_OVERRIDES as CHAT_OVERRIDES, INDEXES as CHAT_INDEXES
+        from facet_catalog import FIELD_OVERRIDES as FACET_OVERRIDES
+        from price_sketch import FIELD_OVERRIDES as SKETCH_OVERRIDES
+        from rollups import FIELD_OVERRIDES
+        overrides = (FIELD_OVERRIDES + SKETCH_OVERRIDES + BID_METRIC_OVERRIDES + AGING_OVERRIDES
+                     + CHAT_OVERRIDES + FACET_OVERRIDES)
+        indexes = all_index_definitions() + CHAT_INDEXES + RECRUITER_INDEXES + BID_INDEXES
+        print(json.dumps({"indexes": indexes, "fieldOverrides": overrides}, indent=2))
+    elif command == "backfill":
+        from datastore import sync_db
+        print(f"{backfill_shadow_fields(sync_db)} candidates updated")
+    else:
+        sys.exit(f"Unknown command: {command}")
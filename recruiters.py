@@ -1,57 +1,64 @@
-from fastapi import FastAPI, HTTPException
-import firebase_admin
-from firebase_admin import credentials, firestore
-from fastapi.middleware.cors import CORSMiddleware
-import os
-from dotenv import load_dotenv
-load_dotenv()
+from fastapi import APIRouter, HTTPException, Query, Request
+from typing import Optional
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, fetch_page, parse_fields, project
+from streaming import ndjson_response, wants_ndjson
+from datastore import db
+from service import service_app
 
-# Initialize FastAPI app
-app = FastAPI()
+router = APIRouter()
 
-# Load Firebase credentials from environment variable
-cred = credentials.Certificate(os.getenv("FIREBASE_CREDENTIALS_PATH"))
-firebase_admin.initialize_app(cred)
-
-# Initialize Firestore client
-db = firestore.client()
+@router.get("/recruiters")
+async def get_all_recruiters(
+    request: Request,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    start_after: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
+):
+    """Fetch recruiters from Firestore, one page at a time"""
+    try:
+        # Order by document ID only, so profiles without created_at are still listed
+        field_list = parse_fields(fields)
 
-# Enable CORS (Cross-Origin Resource Sharing)
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],  # Allow requests from any origin
-    allow_credentials=True,
-    allow_methods=["*"],  # Allow all HTTP methods
-    allow_headers=["*"],  # Allow all headers
-)
+        # Full export: stream every document instead of paging
+        if wants_ndjson(request):
+            query = db.collection("recruiters")
+            if field_list:
+                query = query.select(field_list)
+            return ndjson_response(
+                {**recruiter.to_dict(), "id": recruiter.id} async for recruiter in query.stream()
+            )
 
-@app.get("/recruiters")
-def get_all_recruiters():
-    """Fetch all recruiters from Firestore"""
-    try:
-        recruiters_ref = db.collection("recruiters").stream()
+        recruiters_ref, next_cursor = await fetch_page(
+            db.collection("recruiters"),
+            order_by=(),
+            limit=limit,
+            start_after=start_after,
+            fields=field_list,
+        )
         recruiters = []
         
         # Retrieve recruiter data from Firestore
         for recruiter in recruiters_ref:
-            recruiter_data = recruiter.to_dict()
+            recruiter_data = project(recruiter.to_dict(), field_list)
             recruiter_data["id"] = recruiter.id  # Include document ID
             recruiters.append(recruiter_data)
 
-        return {"recruiters": recruiters}
+        return {"recruiters": recruiters, "next_cursor": next_cursor}
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-@app.get("/sponsored-recruiters")
-def get_sponsored_recruiters():
+@router.get("/sponsored-recruiters")
+async def get_sponsored_recruiters():
     """Fetch only recruiters with sponsored.status = True"""
     try:
         recruiters_ref = db.collection("recruiters").where("sponsored.status", "==", True).stream()
         sponsored_recruiters = []
         
         # Retrieve sponsored recruiter data from Firestore
-        for recruiter in recruiters_ref:
+        async for recruiter in recruiters_ref:
             recruiter_data = recruiter.to_dict()
             recruiter_data["id"] = recruiter.id  # Include document ID
             sponsored_recruiters.append(recruiter_data)
@@ -61,12 +68,12 @@ def get_sponsored_recruiters():
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-@app.get("/recruiter/{recruiter_id}")
-def get_recruiter_by_id(recruiter_id: str):
+@router.get("/recruiter/{recruiter_id}")
+async def get_recruiter_by_id(recruiter_id: str):
     """Fetch a specific recruiter's details by ID"""
     try:
         recruiter_ref = db.collection("recruiters").document(recruiter_id)
-        recruiter_doc = recruiter_ref.get()
+        recruiter_doc = await recruiter_ref.get()
         
         if recruiter_doc.exists:
             recruiter_data = recruiter_doc.to_dict()
@@ -79,6 +86,9 @@ def get_recruiter_by_id(recruiter_id: str):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 # Run the FastAPI app
 if __name__ == "__main__":
     import uvicorn
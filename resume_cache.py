@@ -0,0 +1,158 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Where a lookup was answered from
+MEMORY, DISK, MISS = "memory", "disk", "miss"
+
+# The disk tier is pruned on a write at most this often
+PRUNE_SECONDS = 60
+
+
+def content_key(data: bytes, version: str) -> str:
+    """SHA-256 of the file bytes and the extraction version, so a prompt or model change misses."""
+    digest = hashlib.sha256()
+    digest.update(version.encode())
+    digest.update(b"\0")
+    digest.update(data)
+    return digest.hexdigest()
+
+
+class ResumeCache:
+    """Parsed resumes keyed by content hash: an LRU in memory in front of JSON files on disk.
+
+    The memory tier is per worker; the disk tier is shared by every worker
+    pointed at the same directory and survives restarts. Files are written
+    to a temporary name and renamed, so a reader never sees half a result.
+
+    Parsed resumes are personal data: the directory is only used when one is
+    given, is readable by this user alone, and entries are deleted after
+    `max_age` seconds or, oldest first, once they take more than `max_bytes`.
+    get() and put() touch the disk, so async callers run them in a thread.
+    """
+
+    def __init__(self, directory: Optional[str] = None, max_entries: int = 256,
+                 max_bytes: int = 512 * 1024 * 1024, max_age: float = 7 * 24 * 3600):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {MEMORY: 0, DISK: 0, MISS: 0, "stores": 0, "evicted": 0}
+        self._pruned_at = 0.0
+        if directory is not None:
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+            # makedirs leaves an existing directory's mode alone
+            os.chmod(directory, 0o700)
+
+    def _path(self, key: str) -> str:
+        # Two-character fan-out keeps directories small
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _remember(self, key: str, value: dict):
+        with self._lock:
+            self._memory[key] = value
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> Tuple[Optional[dict], str]:
+        """(cached result, tier it came from), or (None, MISS)."""
+        with self._lock:
+            value = self._memory.get(key)
+            if value is not None:
+                self._memory.move_to_end(key)
+                self._stats[MEMORY] += 1
+                return value, MEMORY
+
+        value = self._read(key) if self.directory is not None else None
+
+        with self._lock:
+            self._stats[DISK if value is not None else MISS] += 1
+        if value is None:
+            return None, MISS
+        self._remember(key, value)
+        return value, DISK
+
+    def _read(self, key: str) -> Optional[dict]:
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.max_age:
+                os.remove(path)
+                return None
+            with open(path, encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning("Ignoring unreadable resume cache entry %s: %s", key, e)
+            return None
+
+    def put(self, key: str, value: dict):
+        self._remember(key, value)
+        with self._lock:
+            self._stats["stores"] += 1
+        if self.directory is None:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump(value, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            # The memory tier still has it; a full or read-only disk must not fail the request
+            logger.warning("Could not write resume cache entry %s: %s", key, e)
+        if time.monotonic() - self._pruned_at >= PRUNE_SECONDS:
+            self._pruned_at = time.monotonic()
+            self.prune()
+
+    def prune(self) -> int:
+        """Delete expired entries, then the oldest ones while over max_bytes; returns the files deleted."""
+        entries = []
+        now = time.time()
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        deleted = 0
+        for mtime, size, path in entries:
+            if now - mtime <= self.max_age and total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                deleted += 1
+            except FileNotFoundError:
+                # Another worker pruned it first
+                pass
+            except OSError as e:
+                logger.warning("Could not evict resume cache entry %s: %s", path, e)
+                continue
+            total -= size
+        with self._lock:
+            self._stats["evicted"] += deleted
+        return deleted
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats[MEMORY] + stats[DISK] + stats[MISS]
+        stats["hit_rate"] = round((stats[MEMORY] + stats[DISK]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -0,0 +1,123 @@
+import re
+from typing import Any, Dict, List, Tuple
+
+# Fields found at or above this confidence are not asked of the LLM
+CONFIDENCE_THRESHOLD = 0.8
+
+# Skills recognised without the LLM, in the spelling they are reported with. Names
+# that are also ordinary words (Go, R, C, Swift, Spring, Oracle, REST, Excel,
+# Rust, Spark, ...) are left out: matched case-insensitively in free text they
+# would turn prose into skills. The LLM is still asked for skills, so they are
+# found there.
+SKILLS = [
+    "Python", "Java", "JavaScript", "TypeScript", "C++", "C#", "Golang", "Kotlin", "Scala", "PHP",
+    "Perl", "MATLAB", "Objective-C", "Haskell",
+    "SQL", "NoSQL", "PostgreSQL", "MySQL", "SQLite", "MongoDB", "Redis", "Cassandra",
+    "Elasticsearch", "DynamoDB", "Firestore", "Firebase", "BigQuery", "Redshift",
+    "HTML", "CSS", "Sass", "React", "Vue.js", "Next.js", "Node.js", "Express.js",
+    "Redux", "jQuery", "Tailwind CSS", "GraphQL", "gRPC",
+    "Django", "FastAPI", "Spring Boot", ".NET", "ASP.NET",
+    "Ruby on Rails", "Laravel", "Android", "iOS", "React Native",
+    "AWS", "Azure", "GCP", "Google Cloud", "Docker", "Kubernetes", "Terraform", "Ansible",
+    "Jenkins", "GitHub Actions", "GitLab CI", "CI/CD", "Linux", "Git", "Kafka", "RabbitMQ",
+    "Hadoop", "dbt", "Pandas", "NumPy", "scikit-learn", "TensorFlow",
+    "PyTorch", "Keras", "OpenCV", "NLP", "Machine Learning", "Deep Learning", "Computer Vision",
+    "Power BI", "Selenium", "JUnit", "Pytest", "Microservices", "Jira", "Figma", "Salesforce",
+]
+
+# The dictionary is closed, so these fields are asked of the LLM whatever the
+# rules found; what the rules found is merged into the answer
+ALWAYS_ASKED = ("skills",)
+
+_SKILL_PATTERNS = [
+    (skill, re.compile(r"(?<![\w+#.])" + re.escape(skill) + r"(?![\w+#])", re.IGNORECASE))
+    for skill in SKILLS
+]
+
+EMAIL_RE = re.compile(r"[A-Za-z0-9._%+-]+@[A-Za-z0-9-]+(?:\.[A-Za-z0-9-]+)*\.[A-Za-z]{2,}")
+LINKEDIN_RE = re.compile(r"(?:https?://)?(?:[a-z]{2,3}\.)?linkedin\.com/in/([A-Za-z0-9_%-]+)", re.IGNORECASE)
+PHONE_RE = re.compile(r"(?<![\w+])\+?\(?\d[\d\s().-]{7,}\d(?!\w)")
+PHONE_LABEL_RE = re.compile(r"\b(?:phone|mobile|mob|cell|contact|tel|whatsapp)\b", re.IGNORECASE)
+# Employment periods ("01.2015 - 03.2019", "2015 – 2019") that PHONE_RE would read as numbers
+DATE_RANGE_RE = re.compile(r"\d{1,2}[./]\d{4}\s*[-–]|\b(?:19|20)\d{2}\s*[-–]\s*(?:19|20)\d{2}\b")
+SKILLS_HEADER_RE = re.compile(r"^\s*(?:technical\s+|key\s+|core\s+)?skills\b", re.IGNORECASE | re.MULTILINE)
+
+_YEARS = r"(\d{1,2}(?:\.\d{1,2})?)\s*\+?\s*(?:years?|yrs?)"
+_FILLER = r"(?:\s+(?:of|in))?(?:\s+(?:total|overall|professional|work|working|industry|relevant|it))*"
+EXPERIENCE_RES = [
+    re.compile(_YEARS + _FILLER + r"\s+experience", re.IGNORECASE),
+    re.compile(r"(?:total\s+)?experience\s*(?:of|:|-|–)?\s*" + _YEARS, re.IGNORECASE),
+]
+
+
+def _email(text: str):
+    found = list(dict.fromkeys(match.lower() for match in EMAIL_RE.findall(text)))
+    if not found:
+        return None
+    return found[0], 0.98 if len(found) == 1 else 0.7
+
+
+def _linkedin(text: str):
+    found = list(dict.fromkeys(handle.strip("/") for handle in LINKEDIN_RE.findall(text)))
+    if not found:
+        return None
+    return f"https://www.linkedin.com/in/{found[0]}", 0.95 if len(found) == 1 else 0.7
+
+
+def _phone(text: str):
+    labelled: List[str] = []
+    unlabelled: List[str] = []
+    for line in text.splitlines():
+        for match in PHONE_RE.findall(line):
+            digits = re.sub(r"\D", "", match)
+            # Shorter runs are dates, year ranges or postcodes
+            if not 10 <= len(digits) <= 15 or DATE_RANGE_RE.search(match):
+                continue
+            number = ("+" if match.lstrip().startswith("+") else "") + digits
+            (labelled if PHONE_LABEL_RE.search(line) else unlabelled).append(number)
+    if labelled:
+        return labelled[0], 0.95
+    distinct = list(dict.fromkeys(unlabelled))
+    if not distinct:
+        return None
+    # Without a label any ten-digit run (an ID, an account number) looks the same;
+    # kept below the threshold, so it is only a fallback for the LLM's answer
+    return distinct[0], 0.7 if len(distinct) == 1 else 0.5
+
+
+def _experience(text: str):
+    years = {float(value) for pattern in EXPERIENCE_RES for value in pattern.findall(text)}
+    years = {value for value in years if value < 60}
+    if not years:
+        return None
+    # Several figures usually mean per-skill experience next to the total; the total is the largest
+    return max(years), 0.9 if len(years) == 1 else 0.7
+
+
+def _skills(text: str):
+    found = [skill for skill, pattern in _SKILL_PATTERNS if pattern.search(text)]
+    if not found:
+        return None
+    # Only the dictionary's share of the skills; see ALWAYS_ASKED
+    return found, 0.6 if SKILLS_HEADER_RE.search(text) is None else 0.7
+
+
+_EXTRACTORS = {
+    "email": _email,
+    "linkedin": _linkedin,
+    "contact_number": _phone,
+    "experience": _experience,
+    "skills": _skills,
+}
+
+RULE_FIELDS = list(_EXTRACTORS)
+
+
+def extract_fields(text: str) -> Dict[str, Tuple[Any, float]]:
+    """{field: (value, confidence)} for the fields the rules found in the resume text."""
+    found = {}
+    for field, extractor in _EXTRACTORS.items():
+        result = extractor(text)
+        if result is not None:
+            found[field] = result
+    return found
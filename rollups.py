@@ -0,0 +1,409 @@
+import asyncio
+import math
+import sys
+import zlib
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from counters import NUM_SHARDS
+
+# Pre-aggregated candidate counts by created_at, kept next to the candidates themselves
+ROLLUP_COLLECTION = "candidate_rollups"
+
+# Marker written by a full rebuild; until it exists the dashboard reads raw candidates
+META_DOC = "_meta"
+
+# Bucket granularities
+HOUR, DAY, MONTH = "hour", "day", "month"
+
+# Cell keys are role|city|sold|experience band|ctc band
+CELL_SEPARATOR = "|"
+
+# Role and city labels are cut to this length, so a cell entry stays under ~200 bytes
+MAX_LABEL = 64
+
+# Each candidate bucket is split over shard documents "<bucket id>.<n>", a cell
+# always landing in the shard its key hashes to. Concurrent creates with
+# different cells write different documents, and a month bucket holds a tenth
+# of the month's cells per document: at least 5000 distinct cells each before
+# it nears Firestore's 1 MiB document limit.
+ROLLUP_SHARDS = NUM_SHARDS
+
+# Shard documents one add_to_rollups call writes at most when its candidates share a created_at
+MAX_BUCKET_WRITES = 3 * ROLLUP_SHARDS
+
+# Bucket documents hold one map entry per cell; indexing those would only cost writes
+FIELD_OVERRIDES = [{
+    "collectionGroup": ROLLUP_COLLECTION,
+    "fieldPath": "cells",
+    "indexes": [],
+}]
+
+
+def as_utc(value: datetime) -> datetime:
+    """Naive datetimes are UTC, as Firestore timestamps are."""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def _fmt(value: float) -> str:
+    return format(round(value, 10), ".12g")
+
+
+def band(value) -> str:
+    """Band of a numeric value: the value itself if it has at most two significant digits,
+    otherwise the open interval between its two-significant-digit neighbours.
+
+    Filter thresholds people type (5, 7.5, 12, 1200000) are band edges, so a
+    band is always wholly inside or outside such a range.
+    """
+    v = float(value or 0)
+    if v == 0:
+        return "0"
+    scale = 10.0 ** (math.floor(math.log10(abs(v))) - 1)
+    q = v / scale
+    if abs(q - round(q)) < 1e-9:
+        return _fmt(round(q) * scale)
+    return f"{_fmt(math.floor(q) * scale)}~{_fmt((math.floor(q) + 1) * scale)}"
+
+
+def band_bounds(key: str) -> Tuple[float, float, bool]:
+    """(low, high, exact) of a band key."""
+    if "~" in key:
+        low, high = key.split("~")
+        return float(low), float(high), False
+    return float(key), float(key), True
+
+
+def _label(value) -> str:
+    return str(value or "").strip().replace(CELL_SEPARATOR, "/")[:MAX_LABEL]
+
+
+def cell_key(candidate: dict) -> str:
+    return CELL_SEPARATOR.join([
+        _label(candidate.get("role")),
+        _label(candidate.get("city")),
+        "1" if candidate.get("sold") else "0",
+        band(candidate.get("experience")),
+        band(candidate.get("ctc")),
+    ])
+
+
+def bucket_start(moment: datetime, granularity: str) -> datetime:
+    moment = as_utc(moment)
+    if granularity == HOUR:
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == DAY:
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    return moment.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def bucket_id(start: datetime, granularity: str) -> str:
+    if granularity == HOUR:
+        return f"h-{start:%Y-%m-%dT%H}"
+    if granularity == DAY:
+        return f"d-{start:%Y-%m-%d}"
+    return f"m-{start:%Y-%m}"
+
+
+def cell_shard(key: str) -> int:
+    # crc32 rather than hash(), which differs between processes
+    return zlib.crc32(key.encode()) % ROLLUP_SHARDS
+
+
+def shard_doc_id(doc_id: str, shard: int) -> str:
+    return f"{doc_id}.{shard}"
+
+
+def _created_at(candidate: dict, default: datetime) -> datetime:
+    created_at = candidate.get("created_at")
+    return created_at if isinstance(created_at, datetime) else default
+
+
+def bucket_deltas(entries: Iterable[Tuple[dict, int]], now: Optional[datetime] = None) -> Dict[str, dict]:
+    """Per bucket document: start, granularity and cell deltas for (candidate, delta) pairs.
+
+    Candidates whose created_at is still a server timestamp sentinel are
+    bucketed at `now`.
+    """
+    now = now or datetime.now(timezone.utc)
+    buckets: Dict[str, dict] = {}
+    for candidate, delta in entries:
+        key = cell_key(candidate)
+        created_at = _created_at(candidate, now)
+        for granularity in (HOUR, DAY, MONTH):
+            start = bucket_start(created_at, granularity)
+            bucket = buckets.setdefault(bucket_id(start, granularity), {
+                "granularity": granularity, "start": start, "cells": defaultdict(int),
+            })
+            bucket["cells"][key] += delta
+    return buckets
+
+
+def shard_buckets(buckets: Dict[str, dict]) -> Dict[str, dict]:
+    """Split bucket_deltas() output into its shard documents."""
+    shards: Dict[str, dict] = {}
+    for doc_id, bucket in buckets.items():
+        for key, delta in bucket["cells"].items():
+            shard = shards.setdefault(shard_doc_id(doc_id, cell_shard(key)), {
+                "granularity": bucket["granularity"], "start": bucket["start"], "cells": {},
+            })
+            shard["cells"][key] = delta
+    return shards
+
+
+def add_to_rollups(client, writer, entries: Iterable[Tuple[dict, int]], now: Optional[datetime] = None):
+    """Queue rollup increments on the batch or transaction that writes the candidates.
+
+    `entries` are (candidate data, +1/-1) pairs; a sale is the candidate as it
+    was with -1 and as it is now with +1. Each touched shard document gets one write.
+    """
+    from firebase_admin import firestore
+    collection = client.collection(ROLLUP_COLLECTION)
+    for doc_id, bucket in shard_buckets(bucket_deltas(entries, now)).items():
+        cells = {key: firestore.Increment(delta) for key, delta in bucket["cells"].items() if delta}
+        if cells:
+            writer.set(collection.document(doc_id), {
+                "granularity": bucket["granularity"],
+                "start": bucket["start"],
+                "cells": cells,
+            }, merge=True)
+
+
+def rebuild_rollups(sync_db) -> int:
+    """Recompute every bucket from the candidates collection; returns the buckets written.
+
+    Buckets are overwritten wholesale, so run it while candidates are not
+    being written, e.g. once before enabling the rollup read path.
+    """
+    fields = ["created_at", "role", "city", "sold", "experience", "ctc"]
+    docs = sync_db.collection("candidates").select(fields).stream()
+    epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+    buckets = bucket_deltas(((doc.to_dict(), 1) for doc in docs), now=epoch)
+    # The marker records the layout; readers fall back to raw candidates until it matches
+    return write_buckets(sync_db, ROLLUP_COLLECTION, shard_buckets(buckets), meta={"shards": ROLLUP_SHARDS})
+
+
+def add_to_metric_buckets(client, writer, collection_name: str, moment: datetime, increments: Dict[str, float]):
+    """Queue increments of flat metric fields on the hour, day and month buckets of a moment."""
+    from firebase_admin import firestore
+    collection = client.collection(collection_name)
+    fields = {metric: firestore.Increment(delta) for metric, delta in increments.items() if delta}
+    for granularity in (HOUR, DAY, MONTH):
+        start = bucket_start(moment, granularity)
+        writer.set(collection.document(bucket_id(start, granularity)), {
+            "granularity": granularity, "start": start, **fields,
+        }, merge=True)
+
+
+async def read_metric_buckets(db, collection_name: str, start: datetime, end: datetime, granularity: str,
+                              metrics) -> Optional[Dict[datetime, Dict[str, float]]]:
+    """Metric totals per bucket start over [start, end], or None until the buckets were built."""
+    from datastore import get_all
+    collection = db.collection(collection_name)
+    ids = plan_bucket_ids(start, end, granularity, edge=HOUR)
+    docs = await get_all([collection.document(META_DOC)] + [collection.document(doc_id) for doc_id in ids])
+
+    if not any(doc.id == META_DOC and doc.exists for doc in docs):
+        return None
+    return {
+        as_utc(data["start"]): {metric: data.get(metric, 0) for metric in metrics}
+        for data in (doc.to_dict() for doc in docs if doc.exists and doc.id != META_DOC)
+    }
+
+
+def write_buckets(sync_db, collection_name: str, buckets: Dict[str, dict], meta: Optional[dict] = None) -> int:
+    """Replace a bucket collection wholesale and mark it built; returns the buckets written.
+
+    `meta` adds fields to the built marker.
+    """
+    collection = sync_db.collection(collection_name)
+    stale = {doc.id for doc in collection.select([]).stream()} - set(buckets) - {META_DOC}
+
+    batch, pending = sync_db.batch(), 0
+    writes = [(doc_id, None) for doc_id in stale] + list(buckets.items())
+    for doc_id, data in writes:
+        if data is None:
+            batch.delete(collection.document(doc_id))
+        else:
+            batch.set(collection.document(doc_id), data)
+        pending += 1
+        if pending == 500:
+            batch.commit()
+            batch, pending = sync_db.batch(), 0
+    batch.set(collection.document(META_DOC), {**(meta or {}), "built_at": datetime.now(timezone.utc)})
+    batch.commit()
+    return len(buckets)
+
+
+class CellFilter:
+    """Candidate filters evaluated against rollup cells instead of documents."""
+
+    def __init__(self, roles=None, city=None, min_experience=None, max_experience=None,
+                 min_ctc=None, max_ctc=None, sold=None):
+        self.roles = {_label(role) for role in roles} if roles else None
+        self.city = {_label(c) for c in city} if city else None
+        self.experience = (min_experience, max_experience)
+        self.ctc = (min_ctc, max_ctc)
+        self.sold = sold
+
+    @staticmethod
+    def _in_range(band_key: str, bounds) -> Optional[bool]:
+        """True/False when the band is wholly inside/outside the range, None when it straddles."""
+        minimum, maximum = bounds
+        if minimum is None and maximum is None:
+            return True
+        low, high, exact = band_bounds(band_key)
+        if exact:
+            return (minimum is None or low >= minimum) and (maximum is None or low <= maximum)
+        # Open interval (low, high)
+        if (minimum is None or low >= minimum) and (maximum is None or high <= maximum):
+            return True
+        if (minimum is not None and high <= minimum) or (maximum is not None and low >= maximum):
+            return False
+        return None
+
+    def matches(self, key: str) -> Optional[bool]:
+        role, city, sold, experience, ctc = key.split(CELL_SEPARATOR)
+        if self.roles is not None and role not in self.roles:
+            return False
+        if self.city is not None and city not in self.city:
+            return False
+        if self.sold is not None and (sold == "1") != self.sold:
+            return False
+        in_experience = self._in_range(experience, self.experience)
+        in_ctc = self._in_range(ctc, self.ctc)
+        if in_experience is False or in_ctc is False:
+            return False
+        if in_experience is None or in_ctc is None:
+            return None
+        return True
+
+
+def _hour_ids(first: datetime, last: datetime) -> List[str]:
+    ids, moment = [], bucket_start(first, HOUR)
+    while moment <= last:
+        ids.append(bucket_id(moment, HOUR))
+        moment += timedelta(hours=1)
+    return ids
+
+
+def plan_bucket_ids(start: datetime, end: datetime, granularity: str, edge: str = DAY) -> List[str]:
+    """Bucket documents covering [start, end] at the given granularity.
+
+    MONTH uses whole months where they fit and days elsewhere; it only suits
+    series binned by month or coarser. With edge=HOUR, partial first and last
+    days are covered by hour buckets, so the range is exact to the hour
+    rather than the day; the collection must keep hour buckets.
+    """
+    start, end = as_utc(start), as_utc(end)
+    if granularity == HOUR:
+        return _hour_ids(start, end)
+
+    ids, tail, day = [], [], bucket_start(start, DAY)
+    last_day = bucket_start(end, DAY)
+    if edge == HOUR:
+        if start.hour:
+            ids += _hour_ids(start, min(end, day + timedelta(hours=23)))
+            day += timedelta(days=1)
+        if day <= last_day and end.hour < 23:
+            tail = _hour_ids(last_day, end)
+            last_day -= timedelta(days=1)
+    while day <= last_day:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        if granularity == MONTH and day.day == 1 and next_month - timedelta(days=1) <= last_day:
+            ids.append(bucket_id(day, MONTH))
+            day = next_month
+        else:
+            ids.append(bucket_id(day, DAY))
+            day += timedelta(days=1)
+    return ids + tail
+
+
+def _runs(ids: List[str]) -> List[Tuple[str, str]]:
+    """(first, last) of each run of same-granularity bucket IDs in a plan, which lists them in time order."""
+    runs: List[List[str]] = []
+    for doc_id in ids:
+        if runs and runs[-1][1][0] == doc_id[0]:
+            runs[-1][1] = doc_id
+        else:
+            runs.append([doc_id, doc_id])
+    return [(first, last) for first, last in runs]
+
+
+async def _shard_docs(collection, ids: List[str]) -> List[dict]:
+    """Every shard document of the planned buckets.
+
+    A plan is a few runs of consecutive bucket IDs, and a bucket's shards sort
+    right after its ID, so one document-ID range query per run returns the
+    shards that exist without a lookup per possible shard.
+    """
+    async def run_docs(first: str, last: str) -> List[dict]:
+        query = collection.where("__name__", ">=", collection.document(first))\
+            .where("__name__", "<", collection.document(last + "~"))
+        return [doc.to_dict() async for doc in query.stream()]
+
+    runs = await asyncio.gather(*(run_docs(first, last) for first, last in _runs(ids)))
+    return [data for run in runs for data in run]
+
+
+async def read_rollups(db, start: datetime, end: datetime, granularity: str, cell_filter: CellFilter):
+    """Matching {"count": n} per bucket start, or None when the rollups cannot answer exactly
+    (not built in the sharded layout yet, or a range filter that straddles a band)."""
+    collection = db.collection(ROLLUP_COLLECTION)
+    meta = await collection.document(META_DOC).get()
+    if (meta.to_dict() or {}).get("shards") != ROLLUP_SHARDS:
+        return None
+
+    counts: Dict[datetime, Dict[str, int]] = defaultdict(lambda: {"count": 0})
+    for data in await _shard_docs(collection, plan_bucket_ids(start, end, granularity, edge=HOUR)):
+        total = 0
+        for key, count in (data.get("cells") or {}).items():
+            matched = cell_filter.matches(key)
+            if matched is None:
+                return None
+            if matched:
+                total += count
+        if total:
+            counts[as_utc(data["start"])]["count"] += total
+    return counts
+
+
+# Dashboard series are binned from bucket starts; frequencies match the dashboards' Frequency enums
+ROLLUP_GRANULARITY = {
+    "hourly": HOUR,
+    "daily": DAY,
+    "weekly": DAY,
+    "monthly": MONTH,
+    "quarterly": MONTH,
+    "yearly": MONTH,
+}
+
+
+def series_from_buckets(totals: Dict[datetime, Dict[str, float]], start: datetime, end: datetime,
+                        frequency: str, metrics=("count",)) -> List[dict]:
+    """Dashboard series from per-bucket totals, zero-filled for empty periods."""
+    # NumPy adds to cold start; it is imported when the first series is built
+    import numpy as np
+    import timebuckets
+
+    moments = list(totals)
+    instants = np.array([as_utc(moment).timestamp() for moment in moments], dtype=np.float64)
+    values = {
+        metric: np.array([totals[moment].get(metric, 0) for moment in moments]) if moments
+        else np.zeros(0, dtype=np.int64)
+        for metric in metrics
+    }
+    return timebuckets.series(instants, start, end, frequency, values=values)
+
+
+if __name__ == "__main__":
+    # python rollups.py rebuild
+    command = sys.argv[1] if len(sys.argv) > 1 else "rebuild"
+    if command == "rebuild":
+        from datastore import sync_db
+        print(f"{rebuild_rollups(sync_db)} rollup buckets written")
+    else:
+        sys.exit(f"Unknown command: {command}")
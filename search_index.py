@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from candidate_changes import CandidateChanges, drop_old_tombstones
+
+logger = logging.getLogger(__name__)
+
+# Fields covered by keyword search, with the weight a match in that field adds to the rank
+INDEXED_FIELDS = {
+    "name": 5.0,
+    "role": 4.0,
+    "skills": 3.0,
+    "city": 2.0,
+    "country": 1.5,
+    "email": 1.5,
+    "notice_period": 1.0,
+}
+
+GRAM_SIZE = 3
+
+
+def _normalize(value) -> str:
+    """Lowercase a field value; lists (skills) are joined so each entry stays searchable."""
+    if value is None:
+        return ""
+    if isinstance(value, (list, tuple, set)):
+        return "\n".join(str(v).lower() for v in value if v is not None)
+    return str(value).lower()
+
+
+def _grams(text: str, size: int) -> Set[str]:
+    """All character n-grams of the given size in text (the whole text if it is shorter)."""
+    if len(text) <= size:
+        return {text} if text else set()
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class CandidateIndex:
+    """In-process inverted index of candidate fields keyed by character n-grams.
+
+    Postings map every bigram and trigram of the normalized field text to the
+    candidate IDs containing it. A query is answered by intersecting the posting
+    lists of its grams (smallest first) and verifying the survivors against the
+    stored field text, so the result matches the old substring semantics without
+    reading the collection.
+
+    A build fills a separate index without holding the lock and swaps it in;
+    writes made while it runs are recorded and replayed onto it, so searches
+    and writes are never blocked by the Firestore read.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._build_lock = threading.RLock()
+        self._postings: Dict[str, Set[str]] = {}
+        self._fields: Dict[str, Tuple[str, ...]] = {}
+        self._sold: Dict[str, bool] = {}
+        self._created_at: Dict[str, float] = {}
+        # Writes seen while a build is running, as (method, args)
+        self._pending: Optional[list] = None
+        self.ready = False
+        # Where refreshes continue from; set by the full build
+        self.changes: Optional[CandidateChanges] = None
+
+    def __len__(self):
+        return len(self._fields)
+
+    def _doc_grams(self, fields: Tuple[str, ...]) -> Set[str]:
+        grams = set()
+        for text in fields:
+            for part in text.split("\n"):
+                grams |= _grams(part, GRAM_SIZE - 1)
+                grams |= _grams(part, GRAM_SIZE)
+        return grams
+
+    def upsert(self, candidate_id: str, data: dict):
+        """Add or replace a candidate in the index."""
+        fields = tuple(_normalize(data.get(field)) for field in INDEXED_FIELDS)
+        created_at = data.get("created_at")
+        with self._lock:
+            self._record("upsert", candidate_id, data)
+            self._remove_postings(candidate_id)
+            self._fields[candidate_id] = fields
+            self._sold[candidate_id] = bool(data.get("sold", False))
+            self._created_at[candidate_id] = created_at.timestamp() if hasattr(created_at, "timestamp") else 0.0
+            for gram in self._doc_grams(fields):
+                self._postings.setdefault(gram, set()).add(candidate_id)
+
+    def upsert_many(self, items: Iterable[Tuple[str, dict]]):
+        """upsert() each (candidate_id, data) pair; for bulk writes, called off the event loop."""
+        for candidate_id, data in items:
+            self.upsert(candidate_id, data)
+
+    def set_sold(self, candidate_id: str, sold: bool = True):
+        """Record a change of sold status; sold candidates rank below unsold ones."""
+        with self._lock:
+            self._record("set_sold", candidate_id, sold)
+            if candidate_id in self._fields:
+                self._sold[candidate_id] = sold
+
+    def remove(self, candidate_id: str):
+        """Drop a candidate from the index."""
+        with self._lock:
+            self._record("remove", candidate_id)
+            self._remove_postings(candidate_id)
+            self._fields.pop(candidate_id, None)
+            self._sold.pop(candidate_id, None)
+            self._created_at.pop(candidate_id, None)
+
+    def _record(self, method: str, *args):
+        if self._pending is not None:
+            self._pending.append((method, args))
+
+    def _remove_postings(self, candidate_id: str):
+        fields = self._fields.get(candidate_id)
+        if fields is None:
+            return
+        for gram in self._doc_grams(fields):
+            posting = self._postings.get(gram)
+            if posting is not None:
+                posting.discard(candidate_id)
+                if not posting:
+                    del self._postings[gram]
+
+    def build(self, documents: Iterable[Tuple[str, dict]]):
+        """Replace the index contents with the given (candidate_id, data) pairs.
+
+        `documents` may be a Firestore stream; it is consumed without holding
+        the lock, and writes made meanwhile are replayed onto the result.
+        """
+        with self._build_lock:
+            with self._lock:
+                self._pending = []
+            try:
+                fresh = CandidateIndex()
+                fresh.upsert_many(documents)
+            except BaseException:
+                with self._lock:
+                    self._pending = None
+                raise
+            with self._lock:
+                for method, args in self._pending:
+                    getattr(fresh, method)(*args)
+                self._pending = None
+                self._postings, self._fields = fresh._postings, fresh._fields
+                self._sold, self._created_at = fresh._sold, fresh._created_at
+                self.ready = True
+
+    def _matching_ids(self, keyword: str) -> Set[str]:
+        if len(keyword) >= GRAM_SIZE:
+            grams = _grams(keyword, GRAM_SIZE)
+        elif len(keyword) == GRAM_SIZE - 1:
+            grams = {keyword}
+        else:
+            # Single character: union of every bigram posting that contains it
+            matched = set()
+            for gram, posting in self._postings.items():
+                if len(gram) == GRAM_SIZE - 1 and keyword in gram:
+                    matched |= posting
+            return matched
+
+        postings = []
+        for gram in grams:
+            posting = self._postings.get(gram)
+            if not posting:
+                return set()
+            postings.append(posting)
+        postings.sort(key=len)
+        matched = set(postings[0])
+        for posting in postings[1:]:
+            matched &= posting
+            if not matched:
+                break
+        return matched
+
+    def _score(self, candidate_id: str, keyword: str) -> float:
+        score = 0.0
+        for text, weight in zip(self._fields[candidate_id], INDEXED_FIELDS.values()):
+            if keyword not in text:
+                continue
+            tokens = text.replace("\n", " ").split()
+            if text == keyword or keyword in tokens:
+                score += weight * 3
+            elif any(token.startswith(keyword) for token in tokens):
+                score += weight * 2
+            else:
+                score += weight
+        return score
+
+    def search(self, keyword: str, limit: int = 20, offset: int = 0) -> Tuple[List[str], int]:
+        """Return one page of candidate IDs ranked by match quality, plus the total hit count.
+
+        Unsold candidates rank above sold ones, then higher field scores, then newer profiles.
+        """
+        keyword = keyword.strip().lower()
+        if not keyword:
+            return [], 0
+        with self._lock:
+            ranked = []
+            for candidate_id in self._matching_ids(keyword):
+                score = self._score(candidate_id, keyword)
+                if score > 0:
+                    ranked.append((self._sold[candidate_id], -score, -self._created_at[candidate_id], candidate_id))
+        ranked.sort()
+        return [item[3] for item in ranked[offset:offset + limit]], len(ranked)
+
+
+# Shared index instance for the candidate write paths and the search endpoint
+candidate_index = CandidateIndex()
+
+
+INDEX_FIELDS = list(INDEXED_FIELDS) + ["sold", "created_at"]
+
+
+def refresh_index(db, index: Optional[CandidateIndex] = None) -> CandidateIndex:
+    """(Re)build the index from Firestore, reading only the indexed fields."""
+    index = index if index is not None else candidate_index
+    changes = CandidateChanges(INDEX_FIELDS)
+    changes.mark()
+    docs = db.collection("candidates").select(INDEX_FIELDS).stream()
+    index.build((doc.id, doc.to_dict()) for doc in docs)
+    index.changes = changes
+    return index
+
+
+def apply_changes(db, index: Optional[CandidateIndex] = None) -> CandidateIndex:
+    """Bring a built index up to date with the candidates written or deleted since its last refresh."""
+    index = index if index is not None else candidate_index
+    with index._build_lock:
+        if index.changes is None or index.changes.stale():
+            return refresh_index(db, index)
+        changed, deleted = index.changes.poll(db)
+        index.upsert_many(changed)
+        for candidate_id in deleted:
+            index.remove(candidate_id)
+    return index
+
+
+def ensure_index_built(db, index: Optional[CandidateIndex] = None) -> CandidateIndex:
+    """Populate the index from Firestore on first use."""
+    index = index if index is not None else candidate_index
+    if index.ready:
+        return index
+    with index._build_lock:
+        if not index.ready:
+            refresh_index(db, index)
+    return index
+
+
+async def keep_index_fresh(db, interval: float, index: Optional[CandidateIndex] = None):
+    """Every `interval` seconds, apply other workers' candidate writes once this worker has built the index.
+
+    Each refresh reads only the candidates stamped or tombstoned since the
+    last one, not the collection. Searches never return deleted candidates,
+    which are dropped when their documents are fetched.
+    """
+    index = index if index is not None else candidate_index
+    while True:
+        await asyncio.sleep(interval)
+        if not index.ready:
+            continue
+        try:
+            await asyncio.to_thread(apply_changes, db, index)
+            await asyncio.to_thread(drop_old_tombstones, db)
+        except Exception:
+            logger.exception("Failed to refresh the candidate search index")
@@ -0,0 +1,22 @@
+from fastapi import APIRouter, FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+
+from settings import get_settings
+
+
+def add_cors(app: FastAPI):
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=get_settings().cors_origins,
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+def service_app(router: APIRouter, **kwargs) -> FastAPI:
+    """Standalone app for one service module; main.create_app() mounts them all instead."""
+    app = FastAPI(**kwargs)
+    add_cors(app)
+    app.include_router(router)
+    return app
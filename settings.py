@@ -0,0 +1,63 @@
+import multiprocessing
+import os
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import List, Optional
+
+from dotenv import load_dotenv
+
+
+def _list(name: str, default: str) -> List[str]:
+    return [item.strip() for item in os.getenv(name, default).split(",") if item.strip()]
+
+
+@dataclass(frozen=True)
+class Settings:
+    """Process-wide configuration, read once from the environment (and .env)."""
+
+    # Services historically used either variable name for the service account
+    firebase_credentials_path: Optional[str] = field(
+        default_factory=lambda: os.getenv("FIREBASE_CREDENTIALS_PATH") or os.getenv("CRED_PATH")
+    )
+    firebase_web_api_key: Optional[str] = field(default_factory=lambda: os.getenv("FIREBASE_WEB_API_KEY"))
+    openai_api_key: Optional[str] = field(default_factory=lambda: os.getenv("OPENAI_API_KEY"))
+    supabase_url: Optional[str] = field(default_factory=lambda: os.getenv("SUPABASE_URL"))
+    supabase_key: Optional[str] = field(default_factory=lambda: os.getenv("SUPABASE_KEY"))
+    stripe_secret_key: Optional[str] = field(default_factory=lambda: os.getenv("STRIPE_SECRET_KEY"))
+    stripe_webhook_secret: Optional[str] = field(default_factory=lambda: os.getenv("STRIPE_WEBHOOK_SECRET"))
+    domain: Optional[str] = field(default_factory=lambda: os.getenv("DOMAIN"))
+
+    cors_origins: List[str] = field(default_factory=lambda: _list("CORS_ORIGINS", "*"))
+    # Service modules mounted by main.create_app(); empty means all of them
+    services: List[str] = field(default_factory=lambda: _list("SERVICES", ""))
+
+    host: str = field(default_factory=lambda: os.getenv("HOST", "0.0.0.0"))
+    port: int = field(default_factory=lambda: int(os.getenv("PORT", "8000")))
+    # gunicorn workers; one per core suits async workers
+    workers: int = field(default_factory=lambda: int(os.getenv("WEB_CONCURRENCY", multiprocessing.cpu_count())))
+    # Seconds a worker serves /candidates/filter-options from memory before re-reading the catalog
+    facet_cache_ttl: float = field(default_factory=lambda: float(os.getenv("FACET_CACHE_TTL", "30")))
+    # Seconds between a worker's reads of other workers' candidate writes into its search index
+    search_index_refresh: float = field(default_factory=lambda: float(os.getenv("SEARCH_INDEX_REFRESH", "600")))
+    # Seconds between a worker's reads of other workers' candidate writes into its match engine
+    match_engine_refresh: float = field(default_factory=lambda: float(os.getenv("MATCH_ENGINE_REFRESH", "600")))
+    # Parsed resumes, keyed by file hash; the disk tier is shared by every worker pointed at the
+    # same directory. They are personal data, so without RESUME_CACHE_DIR they are only kept in memory.
+    resume_cache_dir: Optional[str] = field(default_factory=lambda: os.getenv("RESUME_CACHE_DIR") or None)
+    resume_cache_size: int = field(default_factory=lambda: int(os.getenv("RESUME_CACHE_SIZE", "256")))
+    resume_cache_max_mb: int = field(default_factory=lambda: int(os.getenv("RESUME_CACHE_MAX_MB", "512")))
+    resume_cache_max_age_days: float = field(
+        default_factory=lambda: float(os.getenv("RESUME_CACHE_MAX_AGE_DAYS", "7"))
+    )
+    # Per worker: processes parsing PDF/DOCX files, and OpenAI calls in flight, for batch extraction;
+    # 0 parse workers splits the cores between the gunicorn workers
+    resume_parse_workers: int = field(default_factory=lambda: int(os.getenv("RESUME_PARSE_WORKERS", "0")))
+    resume_llm_concurrency: int = field(default_factory=lambda: int(os.getenv("RESUME_LLM_CONCURRENCY", "8")))
+    # "openai", or "stub" to extract resumes offline with the rules alone
+    resume_llm: str = field(default_factory=lambda: os.getenv("RESUME_LLM", "openai"))
+
+
+@lru_cache
+def get_settings() -> Settings:
+    load_dotenv()
+    return Settings()
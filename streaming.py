@@ -0,0 +1,37 @@
+import json
+from typing import AsyncIterable, Iterable, Union
+
+from fastapi import Request
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def wants_ndjson(request: Request) -> bool:
+    """True when the client opted into streaming with Accept: application/x-ndjson."""
+    return NDJSON_MEDIA_TYPE in request.headers.get("accept", "")
+
+
+def _line(record: dict) -> str:
+    return json.dumps(jsonable_encoder(record)) + "\n"
+
+
+def ndjson_response(records: Union[Iterable[dict], AsyncIterable[dict]]) -> StreamingResponse:
+    """Stream records as newline-delimited JSON, one line per record.
+
+    records is consumed lazily (async iterables on the event loop, sync ones in
+    the threadpool), and each line is sent before the next record is pulled, so
+    a slow client throttles the Firestore stream instead of the worker
+    buffering the collection.
+    """
+    if hasattr(records, "__aiter__"):
+        async def lines():
+            async for record in records:
+                yield _line(record)
+    else:
+        def lines():
+            for record in records:
+                yield _line(record)
+
+    return StreamingResponse(lines(), media_type=NDJSON_MEDIA_TYPE)
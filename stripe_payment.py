@@ -1,41 +1,38 @@
-import os
-from datetime import datetime
+import asyncio
+from datetime import datetime, timezone
+from functools import lru_cache
+from types import SimpleNamespace
 
 import stripe
-import uvicorn
-from dotenv import load_dotenv
-from fastapi import FastAPI, Request, Header
-from fastapi.middleware.cors import CORSMiddleware
+from fastapi import APIRouter, Request, Header
 from pydantic import BaseModel
-from supabase import create_client
+from service import service_app
+from settings import get_settings
+from datastore import db
+from transaction_rollups import payment_recorded, record_payment
 
-# Load environment variables
-load_dotenv()
+settings = get_settings()
 
 # Initialize Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+SUPABASE_URL = settings.supabase_url
+SUPABASE_KEY = settings.supabase_key
 
-# Initialize Stripe
-domain = os.getenv("DOMAIN")
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
-STRIPE_WEBHOOK_SECRET = os.getenv("STRIPE_WEBHOOK_SECRET")
+@lru_cache
+def get_supabase():
+    """Supabase client, created when the first webhook is recorded."""
+    from supabase import create_client
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
 
-# Initialize FastAPI app
-app = FastAPI()
+# Initialize Stripe
+domain = settings.domain
+stripe.api_key = settings.stripe_secret_key
+STRIPE_WEBHOOK_SECRET = settings.stripe_webhook_secret
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+router = APIRouter()
 
-# Store Stripe customer ID in app state (for demo purposes)
-app.state.stripe_customer_id = None
+# Store Stripe customer ID in module state (for demo purposes); the router may
+# be mounted on the shared app, so it no longer lives on app.state
+state = SimpleNamespace(stripe_customer_id=None)
 
 # ---------------------------- MODELS ----------------------------
 
@@ -50,25 +47,25 @@ class ProductInfo(BaseModel):
 
 # ---------------------------- ROUTES ----------------------------
 
-@app.get("/success")
+@router.get("/success")
 async def success():
     return {"status": "success"}
 
-@app.get("/cancel")
+@router.get("/cancel")
 async def cancel():
     return {"status": "cancel"}
 
-@app.post("/create-checkout-session")
+@router.post("/create-checkout-session")
 async def create_checkout_session(product_info: ProductInfo):
     # Create customer once (demo purpose only)
-    if not app.state.stripe_customer_id:
+    if not state.stripe_customer_id:
         customer = stripe.Customer.create(description="Demo customer")
-        app.state.stripe_customer_id = customer["id"]
+        state.stripe_customer_id = customer["id"]
 
     unit_amount = int(product_info.product_price * 100)
 
     checkout_session = stripe.checkout.Session.create(
-        customer=app.state.stripe_customer_id,
+        customer=state.stripe_customer_id,
         success_url=domain+"/success?session_id={CHECKOUT_SESSION_ID}",
         cancel_url=domain+"/cancel",
         payment_method_types=["card"],
@@ -93,15 +90,15 @@ async def create_checkout_session(product_info: ProductInfo):
 
     return {"sessionId": checkout_session["id"], "url": checkout_session.url}
 
-@app.post("/create-portal-session")
+@router.post("/create-portal-session")
 async def create_portal_session():
     session = stripe.billing_portal.Session.create(
-        customer=app.state.stripe_customer_id,
+        customer=state.stripe_customer_id,
         return_url=domain
     )
     return {"url": session.url}
 
-@app.post("/webhook")
+@router.post("/webhook")
 async def webhook_received(request: Request, stripe_signature: str = Header(None)):
     data = await request.body()
 
@@ -120,7 +117,16 @@ async def webhook_received(request: Request, stripe_signature: str = Header(None
     if event_type == 'checkout.session.completed':
         return {"status": "checkout session completed"}
     elif event_type == 'payment_intent.succeeded':
-        handle_checkout_session(session)
+        # Stripe's event time, so retries and late deliveries land in the right bucket
+        paid_at = datetime.fromtimestamp(event['created'], timezone.utc)
+        # Store the transaction before counting it: if the insert fails, Stripe's retry stores it then
+        stored = await asyncio.to_thread(handle_checkout_session, session, event['id'], paid_at)
+        # The delivery that stored the row counts it; a redelivery only does when
+        # that one failed before counting, and the event marker keeps it to once
+        if not stored and await payment_recorded(db, event['id']):
+            return {"status": "duplicate event"}
+        if not await record_payment(db, event['id'], paid_at, int(session.get('amount_received', 0))):
+            return {"status": "duplicate event"}
         return {"status": "invoice paid"}
     elif event_type == 'invoice.payment_failed':
         return {"status": "invoice payment failed"}
@@ -129,7 +135,16 @@ async def webhook_received(request: Request, stripe_signature: str = Header(None
 
 # ---------------------------- UTILITY ----------------------------
 
-def handle_checkout_session(session):
+# transactions.event_id carries a unique constraint, so concurrent deliveries
+# of one event cannot both insert:
+#   alter table transactions add column event_id text unique;
+def handle_checkout_session(session, event_id: str, paid_at: datetime) -> bool:
+    """Insert the transaction row once per Stripe event; True if this call created it.
+
+    Blocking; the webhook runs it in a thread.
+    """
+    table = get_supabase().table("transactions")
+
     customer_email = session.get('customer_email')
     receipt_email = session.get('receipt_email')
     amount_total = session.get('amount_received', 0)
@@ -140,12 +155,23 @@ def handle_checkout_session(session):
         'email': customer_email or receipt_email,
         'product': product_name,
         'amount': amount,
-        'timestamp': str(datetime.now()),
+        'timestamp': paid_at.isoformat(),
+        'event_id': event_id,
     }
 
-    response = supabase.table("transactions").insert({"data": transaction_data}).execute()
+    result = table.upsert(
+        {"event_id": event_id, "data": transaction_data},
+        on_conflict="event_id",
+        ignore_duplicates=True,
+    ).execute()
+    # ON CONFLICT DO NOTHING returns no row for an event already stored
+    return bool(result.data)
 
 # ---------------------------- ENTRY POINT ----------------------------
 
+# Standalone app; main.py mounts the router alongside the other services
+app = service_app(router)
+
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,97 @@
+"""Concurrent purchases of one candidate against the Firestore emulator.
+
+Runs only when FIRESTORE_EMULATOR_HOST is set, e.g.:
+
+    gcloud emulators firestore start --host-port=localhost:8080
+    FIRESTORE_EMULATOR_HOST=localhost:8080 python -m pytest tests/test_candidate_selling_emulator.py
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime
+
+import pytest
+
+if not os.getenv("FIRESTORE_EMULATOR_HOST"):
+    pytest.skip("FIRESTORE_EMULATOR_HOST is not set", allow_module_level=True)
+
+firebase_admin = pytest.importorskip("firebase_admin")
+pytest.importorskip("fastapi")
+
+from fastapi import HTTPException  # noqa: E402
+from firebase_admin import credentials  # noqa: E402
+from google.auth.credentials import AnonymousCredentials  # noqa: E402
+
+BUYERS = 8
+CONNECTS = 10
+START_CONNECTS = 100
+
+
+class _EmulatorCredential(credentials.Base):
+    def get_credential(self):
+        return AnonymousCredentials()
+
+
+@pytest.fixture(scope="module", autouse=True)
+def emulator_app():
+    # Initialised before datastore would load the service-account certificate
+    if not firebase_admin._apps:
+        firebase_admin.initialize_app(_EmulatorCredential(), {"projectId": os.getenv("GCLOUD_PROJECT", "demo-test")})
+
+
+async def _race() -> dict:
+    from candidate_selling import SellRequest, sell_in_transaction
+    from datastore import db
+
+    run = uuid.uuid4().hex
+    seller_id, candidate_id = f"seller-{run}", f"candidate-{run}"
+    buyer_ids = [f"buyer-{run}-{n}" for n in range(BUYERS)]
+    for recruiter_id in [seller_id, *buyer_ids]:
+        await db.collection("recruiters").document(recruiter_id).set({"connects": START_CONNECTS, "num_of_deals": 0})
+    await db.collection("candidates").document(candidate_id).set({
+        "candidate_id": candidate_id, "name": "Race", "role": "Engineer", "city": "Pune",
+        "experience": 5, "ctc": 1200000, "sold": False, "created_at": datetime.utcnow(),
+    })
+
+    async def buy(buyer_id: str):
+        request = SellRequest(buyer_id=buyer_id, seller_id=seller_id, candidate_id=candidate_id, connects=CONNECTS)
+        return await sell_in_transaction(db.transaction(), request, datetime.utcnow())
+
+    results = await asyncio.gather(*(buy(buyer_id) for buyer_id in buyer_ids), return_exceptions=True)
+
+    recruiters = {
+        recruiter_id: (await db.collection("recruiters").document(recruiter_id).get()).to_dict()
+        for recruiter_id in [seller_id, *buyer_ids]
+    }
+    candidate = (await db.collection("candidates").document(candidate_id).get()).to_dict()
+    ledger = [doc.to_dict() async for doc in
+              db.collection("candidate_selling").where("candidate_id", "==", candidate_id).stream()]
+    return {"results": dict(zip(buyer_ids, results)), "seller_id": seller_id,
+            "recruiters": recruiters, "candidate": candidate, "ledger": ledger}
+
+
+def test_parallel_buys_sell_the_candidate_once():
+    race = asyncio.run(_race())
+
+    winners = [buyer for buyer, result in race["results"].items() if not isinstance(result, BaseException)]
+    assert len(winners) == 1, race["results"]
+    for buyer, result in race["results"].items():
+        if buyer in winners:
+            continue
+        # Losers see the sale, or give up after Firestore's transaction retries; neither may write
+        if isinstance(result, HTTPException):
+            assert result.status_code == 409
+        else:
+            assert "transaction" in str(result).lower() or "aborted" in str(result).lower(), result
+
+    winner = winners[0]
+    assert race["candidate"]["sold"] is True
+    assert race["candidate"]["purchased_by"] == winner
+    assert [row["buyer_id"] for row in race["ledger"]] == [winner]
+
+    recruiters = race["recruiters"]
+    assert recruiters[race["seller_id"]] == {"connects": START_CONNECTS + CONNECTS, "num_of_deals": 1}
+    assert recruiters[winner] == {"connects": START_CONNECTS - CONNECTS, "num_of_deals": 1}
+    for buyer in race["results"]:
+        if buyer != winner:
+            assert recruiters[buyer] == {"connects": START_CONNECTS, "num_of_deals": 0}
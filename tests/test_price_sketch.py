@@ -0,0 +1,90 @@
+import math
+import random
+
+import pytest
+
+from price_sketch import RELATIVE_ACCURACY, QuantileSketch, build_sketches, merge_sketches
+
+QUANTILES = [0, 0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99, 1]
+
+
+def exact_quantile(values, q):
+    """The value at rank q * (n - 1), the rank QuantileSketch.quantile answers for."""
+    ordered = sorted(values)
+    return ordered[math.floor(q * (len(ordered) - 1))]
+
+
+def assert_within_bound(sketch, values):
+    for q in QUANTILES:
+        exact = exact_quantile(values, q)
+        estimate = sketch.quantile(q)
+        assert abs(estimate - exact) <= RELATIVE_ACCURACY * abs(exact) + 1e-9, (q, exact, estimate)
+
+
+def sketch_of(values):
+    sketch = QuantileSketch()
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+DISTRIBUTIONS = {
+    # Sale prices spread over several orders of magnitude
+    "lognormal": lambda rng: [rng.lognormvariate(11, 1.5) for _ in range(20000)],
+    "uniform": lambda rng: [rng.uniform(1000, 5000) for _ in range(20000)],
+    # Rounded prices put many sales on the same value
+    "rounded": lambda rng: [round(rng.uniform(1, 50)) * 1000 for _ in range(20000)],
+    "with_zeros": lambda rng: [0.0] * 500 + [rng.expovariate(1 / 3000) for _ in range(5000)],
+    "tiny": lambda rng: [rng.uniform(0.001, 0.01) for _ in range(1000)],
+}
+
+
+@pytest.mark.parametrize("name", sorted(DISTRIBUTIONS))
+def test_quantiles_within_relative_error(name):
+    values = DISTRIBUTIONS[name](random.Random(name))
+    assert_within_bound(sketch_of(values), values)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 10])
+def test_small_samples(size):
+    values = [random.Random(size).uniform(100, 200) for _ in range(size)]
+    assert_within_bound(sketch_of(values), values)
+
+
+def test_extremes_count_and_mean_are_exact():
+    values = DISTRIBUTIONS["lognormal"](random.Random(1))
+    sketch = sketch_of(values)
+    assert sketch.quantile(0) == min(values)
+    assert sketch.quantile(1) == max(values)
+    assert sketch.count == len(values)
+    assert sketch.sum / sketch.count == pytest.approx(sum(values) / len(values))
+
+
+def test_empty_sketch():
+    assert QuantileSketch().quantile(0.5) is None
+
+
+def test_merged_shards_keep_the_bound():
+    rng = random.Random(7)
+    candidates = [
+        {"price": rng.lognormvariate(10, 1), "role": rng.choice(["Engineer", "Designer"]), "city": "Pune"}
+        for _ in range(10000)
+    ]
+    # Sales land on random shards; the merge must answer like one sketch of every sale
+    shards = [[] for _ in range(10)]
+    for candidate in candidates:
+        rng.choice(shards).append(candidate)
+    merged = merge_sketches(build_sketches(shard) for shard in shards)
+
+    assert_within_bound(merged["all"], [c["price"] for c in candidates])
+    for role in ("Engineer", "Designer"):
+        assert_within_bound(merged["role"][role], [c["price"] for c in candidates if c["role"] == role])
+    assert merged["city"]["Pune"].count == len(candidates)
+
+
+def test_document_round_trip():
+    values = DISTRIBUTIONS["with_zeros"](random.Random(3))
+    sketch = sketch_of(values)
+    restored = QuantileSketch.from_doc(sketch.to_doc())
+    for q in QUANTILES:
+        assert restored.quantile(q) == sketch.quantile(q)
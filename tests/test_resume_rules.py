@@ -0,0 +1,55 @@
+import pytest
+
+from resume_rules import CONFIDENCE_THRESHOLD, extract_fields
+
+
+@pytest.mark.parametrize("text", [
+    "01.2015 - 03.2019",
+    "Software Engineer, Acme 01/2015 – 03/2019",
+    "2012 - 2015 2015 - 2019",
+    "Phone: +91 98765 43210 | Acme 01.2015 - 03.2019",
+])
+def test_date_ranges_are_not_phone_numbers(text):
+    number = extract_fields(text).get("contact_number")
+    assert number is None or number[0] == "+919876543210"
+
+
+@pytest.mark.parametrize("text", [
+    "ID: 1234567890",
+    "Call me at +1 (415) 555-2671",
+])
+def test_unlabelled_numbers_are_only_a_guess(text):
+    _, confidence = extract_fields(text)["contact_number"]
+    assert confidence < CONFIDENCE_THRESHOLD
+
+
+@pytest.mark.parametrize("text, number", [
+    ("Phone: +91 98765 43210", "+919876543210"),
+    ("Mobile: 9876543210\nID: 1234567890", "9876543210"),
+    ("Contact: 020 7946 0958", "02079460958"),
+])
+def test_labelled_numbers_are_settled(text, number):
+    value, confidence = extract_fields(text)["contact_number"]
+    assert value == number
+    assert confidence >= CONFIDENCE_THRESHOLD
+
+
+def test_email_and_linkedin():
+    found = extract_fields("Jane.Doe@Example.com\nlinkedin.com/in/jane-doe/")
+    assert found["email"] == ("jane.doe@example.com", 0.98)
+    assert found["linkedin"] == ("https://www.linkedin.com/in/jane-doe", 0.95)
+
+
+@pytest.mark.parametrize("text, years", [
+    ("5+ years of experience", 5.0),
+    ("Total experience: 7.5 yrs", 7.5),
+    ("3 years of Python experience, 8 years of total experience", 8.0),
+])
+def test_experience(text, years):
+    assert extract_fields(text)["experience"][0] == years
+
+
+def test_skills_ignore_ordinary_words():
+    skills, confidence = extract_fields("Skills: Python, Node.js, CI/CD\nI like to go for a swift run")["skills"]
+    assert skills == ["Python", "Node.js", "CI/CD"]
+    assert confidence < CONFIDENCE_THRESHOLD
@@ -0,0 +1,254 @@
+"""Vectorised time bucketing for the dashboard series.
+
+Instants are epoch seconds (or datetime64) in UTC. They are shifted to the
+wall-clock time of the requested timezone, mapped to their period and counted
+(or summed) with one bincount. Empty periods come out as zeros and labels are
+built for the whole series at once, so the per-timestamp work never touches
+Python objects.
+
+Periods follow the dashboards' existing series: weeks start on Monday and are
+listed from the first Monday on or after the range start, quarters from the
+first quarter start on or after the start month.
+"""
+from datetime import datetime, timezone, tzinfo
+from typing import Dict, List, Optional, Union
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+import numpy as np
+
+HOURLY = "hourly"
+DAILY = "daily"
+WEEKLY = "weekly"
+MONTHLY = "monthly"
+QUARTERLY = "quarterly"
+YEARLY = "yearly"
+
+# datetime64 unit a frequency's periods are counted in, and periods per step
+_UNITS = {
+    HOURLY: ("h", 1),
+    DAILY: ("D", 1),
+    WEEKLY: ("D", 7),
+    MONTHLY: ("M", 1),
+    QUARTERLY: ("M", 3),
+    YEARLY: ("Y", 1),
+}
+
+FREQUENCIES = tuple(_UNITS)
+
+_MONTH_NAMES = np.array(["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+                         "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"])
+
+# 1970-01-01 was a Thursday; adding 3 makes Monday weekday 0
+_EPOCH_WEEKDAY_SHIFT = 3
+
+_SECONDS_PER_HOUR = 3600
+_SECONDS_PER_DAY = 86400
+_SECONDS_PER_QUARTER_HOUR = 900
+
+# Longest period per frequency; period starts can fall this far before the range start
+_PERIOD_SECONDS = {
+    HOURLY: _SECONDS_PER_HOUR,
+    DAILY: 86400,
+    WEEKLY: 7 * 86400,
+    MONTHLY: 31 * 86400,
+    QUARTERLY: 92 * 86400,
+    YEARLY: 366 * 86400,
+}
+
+# Stand-in second for missing instants; offsets can be added without overflow
+MISSING = np.iinfo(np.int64).min // 2
+
+TimeZone = Union[str, tzinfo, None]
+
+
+def resolve_tz(tz: TimeZone) -> Optional[tzinfo]:
+    """A tzinfo for an IANA name; None stands for UTC. Raises ValueError for unknown names."""
+    if tz is None or isinstance(tz, tzinfo):
+        return None if tz in (None, timezone.utc) else tz
+    if tz.upper() in ("UTC", "Z", "ETC/UTC"):
+        return None
+    try:
+        return ZoneInfo(tz)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"Unknown timezone: {tz}")
+
+
+def is_utc(tz: TimeZone) -> bool:
+    return resolve_tz(tz) is None
+
+
+def to_seconds(values) -> np.ndarray:
+    """UTC instants as int64 epoch seconds; accepts epoch seconds or datetime64.
+
+    Missing values (NaN, None, NaT) map to a second far before any range, so
+    they stay aligned with their values but are never counted.
+    """
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        seconds = values.astype("datetime64[s]").view(np.int64)
+        return np.where(np.isnat(values), MISSING, seconds)
+    values = np.array(values, dtype=np.float64)
+    missing = ~np.isfinite(values)
+    np.floor(values, out=values)
+    if missing.any():
+        values[missing] = MISSING
+    return values.astype(np.int64)
+
+
+def _epoch_seconds(moment: datetime) -> int:
+    # Naive datetimes are UTC, as everywhere else in the dashboards
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() // 1)
+
+
+class _Offsets:
+    """UTC offsets of a timezone, tabulated per hour over a window of instants.
+
+    Zones change offset on the hour, so one lookup per hour in the window
+    replaces a tzinfo call per timestamp.
+    """
+
+    def __init__(self, tz: tzinfo, first_second: int, last_second: int):
+        # A day of slack either side covers wall-clock values around the window's edges
+        self.first_hour = first_second // _SECONDS_PER_HOUR - 24
+        last_hour = last_second // _SECONDS_PER_HOUR + 24
+        self.seconds = np.array([
+            int(datetime.fromtimestamp(hour * _SECONDS_PER_HOUR, tz).utcoffset().total_seconds())
+            for hour in range(self.first_hour, last_hour + 1)
+        ], dtype=np.int64)
+
+    def at(self, seconds: np.ndarray) -> np.ndarray:
+        index = seconds // _SECONDS_PER_HOUR - self.first_hour
+        return self.seconds[np.clip(index, 0, len(self.seconds) - 1)]
+
+
+def period_starts(start_wall: np.datetime64, end_wall: np.datetime64, frequency: str) -> np.ndarray:
+    """Every period start listed for a wall-clock range, the last one containing its end."""
+    unit, step = _UNITS[frequency]
+    first = np.datetime64(start_wall, unit)
+    last = np.datetime64(end_wall, unit)
+    if frequency == WEEKLY:
+        weekday = (first.astype(np.int64) + _EPOCH_WEEKDAY_SHIFT) % 7
+        first = first + (7 - weekday) % 7
+    elif frequency == QUARTERLY:
+        first = first + (3 - first.astype(np.int64) % 3) % 3
+    if first > last:
+        return np.array([], dtype=f"datetime64[{unit}]")
+    return np.arange(first, last + 1, step)
+
+
+def period_labels(periods: np.ndarray, frequency: str) -> np.ndarray:
+    """Display labels for period starts, built for the whole array at once."""
+    if frequency == HOURLY:
+        text = np.datetime_as_string(periods, unit="h")
+        return np.char.add(np.char.replace(text, "T", " "), ":00")
+    if frequency == DAILY:
+        return np.datetime_as_string(periods, unit="D")
+    if frequency == WEEKLY:
+        first = np.datetime_as_string(periods, unit="D")
+        last = np.datetime_as_string(periods + 6, unit="D")
+        return np.char.add(np.char.add(first, " to "), last)
+
+    months = periods.astype("datetime64[M]").astype(np.int64)
+    years = (months // 12 + 1970).astype(str)
+    if frequency == MONTHLY:
+        return np.char.add(np.char.add(_MONTH_NAMES[months % 12], " "), years)
+    if frequency == QUARTERLY:
+        quarters = (months % 12 // 3 + 1).astype(str)
+        return np.char.add(np.char.add(np.char.add("Q", quarters), " "), years)
+    return years
+
+
+class Bucketer:
+    """Bins UTC instants into the periods of one range, frequency and timezone.
+
+    A small table maps each hour, day or (outside UTC) quarter hour of the
+    range to its period, so an instant costs one integer division and one
+    lookup into that table.
+    """
+
+    def __init__(self, start: datetime, end: datetime, frequency: str, tz: TimeZone = None):
+        if frequency not in _UNITS:
+            raise ValueError(f"Unknown frequency: {frequency}")
+        self.frequency = frequency
+        self.tz = resolve_tz(tz)
+        start_second, end_second = _epoch_seconds(start), _epoch_seconds(end)
+        self._offsets = None
+        if self.tz:
+            self._offsets = _Offsets(self.tz, start_second - _PERIOD_SECONDS[frequency], end_second)
+        bounds = self.to_wall(np.array([start_second, end_second], dtype=np.int64)).astype("datetime64[s]")
+        self.periods = period_starts(bounds[0], bounds[1], frequency)
+
+        unit, step = _UNITS[frequency]
+        edges = np.append(self.periods, self.periods[-1:] + step) if len(self.periods) \
+            else np.array([], dtype=f"datetime64[{unit}]")
+        self._edges = edges.astype("datetime64[s]").view(np.int64)
+
+        # Slot of every step of UTC time across the range, with a day of slack
+        # either side that maps to the before/after slots. Period boundaries
+        # fall on whole hours or days of wall-clock time, and UTC offsets are
+        # whole quarter hours, so an instant's step decides its period.
+        if self._offsets is not None:
+            self._step = _SECONDS_PER_QUARTER_HOUR
+        else:
+            self._step = _SECONDS_PER_HOUR if frequency == HOURLY else _SECONDS_PER_DAY
+        if len(self.periods):
+            self._first_step = (self._edges[0] - _SECONDS_PER_DAY) // self._step
+            last_step = (self._edges[-1] + _SECONDS_PER_DAY) // self._step
+            steps = np.arange(self._first_step, last_step + 1) * self._step
+            self._slots = np.searchsorted(self._edges, self.to_wall(steps), side="right")
+
+    def to_wall(self, seconds: np.ndarray) -> np.ndarray:
+        """UTC epoch seconds as wall-clock seconds in the bucketer's timezone."""
+        if self._offsets is None:
+            return seconds
+        return seconds + self._offsets.at(seconds)
+
+    def timestamps(self) -> np.ndarray:
+        """Epoch seconds at which each period starts."""
+        wall = self._edges[:-1]
+        if self._offsets is None:
+            return wall.astype(np.float64)
+        # Offset of the instant the wall-clock time maps to; a second pass settles DST edges
+        utc = wall - self._offsets.at(wall)
+        utc = wall - self._offsets.at(utc)
+        return utc.astype(np.float64)
+
+    def slots(self, seconds: np.ndarray) -> np.ndarray:
+        """Slot of each instant: 1..n for the n periods, 0 before the range and n + 1 after it."""
+        if not len(self.periods):
+            return np.zeros(len(seconds), dtype=np.int64)
+        steps = seconds // self._step
+        steps -= self._first_step
+        np.clip(steps, 0, len(self._slots) - 1, out=steps)
+        return self._slots[steps]
+
+    def totals(self, instants, values: Optional[Dict[str, np.ndarray]] = None) -> Dict[str, np.ndarray]:
+        """Per-period count of instants, or per-period sums of each value array aligned with them."""
+        slots = self.slots(to_seconds(instants))
+        size = len(self.periods) + 2
+        if not values:
+            return {"count": np.bincount(slots, minlength=size)[1:-1]}
+
+        sums = {}
+        for metric, column in values.items():
+            column = np.asarray(column)
+            summed = np.bincount(slots, weights=column, minlength=size)[1:-1]
+            sums[metric] = summed.astype(np.int64) if np.issubdtype(column.dtype, np.integer) else summed
+        return sums
+
+    def series(self, instants, values: Optional[Dict[str, np.ndarray]] = None) -> List[dict]:
+        """Dashboard series points: period label, metric totals and period start timestamp."""
+        totals = self.totals(instants, values)
+        columns = [period_labels(self.periods, self.frequency).tolist()]
+        columns += [column.tolist() for column in totals.values()]
+        columns.append(self.timestamps().tolist())
+        keys = ["period", *totals, "timestamp"]
+        return [dict(zip(keys, row)) for row in zip(*columns)]
+
+
+def series(instants, start: datetime, end: datetime, frequency: str, tz: TimeZone = None,
+           values: Optional[Dict[str, np.ndarray]] = None) -> List[dict]:
+    """Zero-filled series of `instants` (epoch seconds or datetime64) between start and end."""
+    return Bucketer(start, end, frequency, tz).series(instants, values)
@@ -0,0 +1,118 @@
+import sys
+from datetime import datetime
+from typing import Dict, Iterable, Tuple
+
+from rollups import DAY, HOUR, MONTH, add_to_metric_buckets, as_utc, bucket_id, bucket_start, \
+    read_metric_buckets, write_buckets
+
+# Hour/day/month buckets of completed payments: count and amount_cents
+TRANSACTION_ROLLUP_COLLECTION = "transaction_rollups"
+
+# One document per Stripe event already counted; Stripe retries webhooks
+PROCESSED_EVENTS_COLLECTION = "stripe_events"
+
+METRICS = ("count", "amount_cents")
+
+
+def to_cents(amount) -> int:
+    return int(round(float(amount or 0) * 100))
+
+
+async def payment_recorded(db, event_id: str) -> bool:
+    """True once record_payment has counted this Stripe event."""
+    doc = await db.collection(PROCESSED_EVENTS_COLLECTION).document(event_id).get()
+    return doc.exists
+
+
+async def record_payment(db, event_id: str, paid_at: datetime, amount_cents: int) -> bool:
+    """Count a payment in the transaction buckets exactly once per Stripe event.
+
+    The event marker is created in the same batch as the increments, so a
+    redelivered event fails the whole batch instead of counting twice.
+    Returns False for an event that was already recorded. Call it only after
+    the payment itself is stored, so a failed store is retried by Stripe.
+    """
+    from google.api_core.exceptions import AlreadyExists
+    batch = db.batch()
+    batch.create(db.collection(PROCESSED_EVENTS_COLLECTION).document(event_id), {
+        "paid_at": paid_at,
+        "amount_cents": amount_cents,
+    })
+    add_to_metric_buckets(db, batch, TRANSACTION_ROLLUP_COLLECTION, paid_at, {"count": 1, "amount_cents": amount_cents})
+    try:
+        await batch.commit()
+    except AlreadyExists:
+        return False
+    return True
+
+
+async def read_transaction_buckets(db, start: datetime, end: datetime, granularity: str):
+    return await read_metric_buckets(db, TRANSACTION_ROLLUP_COLLECTION, start, end, granularity, METRICS)
+
+
+def build_buckets(payments: Iterable[Tuple[datetime, int]]) -> Dict[str, dict]:
+    """Bucket documents for (paid_at, amount_cents) pairs."""
+    buckets: Dict[str, dict] = {}
+    for paid_at, amount_cents in payments:
+        for granularity in (HOUR, DAY, MONTH):
+            start = bucket_start(paid_at, granularity)
+            bucket = buckets.setdefault(bucket_id(start, granularity), {
+                "granularity": granularity, "start": start, "count": 0, "amount_cents": 0,
+            })
+            bucket["count"] += 1
+            bucket["amount_cents"] += amount_cents
+    return buckets
+
+
+def firestore_payments(sync_db):
+    """History from the Firestore transactions collection the dashboard used to scan."""
+    for doc in sync_db.collection("transactions").select(["timestamp", "amount"]).stream():
+        data = doc.to_dict()
+        if isinstance(data.get("timestamp"), datetime):
+            yield as_utc(data["timestamp"]), to_cents(data.get("amount"))
+
+
+def supabase_payments(page_size: int = 1000):
+    """History from the Supabase transactions table written by the Stripe webhook."""
+    from supabase import create_client
+    from settings import get_settings
+    settings = get_settings()
+    table = create_client(settings.supabase_url, settings.supabase_key).table("transactions")
+    offset = 0
+    while True:
+        rows = table.select("data").range(offset, offset + page_size - 1).execute().data
+        for row in rows:
+            data = row.get("data") or {}
+            try:
+                # Older rows hold str(datetime.now()) in server-local time, taken to be UTC;
+                # newer ones the event's ISO time with its offset
+                paid_at = as_utc(datetime.fromisoformat(data["timestamp"]))
+            except (KeyError, TypeError, ValueError):
+                continue
+            yield paid_at, to_cents(data.get("amount"))
+        if len(rows) < page_size:
+            return
+        offset += page_size
+
+
+def rebuild_transaction_rollups(sync_db, source: str = "firestore") -> int:
+    """Rebuild every transaction bucket from history; returns the buckets written.
+
+    Payments recorded by the webhook while this runs may be overwritten, so
+    run it before switching the webhook on or during a quiet period.
+    """
+    payments = supabase_payments() if source == "supabase" else firestore_payments(sync_db)
+    return write_buckets(sync_db, TRANSACTION_ROLLUP_COLLECTION, build_buckets(payments))
+
+
+if __name__ == "__main__":
+    # python transaction_rollups.py backfill [firestore|supabase]
+    command = sys.argv[1] if len(sys.argv) > 1 else "backfill"
+    if command == "backfill":
+        from datastore import sync_db
+        source = sys.argv[2] if len(sys.argv) > 2 else "firestore"
+        if source not in ("firestore", "supabase"):
+            sys.exit(f"Unknown source: {source}")
+        print(f"{rebuild_transaction_rollups(sync_db, source)} transaction buckets written")
+    else:
+        sys.exit(f"Unknown command: {command}")